@@ -0,0 +1,304 @@
+import asyncio
+import contextvars
+import copy
+import logging
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+import aiohttp
+
+import osu
+import ratelimit
+from cache import BeatmapCache, ProfileCache
+from metrics import Metrics
+
+logger = logging.getLogger('discord')
+
+AMEO_API_ENDPOINT = 'https://osutrack-api.ameo.dev/'
+OSU_API_ENDPOINT = 'https://osu.ppy.sh/api/'
+OSU_FILE_ENDPOINT = 'https://osu.ppy.sh/osu/'
+
+# total request timeouts (seconds) per endpoint, osu!track updates can take a while on their end
+ENDPOINT_TIMEOUTS: Mapping[str, float] = {
+    'get_user': 10,
+    'get_beatmaps': 10,
+    'get_user_best': 15,
+    'get_user_recent': 10,
+    'update': 30,
+    'osu': 20,
+}
+DEFAULT_TIMEOUT = 15
+# longest gap allowed between reads of a response, osu!track sometimes accepts the connection and then stalls
+ENDPOINT_READ_TIMEOUTS: Mapping[str, float] = {
+    'update': 15,
+}
+# only covers opening the connection, waiting for a free pooled connection counts against the total timeout
+CONNECT_TIMEOUT = 5
+
+# rate limit priority of requests made from the current task, background work (auto updates, cache refreshes)
+# sets this to ratelimit.BACKGROUND so interactive commands always go first
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar('request_priority', default=ratelimit.INTERACTIVE)
+
+
+class ApiError(Exception):
+    def __init__(self, endpoint: str, status: int, message: str = ''):
+        super().__init__(f'{endpoint} request failed with status {status} {message}'.strip())
+        self.endpoint = endpoint
+        self.status = status
+
+
+class ApiTimeout(ApiError):
+    pass
+
+
+class OsuApiClient:
+    '''
+        Async osu! api v1 and osu!track client. All requests share a single pooled aiohttp session
+        so connections (and TLS handshakes) are reused between calls.
+    '''
+
+    def __init__(
+        self,
+        apiKey: Optional[str],
+        connectionLimit: int = 20,
+        beatmapCache: Optional[BeatmapCache] = None,
+        profileCache: Optional[ProfileCache] = None,
+        limiter: Optional[ratelimit.TokenBucketLimiter] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.apiKey = apiKey
+        self.connectionLimit = connectionLimit
+        self.limiter = limiter
+        self.beatmapCache = beatmapCache
+        self.profileCache = profileCache
+        self._session: Optional[aiohttp.ClientSession] = None
+        # identical requests currently in flight, keyed by (url, normalized params). See `request`
+        self._inflight: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], 'asyncio.Future[Any]'] = {}
+        self.coalesced = 0
+        # (osuid, mode) profiles currently being refreshed in the background
+        self._refreshing: Set[Tuple[str, int]] = set()
+        self._refreshTasks: Set['asyncio.Future[None]'] = set()
+        # called with (profile, mode) for every profile fetched from the api
+        self.profileListeners: List[Callable[[osu.User, int], None]] = []
+        self.metrics = metrics or Metrics()
+        self.requestLatency = self.metrics.histogram(
+            'bonkers_api_request_seconds', 'osu! api/osu!track request latency (excluding rate limit waits)', ('endpoint',)
+        )
+        self.requestsTotal = self.metrics.counter(
+            'bonkers_api_requests_total', 'osu! api/osu!track requests by response status (0 = connection error)', ('endpoint', 'status')
+        )
+        self.rateLimitWait = self.metrics.histogram(
+            'bonkers_api_rate_limit_wait_seconds', 'Time requests spent waiting for the rate limiter', ('priority',)
+        )
+        self.metrics.counter('bonkers_api_coalesced_total', 'Requests served by an identical in flight request', callback=lambda: self.coalesced)
+
+    async def session(self) -> aiohttp.ClientSession:
+        # session has to be created inside a running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connectionLimit, keepalive_timeout=60),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, base: str, endpoint: str, params: Dict[str, Any]) -> Any:
+        '''
+            Single flight request: concurrent callers asking for the same endpoint and params share one http request
+            and all get its result (or its ApiError). Callers other than the first get their own copy of the response
+        '''
+        key = (f'{base}{endpoint}', tuple(sorted((k, str(v)) for k, v in params.items() if v is not None)))
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return copy.deepcopy(await asyncio.shield(inflight))
+        # the request runs in its own task so cancelling the first caller doesn't fail everyone else waiting on it
+        task = asyncio.ensure_future(self._request(base, endpoint, params))
+        self._inflight[key] = task
+
+        def done(task: 'asyncio.Future[Any]') -> None:
+            self._inflight.pop(key, None)
+            if not task.cancelled():
+                task.exception()  # marks the exception as retrieved even if every caller went away
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    async def acquire(self, endpoint: str) -> None:
+        # waits for a rate limit token, raises RateLimitExceeded if the request was shed
+        if not self.limiter:
+            return
+        priority = request_priority.get()
+        waited = await self.limiter.acquire(priority)
+        self.rateLimitWait.observe(waited, priority=ratelimit.PRIORITY_NAMES[priority])
+        if waited > 1:
+            logger.debug(f'{endpoint} request waited {waited:.2f}s for rate limit ({ratelimit.PRIORITY_NAMES[priority]})')
+
+    async def _request(self, base: str, endpoint: str, params: Dict[str, Any]) -> Any:
+        try:
+            await self.acquire(endpoint)
+        except ratelimit.RateLimitExceeded as e:
+            raise ApiError(endpoint, 429, str(e))
+        session = await self.session()
+        timeout = aiohttp.ClientTimeout(
+            total=ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT),
+            sock_connect=CONNECT_TIMEOUT,
+            sock_read=ENDPOINT_READ_TIMEOUTS.get(endpoint),
+        )
+        status = 0
+        start = time.perf_counter()
+        try:
+            async with session.post(f'{base}{endpoint}', params=params, timeout=timeout) as response:
+                status = response.status
+                if response.status != 200:
+                    raise ApiError(endpoint, response.status, await response.text())
+                return await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            status = 504
+            raise ApiTimeout(endpoint, 504, 'timed out')
+        except (aiohttp.ClientError, ValueError) as e:
+            raise ApiError(endpoint, 0, str(e))
+        finally:
+            self.requestLatency.observe(time.perf_counter() - start, endpoint=endpoint)
+            self.requestsTotal.inc(endpoint=endpoint, status=status)
+
+    async def osu_request(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        return await self.request(OSU_API_ENDPOINT, endpoint, {'k': self.apiKey, **params})
+
+    async def get_beatmap_file(self, beatmapid: str) -> Optional[str]:
+        # raw .osu file for a beatmap (not part of the api, but it comes out of the same request budget)
+        try:
+            await self.acquire('osu')
+        except ratelimit.RateLimitExceeded:
+            return None
+        session = await self.session()
+        timeout = aiohttp.ClientTimeout(total=ENDPOINT_TIMEOUTS['osu'], sock_connect=CONNECT_TIMEOUT)
+        status = 0
+        start = time.perf_counter()
+        try:
+            async with session.get(f'{OSU_FILE_ENDPOINT}{beatmapid}', timeout=timeout) as response:
+                status = response.status
+                if response.status != 200:
+                    return None
+                text = await response.text(encoding='utf-8', errors='replace')
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            status = 504 if isinstance(e, asyncio.TimeoutError) else 0
+            logger.warning(f'Failed to download beatmap file {beatmapid}: {e}')
+            return None
+        finally:
+            self.requestLatency.observe(time.perf_counter() - start, endpoint='osu')
+            self.requestsTotal.inc(endpoint='osu', status=status)
+        text = text.lstrip('\ufeff')
+        return text if text.startswith('osu file format') else None
+
+    async def get_user(self, u: str, mode: int = 0) -> Optional[osu.User]:
+        try:
+            user = osu.User.from_api((await self.osu_request('get_user', {'u': u, 'm': mode}))[0])
+        except (ApiError, IndexError, KeyError, TypeError, ValueError):
+            return None
+        if self.profileCache:
+            self.profileCache.put(user.user_id, mode, user)
+        for listener in self.profileListeners:
+            listener(user, mode)
+        return user
+
+    async def get_user_profiles(self, osuids: List[str], mode: int = 0, concurrency: int = 8) -> List[Optional[osu.User]]:
+        '''
+            Fetches profiles for many osu ids with at most `concurrency` requests in flight. Stale cached profiles
+            are returned immediately and refreshed in the background
+        '''
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(osuid: str) -> Optional[osu.User]:
+            async with semaphore:
+                return await self.get_user(osuid, mode)
+
+        profiles: List[Optional[osu.User]] = [None] * len(osuids)
+        missing: List[int] = []
+        for i, osuid in enumerate(osuids):
+            user, fresh = self.profileCache.get(osuid, mode) if self.profileCache else (None, False)
+            profiles[i] = user
+            if user is None:
+                missing.append(i)
+            elif not fresh:
+                self.refresh_user(osuid, mode)
+        fetched = await asyncio.gather(*(fetch(osuids[i]) for i in missing))
+        for i, user in zip(missing, fetched):
+            profiles[i] = user
+        return profiles
+
+    def refresh_user(self, osuid: str, mode: int = 0) -> None:
+        key = (str(osuid), mode)
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def refresh() -> None:
+            request_priority.set(ratelimit.BACKGROUND)
+            try:
+                await self.get_user(osuid, mode)
+            finally:
+                self._refreshing.discard(key)
+
+        task = asyncio.ensure_future(refresh())
+        self._refreshTasks.add(task)
+        task.add_done_callback(self._refreshTasks.discard)
+
+    async def get_beatmap(self, beatmapid: str, mods: int = 0) -> Optional[osu.Beatmap]:
+        # with `mods` the star rating comes from the api and the rest of the stats are adjusted locally
+        mods = osu.difficulty_mods(mods)
+        if self.beatmapCache:
+            beatmap = self.beatmapCache.get(beatmapid, mods)
+            if beatmap:
+                return beatmap
+        params = {'b': beatmapid, 'mods': mods} if mods else {'b': beatmapid}
+        try:
+            beatmap = osu.modded_beatmap(osu.Beatmap.from_api((await self.osu_request('get_beatmaps', params))[0]), mods)
+        except (ApiError, IndexError, KeyError, TypeError, ValueError):
+            return None
+        if self.beatmapCache:
+            self.beatmapCache.put(beatmap, mods)
+        return beatmap
+
+    async def get_top_scores(self, u: str, limit: int) -> Optional[List[osu.Score]]:
+        # None if the request failed, an empty list for users without top scores
+        try:
+            topScores = [osu.Score.from_api(score) for score in await self.osu_request('get_user_best', {'u': u, 'limit': limit})]
+            for i, score in enumerate(topScores):
+                score.ranking = i
+            return topScores
+        except (ApiError, TypeError, ValueError) as e:
+            logger.critical(f'get_user_best api call failed! {e}')
+            return None
+
+    async def get_recent_scores(self, u: str, limit: int, mode: int = 0) -> List[osu.Score]:
+        try:
+            return [osu.Score.from_api(score) for score in await self.osu_request('get_user_recent', {'u': u, 'limit': limit, 'm': mode})]
+        except (ApiError, TypeError, ValueError) as e:
+            logger.critical(f'get_user_recent api call failed! {e}')
+            return []
+
+    async def osutrack_update(self, osuid: str, mode: int = 0) -> osu.Update:
+        # raises ApiError so callers can tell bad requests (400) apart from osu!track being down
+        update = await self.request(AMEO_API_ENDPOINT, 'update', {'user': osuid, 'mode': mode})
+        try:
+            return {**update, 'newhs': [osu.Score.from_api(score) for score in update.get('newhs', [])]}
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ApiError('update', 0, f'invalid response: {e}')
+
+    async def attach_beatmaps(self, scores: List[osu.Score]) -> None:
+        '''
+            Fills in score.meta (adjusted for the score's mods) for every score missing it, fetching each distinct
+            (beatmap, difficulty mods) pair once concurrently
+        '''
+        missing = list({
+            (score.beatmap_id, osu.difficulty_mods(score.enabled_mods)) for score in scores if score.meta is None
+        })
+        beatmaps = await asyncio.gather(*(self.get_beatmap(beatmapid, mods) for beatmapid, mods in missing))
+        beatmapsByKey = dict(zip(missing, beatmaps))
+        for score in scores:
+            if score.meta is None:
+                score.meta = beatmapsByKey[(score.beatmap_id, osu.difficulty_mods(score.enabled_mods))]
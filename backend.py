@@ -1,6 +1,9 @@
+from abc import ABC, abstractmethod
 from json.decoder import JSONDecodeError
+import copy
 import logging
-from typing import Any, List, Dict, Final, Literal, Optional, TypedDict, Union, overload
+import sqlite3
+from typing import Any, List, Dict, Final, Iterable, Literal, Optional, Set, Tuple, TypedDict, Union, overload
 import os
 import json
 
@@ -36,6 +39,364 @@ class GuildData(TypedDict, total=False):
 GuildDataKey = Literal['osu_update_channel', 'prefix']
 
 
+class StorageEngine(ABC):
+    '''
+        Storage for user and guild records. `filename` (USER_DATA or GUILD_DATA) picks the collection, records
+        are plain UserData/GuildData dicts keyed by the stringified discord id
+    '''
+
+    @abstractmethod
+    def read_all(self, filename: FilenameType) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def read(self, filename: FilenameType, id: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def write(self, filename: FilenameType, id: str, data: Dict[str, Any], truncate: bool) -> None:
+        ...
+
+    @abstractmethod
+    def read_guild_prefix(self, gid: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def add_user_guild(self, uid: str, gid: int) -> None:
+        ...
+
+    @abstractmethod
+    def remove_user_guild(self, uid: str, gid: int) -> None:
+        ...
+
+    @abstractmethod
+    def read_guild_members(self, gid: int) -> Dict[str, str]:
+        # uid -> osuid for every user registered in the guild with an osu account set
+        ...
+
+
+class JsonStorage(StorageEngine):
+    '''
+        Original storage format, one json document per collection rewritten in full on every write.
+        Parsed documents are kept in memory and only re-read when the file mtime changes
+    '''
+
+    def __init__(self):
+        # filename -> (mtime the document was parsed from, parsed document)
+        self._documents: Dict[str, Tuple[Optional[int], Dict[str, Any]]] = {}
+        # guild id -> prefix, rebuilt whenever the guild document is (re)loaded or written so prefix lookups do no I/O
+        self._guildPrefixes: Dict[str, str] = {}
+        # guild id -> registered user ids, rebuilt when users.json is (re)loaded and kept up to date on writes
+        self._guildMembers: Dict[int, Set[str]] = {}
+
+    @staticmethod
+    def _file_mtime(filename: str) -> Optional[int]:
+        try:
+            return os.stat(filename).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _set_document(self, filename: str, mtime: Optional[int], allData: Dict[str, Any]) -> None:
+        self._documents[filename] = (mtime, allData)
+        if filename == GUILD_DATA:
+            self._guildPrefixes = {
+                gid: guildData['prefix'] for gid, guildData in allData.items() if guildData.get('prefix')
+            }
+        else:
+            self._guildMembers = {}
+            for uid, userData in allData.items():
+                for gid in userData.get('guilds', []):
+                    self._guildMembers.setdefault(gid, set()).add(uid)
+
+    def _index_user_guilds(self, uid: str, oldGuilds: Iterable[int], newGuilds: Iterable[int]) -> None:
+        for gid in set(oldGuilds) - set(newGuilds):
+            members = self._guildMembers.get(gid)
+            if members is not None:
+                members.discard(uid)
+                if not members:
+                    del self._guildMembers[gid]
+        for gid in newGuilds:
+            self._guildMembers.setdefault(gid, set()).add(uid)
+
+    def read_all(self, filename: FilenameType) -> Dict[str, Any]:
+        # returns the cached document, callers should treat it as read only
+        mtime = self._file_mtime(filename)
+        cached = self._documents.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        allData = load_json_document(filename)
+        self._set_document(filename, mtime, allData)
+        return allData
+
+    def read(self, filename: FilenameType, id: str) -> Dict[str, Any]:
+        return self.read_all(filename).get(id, {})
+
+    def write(self, filename: FilenameType, id: str, data: Dict[str, Any], truncate: bool) -> None:
+        allData = self.read_all(filename)
+        record = allData[id] if id in allData else {}
+        oldGuilds = list(record.get('guilds', []))
+        if truncate:
+            record = copy.deepcopy(data)
+        else:
+            record.update(copy.deepcopy(data))
+        allData[id] = record
+        # write to a temp file first so a crash mid write can't corrupt the data file
+        with open(f'{filename}.tmp', "w+") as fp:
+            json.dump(allData, fp, sort_keys=True, indent=4)
+        os.replace(f'{filename}.tmp', filename)
+        if filename == GUILD_DATA:
+            self._set_document(filename, self._file_mtime(filename), allData)
+        else:
+            self._documents[filename] = (self._file_mtime(filename), allData)
+            self._index_user_guilds(id, oldGuilds, record.get('guilds', []))
+
+    def read_guild_prefix(self, gid: str) -> Optional[str]:
+        # hot path (called for every message), served from memory without checking guilds.json for changes
+        if GUILD_DATA not in self._documents:
+            self.read_all(GUILD_DATA)
+        return self._guildPrefixes.get(gid)
+
+    def add_user_guild(self, uid: str, gid: int) -> None:
+        guilds = self.read(USER_DATA, uid).get('guilds', [])
+        if gid not in guilds:
+            self.write(USER_DATA, uid, {'guilds': [*guilds, gid]}, False)
+
+    def remove_user_guild(self, uid: str, gid: int) -> None:
+        guilds = self.read(USER_DATA, uid).get('guilds', [])
+        if gid in guilds:
+            self.write(USER_DATA, uid, {'guilds': [g for g in guilds if g != gid]}, False)
+
+    def read_guild_members(self, gid: int) -> Dict[str, str]:
+        allUserData = self.read_all(USER_DATA)
+        members = {}
+        for uid in self._guildMembers.get(gid, ()):
+            osuid = allUserData[uid].get('osuid')
+            if osuid:
+                members[uid] = osuid
+        return members
+
+
+USER_COLUMNS = ('osuid', 'bonks')
+GUILD_COLUMNS = ('osu_update_channel', 'osu_update_score_rank_cutoff', 'osu_update_score_pp_cutoff', 'prefix')
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key     TEXT PRIMARY KEY,
+    value   TEXT
+);
+CREATE TABLE IF NOT EXISTS users (
+    uid     TEXT PRIMARY KEY,
+    osuid   TEXT,
+    bonks   INTEGER
+);
+CREATE TABLE IF NOT EXISTS user_guilds (
+    uid     TEXT NOT NULL,
+    gid     INTEGER NOT NULL,
+    PRIMARY KEY (uid, gid)
+);
+CREATE INDEX IF NOT EXISTS user_guilds_gid ON user_guilds (gid);
+CREATE TABLE IF NOT EXISTS guilds (
+    gid                             TEXT PRIMARY KEY,
+    osu_update_channel              INTEGER,
+    osu_update_score_rank_cutoff    INTEGER,
+    osu_update_score_pp_cutoff      REAL,
+    prefix                          TEXT
+);
+'''
+
+
+def connect(path: str) -> sqlite3.Connection:
+    # autocommit mode, transactions are opened explicitly with `with transaction(conn)`
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    return conn
+
+
+class transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, excType, exc, tb) -> None:
+        self.conn.execute('ROLLBACK' if excType else 'COMMIT')
+
+
+class SqliteStorage(StorageEngine):
+    '''
+        SQLite (WAL mode) storage, every write is a single transaction touching only the affected rows
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = connect(path)
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._guildPrefixes: Dict[str, str] = {
+            row['gid']: row['prefix'] for row in self.conn.execute('SELECT gid, prefix FROM guilds WHERE prefix IS NOT NULL')
+        }
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    @staticmethod
+    def _user_record(row: sqlite3.Row, guilds: Iterable[int]) -> UserData:
+        record: Dict[str, Any] = {key: row[key] for key in USER_COLUMNS if row[key] is not None}
+        record['guilds'] = list(guilds)
+        return record  # type: ignore
+
+    @staticmethod
+    def _guild_record(row: sqlite3.Row) -> GuildData:
+        return {key: row[key] for key in GUILD_COLUMNS if row[key] is not None}  # type: ignore
+
+    def read_all(self, filename: FilenameType) -> Dict[str, Any]:
+        if filename == USER_DATA:
+            guilds: Dict[str, List[int]] = {}
+            for row in self.conn.execute('SELECT uid, gid FROM user_guilds'):
+                guilds.setdefault(row['uid'], []).append(row['gid'])
+            return {
+                row['uid']: self._user_record(row, guilds.get(row['uid'], []))
+                for row in self.conn.execute('SELECT * FROM users')
+            }
+        return {row['gid']: self._guild_record(row) for row in self.conn.execute('SELECT * FROM guilds')}
+
+    def read(self, filename: FilenameType, id: str) -> Dict[str, Any]:
+        if filename == USER_DATA:
+            row = self.conn.execute('SELECT * FROM users WHERE uid = ?', (id,)).fetchone()
+            if not row:
+                return {}
+            guilds = [guildRow['gid'] for guildRow in self.conn.execute('SELECT gid FROM user_guilds WHERE uid = ?', (id,))]
+            return self._user_record(row, guilds)  # type: ignore
+        row = self.conn.execute('SELECT * FROM guilds WHERE gid = ?', (id,)).fetchone()
+        return self._guild_record(row) if row else {}  # type: ignore
+
+    @staticmethod
+    def _upsert(conn: sqlite3.Connection, table: str, idColumn: str, id: str, values: Dict[str, Any]) -> None:
+        if not values:
+            conn.execute(f'INSERT OR IGNORE INTO {table} ({idColumn}) VALUES (?)', (id,))
+            return
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' for _ in values)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in values)
+        conn.execute(
+            f'INSERT INTO {table} ({idColumn}, {columns}) VALUES (?, {placeholders}) '
+            f'ON CONFLICT ({idColumn}) DO UPDATE SET {updates}',
+            (id, *values.values()),
+        )
+
+    def _write(self, conn: sqlite3.Connection, filename: FilenameType, id: str, data: Dict[str, Any], truncate: bool) -> None:
+        columns = USER_COLUMNS if filename == USER_DATA else GUILD_COLUMNS
+        unknown = set(data) - set(columns) - ({'guilds'} if filename == USER_DATA else set())
+        if unknown:
+            raise Exception(f'Unknown {filename} keys {unknown}')
+        values = {key: data[key] for key in columns if key in data}
+        if filename == USER_DATA:
+            if truncate:
+                conn.execute('DELETE FROM users WHERE uid = ?', (id,))
+            self._upsert(conn, 'users', 'uid', id, values)
+            if truncate or 'guilds' in data:
+                conn.execute('DELETE FROM user_guilds WHERE uid = ?', (id,))
+                conn.executemany(
+                    'INSERT OR IGNORE INTO user_guilds (uid, gid) VALUES (?, ?)',
+                    [(id, gid) for gid in data.get('guilds', [])],
+                )
+        else:
+            if truncate:
+                conn.execute('DELETE FROM guilds WHERE gid = ?', (id,))
+            self._upsert(conn, 'guilds', 'gid', id, values)
+
+    def write(self, filename: FilenameType, id: str, data: Dict[str, Any], truncate: bool) -> None:
+        with transaction(self.conn) as conn:
+            self._write(conn, filename, id, data, truncate)
+        if filename == GUILD_DATA and (truncate or 'prefix' in data):
+            if data.get('prefix'):
+                self._guildPrefixes[id] = data['prefix']
+            else:
+                self._guildPrefixes.pop(id, None)
+
+    def read_guild_prefix(self, gid: str) -> Optional[str]:
+        return self._guildPrefixes.get(gid)
+
+    def add_user_guild(self, uid: str, gid: int) -> None:
+        self.conn.execute('INSERT OR IGNORE INTO user_guilds (uid, gid) VALUES (?, ?)', (uid, gid))
+
+    def remove_user_guild(self, uid: str, gid: int) -> None:
+        self.conn.execute('DELETE FROM user_guilds WHERE uid = ? AND gid = ?', (uid, gid))
+
+    def read_guild_members(self, gid: int) -> Dict[str, str]:
+        return {
+            row['uid']: row['osuid'] for row in self.conn.execute(
+                'SELECT users.uid, users.osuid FROM user_guilds JOIN users ON users.uid = user_guilds.uid '
+                'WHERE user_guilds.gid = ? AND users.osuid IS NOT NULL',
+                (gid,),
+            )
+        }
+
+    def migrate_json(self, userFilename: str = USER_DATA, guildFilename: str = GUILD_DATA) -> None:
+        # one shot import of the old json documents, the json files are left in place as a backup
+        if self.get_meta('json_migrated'):
+            return
+        allUserData = load_json_document(userFilename)
+        allGuildData = load_json_document(guildFilename)
+        with transaction(self.conn) as conn:
+            for uid, userData in allUserData.items():
+                self._write(conn, USER_DATA, uid, userData, True)
+            for gid, guildData in allGuildData.items():
+                self._write(conn, GUILD_DATA, gid, guildData, True)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', '1')")
+        for gid, guildData in allGuildData.items():
+            if guildData.get('prefix'):
+                self._guildPrefixes[gid] = guildData['prefix']
+        logger.info(f'Migrated {len(allUserData)} users and {len(allGuildData)} guilds from json to {self.path}')
+
+
+def load_json_document(filename: str) -> Dict[str, Any]:
+    try:
+        with open(filename, 'r') as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except JSONDecodeError:
+        if os.path.getsize(filename):
+            with open(filename, 'r') as fp:
+                contents = fp.read()
+            logger.critical(f'Corrupted data for file {filename}! File contents: {contents}')
+        else:
+            logger.warning(f'File empty: {filename}')
+        return {}
+
+
+_storage: Optional[StorageEngine] = None
+
+
+def database_path() -> str:
+    return os.getenv('BONKERS_DB') or 'bonkers.db'
+
+
+def get_storage() -> StorageEngine:
+    # created lazily so envvars loaded by the bot (dotenv) are picked up.
+    # BONKERS_STORAGE=json keeps using users.json/guilds.json directly
+    global _storage
+    if _storage is None:
+        if os.getenv('BONKERS_STORAGE', 'sqlite') == 'json':
+            _storage = JsonStorage()
+        else:
+            sqliteStorage = SqliteStorage(database_path())
+            sqliteStorage.migrate_json()
+            _storage = sqliteStorage
+    return _storage
+
+
+def set_storage(storage: StorageEngine) -> None:
+    global _storage
+    _storage = storage
+
+
 @overload
 def read_all_data(filename: UserDataFilenameType) -> Dict[UserID, UserData]: ...
 
@@ -45,21 +406,7 @@ def read_all_data(filename: GuildDataFilenameType) -> Dict[GuildID, GuildData]:
 
 
 def read_all_data(filename: str) -> Union[Dict[UserID, UserData], Dict[GuildID, GuildData]]:
-    with open(filename, "a+") as fp:
-        try:
-            fp.seek(0)
-            allData = json.load(fp)
-        except JSONDecodeError as e:
-            if os.path.getsize(filename):
-                # issue with json file, dump contents and rewrite
-                fp.seek(0)
-                contents = fp.read()
-                logger.critical(f'Corrupted data for file {filename}! File contents: {contents}')
-            else:
-                logger.warning(logging.WARNING, f'File empty: {filename}')
-                pass
-            allData = {}
-    return allData
+    return get_storage().read_all(filename)  # type: ignore
 
 
 @overload
@@ -71,9 +418,9 @@ def read_data(filename: GuildDataFilenameType, *, id: GuildID, key: str) -> Any:
 
 
 def read_data(filename: FilenameType, *, id: Union[int, str], key: str):
-    allData = read_all_data(filename)
-    userData = allData[f'{id}'] if f'{id}' in allData else {}
-    return userData.get(key, None)
+    userData = get_storage().read(filename, f'{id}')
+    # copy so callers mutating e.g. a guilds list don't touch cached data
+    return copy.deepcopy(userData.get(key, None))
 
 
 @overload
@@ -96,6 +443,22 @@ def read_guild_data(gid: GuildID, key: GuildDataKey) -> Optional[str]:
     return read_data(GUILD_DATA, id=gid, key=key)
 
 
+def read_guild_prefix(gid: GuildID) -> Optional[str]:
+    return get_storage().read_guild_prefix(f'{gid}')
+
+
+def read_guild_members(gid: GuildID) -> Dict[str, str]:
+    return get_storage().read_guild_members(int(gid))
+
+
+def add_user_guild(uid: UserID, gid: GuildID) -> None:
+    get_storage().add_user_guild(f'{uid}', int(gid))
+
+
+def remove_user_guild(uid: UserID, gid: GuildID) -> None:
+    get_storage().remove_user_guild(f'{uid}', int(gid))
+
+
 @overload
 def write_data(filename: UserDataFilenameType, id: UserID, data: UserData, truncate: bool = False) -> None: ...
 
@@ -110,16 +473,7 @@ def write_data(
     data,
     truncate: bool = False
 ) -> None:
-    allData = read_all_data(filename)
-    userData: Union[UserData, GuildData] = allData[f'{id}'] if f'{id}' in allData else {}
-    if truncate:
-        userData = data
-    else:
-        userData.update(data)
-    # TODO: maybe fix this when PEP type support is expanded or maybe never
-    allData[f'{id}'] = userData  # type: ignore
-    with open(filename, "w+") as fp:
-        json.dump(allData, fp, sort_keys=True, indent=4)
+    get_storage().write(filename, f'{id}', data, truncate)
 
 
 def write_user_data(uid: UserID, data: UserData = {}, truncate: bool = False) -> None:
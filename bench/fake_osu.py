@@ -0,0 +1,391 @@
+'''
+    Local stand-in for the osu! api v1, .osu file downloads and the osu!track update endpoint, serving deterministic
+    synthetic users, top scores and beatmaps with configurable latency and error rates.
+
+    Runs in its own process (so serving requests doesn't eat into the bot's event loop):
+        python -m bench.fake_osu --users 1000 --latency 0.05 --error-rate 0.01
+    Point api.OSU_API_ENDPOINT at <url>/api/, api.OSU_FILE_ENDPOINT at <url>/osu/ and api.AMEO_API_ENDPOINT at
+    <url>/osutrack/. Control endpoints:
+        GET  /_stats        request counts per endpoint
+        POST /_reset        resets the request counts
+        POST /_tick?ratio=  gives `ratio` of all users a new top score dated now
+'''
+import argparse
+import asyncio
+import datetime as dt
+import json
+import random
+import socket
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+COUNTRIES = ('US', 'CA', 'KR', 'JP', 'DE', 'PL', 'GB', 'FR', 'AU', 'BR')
+RANKS = ('XH', 'X', 'SH', 'S', 'A', 'B')
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# base top scores are set at least this long ago so they never look new to the bot
+BASE_SCORE_AGE = 7 * 24 * 3600
+
+
+def format_date(timestamp: float) -> str:
+    return dt.datetime.utcfromtimestamp(timestamp).strftime(DATE_FORMAT)
+
+
+class FakeOsu:
+    def __init__(
+        self,
+        users: int = 1000,
+        beatmaps: int = 5000,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        errorRate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.users = users
+        self.beatmaps = beatmaps
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.seed = seed
+        self.started = time.time()
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.errors = 0
+        # new top scores per user (added by /_tick) and how many of them osu!track has reported already
+        self.newScores: Dict[int, List[Dict[str, Any]]] = {}
+        self.trackedScores: Dict[int, int] = {}
+        # (circles, sliders) per beatmap, looked up for every generated score
+        self.objectCounts = [(0, 0)] + [self.beatmap_counts(beatmapid)[1:] for beatmapid in range(1, beatmaps + 1)]
+
+    def user_index(self, u: Optional[str]) -> Optional[int]:
+        if not u:
+            return None
+        u = u.strip()
+        index = int(u) if u.isdigit() else int(u[4:]) if u.startswith('user') and u[4:].isdigit() else 0
+        return index if 1 <= index <= self.users else None
+
+    def user(self, index: int, mode: int = 0) -> Dict[str, Any]:
+        rng = random.Random(f'{self.seed}-user-{index}-{mode}')
+        rank = index * 37 + rng.randint(0, 36)
+        playcount = rng.randint(1000, 100000)
+        return {
+            'user_id': str(index),
+            'username': f'user{index}',
+            'join_date': format_date(self.started - rng.randint(30, 4000) * 86400),
+            'count300': str(playcount * 500),
+            'count100': str(playcount * 40),
+            'count50': str(playcount * 5),
+            'playcount': str(playcount),
+            'ranked_score': str(playcount * 1000000),
+            'total_score': str(playcount * 3000000),
+            'pp_rank': str(rank),
+            'level': f'{rng.uniform(50, 105):.5f}',
+            'pp_raw': f'{max(12000 - rank * 0.05, 0):.4f}',
+            'accuracy': f'{rng.uniform(90, 99.5):.8f}',
+            'count_rank_ss': str(rng.randint(0, 500)),
+            'count_rank_ssh': str(rng.randint(0, 500)),
+            'count_rank_s': str(rng.randint(0, 2000)),
+            'count_rank_sh': str(rng.randint(0, 2000)),
+            'count_rank_a': str(rng.randint(0, 3000)),
+            'country': rng.choice(COUNTRIES),
+            'total_seconds_played': str(playcount * 120),
+            'pp_country_rank': str(rank // 10 + 1),
+            'events': [],
+        }
+
+    def beatmap_counts(self, beatmapid: int):
+        rng = random.Random(f'{self.seed}-beatmap-{beatmapid}')
+        circles = rng.randint(150, 900)
+        sliders = rng.randint(50, 400)
+        return rng, circles, sliders
+
+    def score(self, index: int, rng: random.Random, pp: float, date: float) -> Dict[str, Any]:
+        beatmapid = rng.randint(1, self.beatmaps)
+        circles, sliders = self.objectCounts[beatmapid]
+        objects = circles + sliders + 1
+        misses = rng.choice((0, 0, 0, 1, 2))
+        n100 = rng.randint(0, objects // 20)
+        n50 = rng.randint(0, 3)
+        maxCombo = circles + 2 * sliders + 1
+        return {
+            'beatmap_id': str(beatmapid),
+            'score_id': str(index * 1000000 + rng.randint(0, 999999)),
+            'score': str(rng.randint(1000000, 100000000)),
+            'maxcombo': str(maxCombo if not misses else rng.randint(maxCombo // 4, maxCombo - 1)),
+            'count50': str(n50),
+            'count100': str(n100),
+            'count300': str(objects - misses - n100 - n50),
+            'countmiss': str(misses),
+            'countkatu': str(rng.randint(0, 50)),
+            'countgeki': str(rng.randint(0, 200)),
+            'perfect': '0' if misses else '1',
+            'enabled_mods': str(rng.choice((0, 0, 8, 16, 24, 64, 72, 88))),
+            'user_id': str(index),
+            'date': format_date(date),
+            'rank': 'A' if misses else rng.choice(RANKS[:4]),
+            'pp': f'{pp:.4f}',
+            'replay_available': str(rng.choice((0, 1))),
+        }
+
+    def top_scores(self, index: int, limit: int) -> List[Dict[str, Any]]:
+        rng = random.Random(self.seed * 1000003 + index)
+        best = max(12000 - index * 37 * 0.05, 100) / 20
+        scores = [
+            self.score(index, rng, best * 0.98 ** i, self.started - BASE_SCORE_AGE - rng.randint(0, 1000) * 86400)
+            for i in range(100)
+        ]
+        scores.extend(self.newScores.get(index, []))
+        scores.sort(key=lambda score: -float(score['pp']))
+        return scores[:limit]
+
+    def recent_scores(self, index: int, limit: int) -> List[Dict[str, Any]]:
+        rng = random.Random(f'{self.seed}-recent-{index}-{int(time.time() // 60)}')
+        scores = []
+        for i in range(limit):
+            score = self.score(index, rng, 0, time.time() - i * 300)
+            # recent plays don't come with pp
+            del score['pp']
+            if rng.random() < 0.2:
+                score['rank'] = 'F'
+            scores.append(score)
+        return scores
+
+    def beatmap(self, beatmapid: int, mods: int = 0) -> Dict[str, Any]:
+        rng, circles, sliders = self.beatmap_counts(beatmapid)
+        stars = rng.uniform(2, 8) * (1.4 if mods & 64 else 1) * (1.1 if mods & 16 else 1)
+        length = (circles + sliders * 2) * 250 // 1000
+        return {
+            'approved': str(rng.choice((1, 1, 1, 2, 4, 0, -2))),
+            'submit_date': format_date(self.started - rng.randint(100, 4000) * 86400),
+            'approved_date': format_date(self.started - rng.randint(1, 100) * 86400),
+            'artist': f'Artist {beatmapid % 997}',
+            'beatmap_id': str(beatmapid),
+            'beatmapset_id': str(beatmapid // 4 + 1),
+            'bpm': '180',
+            'creator': f'mapper{beatmapid % 313}',
+            'creator_id': str(beatmapid % 313 + 1),
+            'difficultyrating': f'{stars:.5f}',
+            'diff_aim': f'{stars / 2:.5f}',
+            'diff_speed': f'{stars / 2:.5f}',
+            'diff_size': str(rng.choice((3, 4, 4, 5))),
+            'diff_overall': str(rng.choice((7, 8, 8.5, 9))),
+            'diff_approach': str(rng.choice((8, 9, 9.3, 9.6, 10))),
+            'diff_drain': str(rng.choice((4, 5, 6))),
+            'hit_length': str(length),
+            'source': '',
+            'genre_id': '1',
+            'language_id': '1',
+            'title': f'Song {beatmapid}',
+            'total_length': str(length + 10),
+            'version': rng.choice(('Insane', 'Extra', 'Expert', 'Hard')),
+            'file_md5': f'{beatmapid:032x}',
+            'mode': '0',
+            'tags': '',
+            'favourite_count': str(rng.randint(0, 1000)),
+            'rating': '9.5',
+            'playcount': str(rng.randint(1000, 1000000)),
+            'passcount': str(rng.randint(100, 100000)),
+            'count_normal': str(circles),
+            'count_slider': str(sliders),
+            'count_spinner': '1',
+            'max_combo': str(circles + 2 * sliders + 1),
+            'storyboard': '0',
+            'video': '0',
+            'download_unavailable': '0',
+            'audio_unavailable': '0',
+        }
+
+    def beatmap_file(self, beatmapid: int) -> str:
+        # 1/2 beat apart circles and one beat sliders (2 combo each) at 180bpm, ending in a spinner
+        rng, circles, sliders = self.beatmap_counts(beatmapid)
+        meta = self.beatmap(beatmapid)
+        lines = [
+            'osu file format v14', '', '[General]', 'Mode: 0', '',
+            '[Metadata]', f'Title:{meta["title"]}', f'Artist:{meta["artist"]}', f'Creator:{meta["creator"]}',
+            f'Version:{meta["version"]}', f'BeatmapID:{beatmapid}', f'BeatmapSetID:{meta["beatmapset_id"]}', '',
+            '[Difficulty]', f'HPDrainRate:{meta["diff_drain"]}', f'CircleSize:{meta["diff_size"]}',
+            f'OverallDifficulty:{meta["diff_overall"]}', f'ApproachRate:{meta["diff_approach"]}',
+            'SliderMultiplier:1.4', 'SliderTickRate:1', '',
+            '[TimingPoints]', '1000,333.333333333333,4,2,0,100,1,0', '',
+            '[HitObjects]',
+        ]
+        objectTypes = [2] * sliders + [1] * circles
+        rng.shuffle(objectTypes)
+        time, x, y = 1000, 256, 192
+        for objectType in objectTypes:
+            x = min(max(x + rng.randint(-150, 150), 0), 512)
+            y = min(max(y + rng.randint(-120, 120), 0), 384)
+            if objectType == 2:
+                lines.append(f'{x},{y},{time},2,0,L|{min(x + 100, 512)}:{y},1,140')
+                time += 500
+            else:
+                lines.append(f'{x},{y},{time},1,0')
+                time += 167
+        lines.append(f'256,192,{time},12,0,{time + 2000}')
+        return '\n'.join(lines) + '\n'
+
+    def tick(self, ratio: float) -> int:
+        # gives a random `ratio` of users a new top score
+        now = time.time()
+        activeUsers = self.random.sample(range(1, self.users + 1), int(self.users * ratio))
+        for index in activeUsers:
+            scores = self.top_scores(index, 100)
+            rng = random.Random(f'{self.seed}-new-{index}-{now}')
+            pp = float(scores[0]['pp']) * rng.uniform(0.8, 1.05)
+            self.newScores.setdefault(index, []).append(self.score(index, rng, pp, now))
+        return len(activeUsers)
+
+    def track_update(self, index: int, mode: int) -> Dict[str, Any]:
+        user = self.user(index, mode)
+        first = index not in self.trackedScores
+        newScores = self.newScores.get(index, [])
+        newhs = newScores[self.trackedScores.get(index, 0):]
+        self.trackedScores[index] = len(newScores)
+        topScores = self.top_scores(index, 100)
+        rankings = {score['score_id']: i for i, score in enumerate(topScores)}
+        return {
+            'username': user['username'],
+            'mode': mode,
+            'playcount': 0,
+            'pp_rank': 0,
+            'pp_raw': 0,
+            'accuracy': 0,
+            'total_score': 0,
+            'ranked_score': 0,
+            'count300': 0,
+            'count50': 0,
+            'count100': 0,
+            'level': 0,
+            'count_rank_a': 0,
+            'count_rank_s': 0,
+            'count_rank_ss': 0,
+            'levelup': False,
+            'first': first,
+            'exists': True,
+            'newhs': [{**score, 'ranking': rankings.get(score['score_id'], -1)} for score in newhs],
+        }
+
+    async def respond(self, request: web.Request, endpoint: str) -> Optional[web.Response]:
+        # simulated latency and errors, returns the error response if this request fails
+        self.calls[endpoint] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(self.random.gauss(self.latency, self.jitter), 0))
+        if self.errorRate and self.random.random() < self.errorRate:
+            self.errors += 1
+            return web.Response(status=500, text='internal server error')
+        return None
+
+    def json(self, data: Any) -> web.Response:
+        return web.Response(text=json.dumps(data), content_type='application/json')
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        error = await self.respond(request, 'get_user')
+        if error is not None:
+            return error
+        index = self.user_index(request.query.get('u'))
+        return self.json([self.user(index, int(request.query.get('m', 0)))] if index else [])
+
+    async def get_user_best(self, request: web.Request) -> web.Response:
+        error = await self.respond(request, 'get_user_best')
+        if error is not None:
+            return error
+        index = self.user_index(request.query.get('u'))
+        return self.json(self.top_scores(index, min(int(request.query.get('limit', 10)), 100)) if index else [])
+
+    async def get_user_recent(self, request: web.Request) -> web.Response:
+        error = await self.respond(request, 'get_user_recent')
+        if error is not None:
+            return error
+        index = self.user_index(request.query.get('u'))
+        return self.json(self.recent_scores(index, min(int(request.query.get('limit', 10)), 50)) if index else [])
+
+    async def get_beatmaps(self, request: web.Request) -> web.Response:
+        error = await self.respond(request, 'get_beatmaps')
+        if error is not None:
+            return error
+        beatmapid = int(request.query.get('b', 0))
+        if not 1 <= beatmapid <= self.beatmaps:
+            return self.json([])
+        return self.json([self.beatmap(beatmapid, int(request.query.get('mods', 0)))])
+
+    async def get_beatmap_file(self, request: web.Request) -> web.Response:
+        error = await self.respond(request, 'osu')
+        if error is not None:
+            return error
+        beatmapid = int(request.match_info['beatmapid'])
+        if not 1 <= beatmapid <= self.beatmaps:
+            return web.Response(text='')
+        return web.Response(text=self.beatmap_file(beatmapid))
+
+    async def osutrack_update(self, request: web.Request) -> web.Response:
+        error = await self.respond(request, 'update')
+        if error is not None:
+            return error
+        index = self.user_index(request.query.get('user'))
+        if not index:
+            return web.Response(status=400, text='invalid user')
+        return self.json(self.track_update(index, int(request.query.get('mode', 0))))
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return self.json({'calls': dict(self.calls), 'errors': self.errors})
+
+    async def reset(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        self.errors = 0
+        return self.json({})
+
+    async def tick_handler(self, request: web.Request) -> web.Response:
+        return self.json({'active': self.tick(float(request.query.get('ratio', 0.05)))})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/api/get_user', self.get_user)
+        app.router.add_route('*', '/api/get_user_best', self.get_user_best)
+        app.router.add_route('*', '/api/get_user_recent', self.get_user_recent)
+        app.router.add_route('*', '/api/get_beatmaps', self.get_beatmaps)
+        app.router.add_get('/osu/{beatmapid}', self.get_beatmap_file)
+        app.router.add_route('*', '/osutrack/update', self.osutrack_update)
+        app.router.add_get('/_stats', self.stats)
+        app.router.add_post('/_reset', self.reset)
+        app.router.add_post('/_tick', self.tick_handler)
+        return app
+
+
+async def serve(fake: FakeOsu, host: str, port: int) -> None:
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    await web.SockSite(runner, sock).start()
+    # the bench reads the url from the first line of output
+    print(f'listening on http://{host}:{sock.getsockname()[1]}', flush=True)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await runner.cleanup()
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Fake osu! api/osu!track server for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--beatmaps', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05, help='mean response latency (seconds)')
+    parser.add_argument('--jitter', type=float, default=0.02, help='response latency standard deviation (seconds)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail with a 500')
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(args)
+    fake = FakeOsu(options.users, options.beatmaps, options.latency, options.jitter, options.error_rate, options.seed)
+    try:
+        asyncio.run(serve(fake, options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+'''
+    Load benchmark for auto updates and commands. Starts the fake osu!/osu!track server (bench/fake_osu.py) in a
+    separate process, registers synthetic users in a throwaway data directory and drives the bot's own code with
+    stub discord channels:
+        python -m bench.run --users 1000 --guilds 20 --json baseline.json
+        python -m bench.run --users 1000 --guilds 20 --baseline baseline.json
+
+    sweep scenarios report sweep duration, api calls per polled user and delivery drain time, the commands scenario
+    reports p50/p99 latency (until the first response is sent) and api calls per invocation for $lb, $tr and $rp.
+    Peak memory is the process' max RSS after each scenario.
+'''
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import aiohttp  # noqa: E402
+
+from bench.stubs import StubDiscord  # noqa: E402
+
+GUILD_ID_BASE = 100000000000000000
+CHANNEL_ID_BASE = 200000000000000000
+USER_ID_BASE = 300000000000000000
+
+Results = Dict[str, Dict[str, float]]
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class FakeServer:
+    def __init__(self, options: argparse.Namespace):
+        self.options = options
+        self.process: Optional[subprocess.Popen] = None
+        self.url = ''
+
+    def start(self) -> str:
+        self.process = subprocess.Popen(
+            [
+                sys.executable, '-m', 'bench.fake_osu',
+                '--users', str(self.options.users),
+                '--beatmaps', str(self.options.beatmaps),
+                '--latency', str(self.options.latency),
+                '--jitter', str(self.options.jitter),
+                '--error-rate', str(self.options.error_rate),
+                '--seed', str(self.options.seed),
+            ],
+            cwd=REPO_ROOT,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        line = self.process.stdout.readline().strip()  # type: ignore
+        if not line.startswith('listening on '):
+            self.stop()
+            raise Exception(f'Fake osu! server failed to start: {line}')
+        self.url = line[len('listening on '):]
+        return self.url
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    async def call(self, method: str, path: str, **params: Any) -> Any:
+        async with aiohttp.ClientSession() as session:
+            async with session.request(method, f'{self.url}{path}', params=params) as response:
+                return await response.json()
+
+    async def calls(self) -> Dict[str, int]:
+        return (await self.call('GET', '/_stats'))['calls']
+
+    async def reset(self) -> None:
+        await self.call('POST', '/_reset')
+
+    async def tick(self, ratio: float) -> int:
+        return (await self.call('POST', '/_tick', ratio=ratio))['active']
+
+
+def load_bot(url: str, directory: str, options: argparse.Namespace) -> ModuleType:
+    # bot.py configures itself from envvars and the working directory when it's imported
+    os.chdir(directory)
+    os.environ.update({
+        'DISCORD_TOKEN': 'bench',
+        'OSU_API_KEY': 'bench',
+        'BONKERS_STORAGE': 'sqlite',
+        'BONKERS_DB': os.path.join(directory, 'bonkers.db'),
+        'BEATMAP_DIR': os.path.join(directory, 'beatmaps'),
+        'OSU_API_RATE_LIMIT': str(options.rate_limit),
+        'SHARD_COUNT': str(options.shard_count),
+    })
+    if options.shard_ids:
+        os.environ['SHARD_IDS'] = options.shard_ids
+    else:
+        os.environ.pop('SHARD_IDS', None)
+    import api
+    api.OSU_API_ENDPOINT = f'{url}/api/'
+    api.OSU_FILE_ENDPOINT = f'{url}/osu/'
+    api.AMEO_API_ENDPOINT = f'{url}/osutrack/'
+    return importlib.import_module('bot')
+
+
+def guild_id(i: int) -> int:
+    # consecutive snowflakes (the shard comes from the timestamp bits) so guilds are spread over every shard
+    return GUILD_ID_BASE + (i << 22)
+
+
+def register_users(discord: StubDiscord, options: argparse.Namespace) -> Dict[int, List[int]]:
+    # every guild gets an update channel, users are spread round robin. Returns the registered uids per guild
+    import backend
+    members: Dict[int, List[int]] = {}
+    for i in range(options.guilds):
+        gid = guild_id(i)
+        guild = discord.add_guild(gid, shard_id=(gid >> 22) % options.shard_count)
+        channel = discord.add_channel(guild, CHANNEL_ID_BASE + i)
+        guildData: Dict[str, Any] = {'osu_update_channel': channel.id}
+        if i % 3 == 1:
+            guildData['osu_update_score_rank_cutoff'] = 50
+        elif i % 3 == 2:
+            guildData['osu_update_score_pp_cutoff'] = 200
+        backend.write_guild_data(gid, guildData)  # type: ignore
+        members[gid] = []
+    for i in range(options.users):
+        uid = USER_ID_BASE + i
+        backend.write_user_data(uid, {'osuid': str(i + 1)})
+        for k in range(min(options.guilds_per_user, options.guilds)):
+            gid = guild_id((i + k) % options.guilds)
+            backend.add_user_guild(uid, gid)
+            members[gid].append(uid)
+    return members
+
+
+def api_calls(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {endpoint: after.get(endpoint, 0) - before.get(endpoint, 0) for endpoint in after}
+
+
+def count_polls(bot: ModuleType) -> Dict[str, int]:
+    # wraps the per user auto update to count polls and failed polls (couldn't fetch top scores/profile)
+    counts = {'polls': 0, 'poll_failures': 0}
+    pollUser = bot.osu_auto_update_user
+
+    async def counted(*args: Any, **kwargs: Any) -> Optional[bool]:
+        counts['polls'] += 1
+        active = await pollUser(*args, **kwargs)
+        counts['poll_failures'] += active is None
+        return active
+
+    bot.osu_auto_update_user = counted
+    return counts
+
+
+async def run_sweep(
+    bot: ModuleType, server: FakeServer, discord: StubDiscord, pollCounts: Dict[str, int], options: argparse.Namespace
+) -> Dict[str, float]:
+    # every registered user is made due so each sweep polls everyone
+    bot.pollScheduler.sync([])
+    pollsBefore = dict(pollCounts)
+    callsBefore = await server.calls()
+    sentBefore, embedsBefore = discord.sent, discord.embeds
+    start = time.perf_counter()
+    await bot.osu_auto_update.coro()
+    duration = time.perf_counter() - start
+    drained = time.perf_counter()
+    if not options.no_delivery_wait:
+        await bot.deliveryQueue.join()
+    calls = api_calls(callsBefore, await server.calls())
+    polls = pollCounts['polls'] - pollsBefore['polls']
+    result = {
+        'duration_s': duration,
+        'delivery_drain_s': time.perf_counter() - drained,
+        'polls': polls,
+        'poll_failures': pollCounts['poll_failures'] - pollsBefore['poll_failures'],
+        'api_calls': sum(calls.values()),
+        'api_calls_per_user': sum(calls.values()) / (polls or 1),
+        'messages_sent': discord.sent - sentBefore,
+        'scores_posted': discord.embeds - embedsBefore,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    for endpoint, count in sorted(calls.items()):
+        result[f'{endpoint}_calls'] = count
+    return result
+
+
+async def run_command(command: Callable[..., Awaitable[Any]], ctx: Any, *args: Any, **kwargs: Any) -> Optional[float]:
+    # latency until the command's first response, whatever the command still has left to do after that is cancelled
+    task = asyncio.ensure_future(command(ctx, *args, **kwargs))
+    await asyncio.wait((task, ctx.responded), return_when=asyncio.FIRST_COMPLETED)
+    if not task.done():
+        task.cancel()
+    elif task.exception():
+        raise task.exception()  # type: ignore
+    return ctx.firstResponse
+
+
+async def run_commands(
+    bot: ModuleType, server: FakeServer, discord: StubDiscord, members: Dict[int, List[int]], options: argparse.Namespace
+) -> Results:
+    rng = random.Random(options.seed)
+    guilds = [gid for gid, uids in members.items() if uids]
+    commands = {
+        'lb': (bot.osu_leaderboard, (), {}),
+        'tr': (bot.osu_toprange, (1, 30), {}),
+        'rp': (bot.osu_recent, (1,), {}),
+    }
+    results: Results = {}
+    semaphore = asyncio.Semaphore(options.concurrency)
+    for name, (command, args, kwargs) in commands.items():
+        latencies: List[float] = []
+        errors = 0
+
+        async def invoke() -> None:
+            nonlocal errors
+            gid = rng.choice(guilds)
+            ctx = discord.context(bot.bot, gid, rng.choice(members[gid]))
+            async with semaphore:
+                try:
+                    latency = await run_command(command, ctx, *args, **kwargs)
+                except Exception:
+                    latency = None
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency)
+
+        callsBefore = await server.calls()
+        start = time.perf_counter()
+        await asyncio.gather(*(invoke() for _ in range(options.runs)))
+        duration = time.perf_counter() - start
+        calls = api_calls(callsBefore, await server.calls())
+        results[f'command {name}'] = {
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': max(latencies, default=0) * 1000,
+            'throughput_per_s': options.runs / duration if duration else 0,
+            'api_calls_per_invocation': sum(calls.values()) / options.runs,
+            'errors': errors,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    return results
+
+
+async def run(options: argparse.Namespace) -> Results:
+    server = FakeServer(options)
+    url = server.start()
+    results: Results = {}
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory(prefix='bonkers-bench-') as directory:
+            bot = load_bot(url, directory, options)
+            discord = StubDiscord(channelLatency=options.channel_latency)
+            discord.install(bot.bot)
+            pollCounts = count_polls(bot)
+            start = time.perf_counter()
+            members = register_users(discord, options)
+            results['setup'] = {'register_s': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+            await server.reset()
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                if 'sweep' in options.scenarios:
+                    results['sweep cold'] = await run_sweep(bot, server, discord, pollCounts, options)
+                    for i in range(options.sweeps):
+                        await server.tick(options.active_ratio)
+                        results[f'sweep warm {i + 1}'] = await run_sweep(bot, server, discord, pollCounts, options)
+                if 'commands' in options.scenarios:
+                    results.update(await run_commands(bot, server, discord, members, options))
+            await bot.osuApi.close()
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        server.stop()
+    return results
+
+
+def report(results: Results, baseline: Optional[Results]) -> None:
+    for scenario, metrics in results.items():
+        print(scenario)
+        for metric, value in metrics.items():
+            line = f'  {metric:<28}{value:>14.3f}'
+            previous = (baseline or {}).get(scenario, {}).get(metric)
+            if previous is not None:
+                change = f'{(value - previous) / previous * 100:+.1f}%' if previous else 'n/a'
+                line += f'{previous:>14.3f}  {change}'
+            print(line)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='BonkersBot auto update/command load benchmark')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--guilds-per-user', type=int, default=1)
+    parser.add_argument('--beatmaps', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05, help='mean fake api latency (seconds)')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--channel-latency', type=float, default=0.0, help='stub discord send latency (seconds)')
+    parser.add_argument(
+        '--rate-limit', type=float, default=1000000,
+        help='osu! api requests per minute, defaults to effectively unlimited to measure the bot itself'
+    )
+    parser.add_argument('--shard-count', type=int, default=1)
+    parser.add_argument('--shard-ids', help='comma separated shards the benchmarked process runs (default all)')
+    parser.add_argument('--scenarios', default='sweep,commands')
+    parser.add_argument('--sweeps', type=int, default=2, help='warm sweeps to run after the cold one')
+    parser.add_argument('--active-ratio', type=float, default=0.05, help='fraction of users with a new top score per warm sweep')
+    parser.add_argument('--runs', type=int, default=200, help='invocations per command')
+    parser.add_argument('--concurrency', type=int, default=10, help='concurrent command invocations')
+    parser.add_argument('--no-delivery-wait', action='store_true', help="don't wait for sweep deliveries to be sent")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    options = parser.parse_args(args)
+    options.scenarios = set(options.scenarios.split(','))
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as fp:
+            baseline = json.load(fp)['results']
+    results = asyncio.run(run(options))
+    report(results, baseline)
+    if options.json:
+        with open(options.json, 'w') as fp:
+            json.dump({'options': {**vars(options), 'scenarios': sorted(options.scenarios)}, 'results': results}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
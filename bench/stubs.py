@@ -0,0 +1,158 @@
+'''
+    Minimal stand-ins for the discord objects the bot touches (channels, messages, guilds, members and command
+    contexts) so commands and auto updates can run without a gateway connection. Sends are recorded instead of
+    going anywhere.
+'''
+import asyncio
+import itertools
+import time
+from typing import Any, Dict, List, Optional
+
+from discord.enums import ChannelType
+
+_ids = itertools.count(900000000000000000)
+
+
+class StubUser:
+    def __init__(self, id: int, name: str = ''):
+        self.id = id
+        self.name = name or f'member{id}'
+        self.bot = False
+        self.mention = f'<@{id}>'
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, StubUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+
+class StubMessage:
+    def __init__(self, channel: 'StubChannel', content: Optional[str], embed: Any):
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.embed = embed
+        self.reactions: List[str] = []
+
+    async def add_reaction(self, emoji: Any) -> None:
+        self.reactions.append(str(emoji))
+
+    async def remove_reaction(self, emoji: Any, member: Any) -> None:
+        pass
+
+    async def clear_reaction(self, emoji: Any) -> None:
+        self.reactions = [reaction for reaction in self.reactions if reaction != str(emoji)]
+
+    async def clear_reactions(self) -> None:
+        self.reactions.clear()
+
+    async def edit(self, *, content: Optional[str] = None, embed: Any = None, **kwargs: Any) -> None:
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+
+
+class StubChannel:
+    type = ChannelType.text
+
+    def __init__(self, id: int, guild: Optional['StubGuild'] = None, latency: float = 0.0, keep: int = 0):
+        self.id = id
+        self.guild = guild
+        self.name = f'channel{id}'
+        self.latency = latency
+        # only the last `keep` messages are kept around, counts are always tracked
+        self.keep = keep
+        self.messages: List[StubMessage] = []
+        self.sent = 0
+        self.embeds = 0
+
+    async def send(self, content: Optional[str] = None, *, embed: Any = None, **kwargs: Any) -> StubMessage:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message = StubMessage(self, content, embed)
+        self.sent += 1
+        self.embeds += embed is not None
+        if self.keep:
+            self.messages.append(message)
+            del self.messages[:-self.keep]
+        return message
+
+
+class StubGuild:
+    def __init__(self, id: int, name: str = '', shard_id: int = 0):
+        self.id = id
+        self.name = name or f'guild{id}'
+        self.icon_url = ''
+        self.shard_id = shard_id
+        self.channels: List[StubChannel] = []
+        self.members: Dict[int, StubUser] = {}
+
+
+class StubContext:
+    '''
+        Command context recording when the command first responded
+    '''
+
+    def __init__(self, bot: Any, guild: StubGuild, channel: StubChannel, author: StubUser):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.message = StubMessage(channel, '', None)
+        self.message.author = author  # type: ignore
+        self.created = time.perf_counter()
+        self.firstResponse: Optional[float] = None
+        self.responded = asyncio.get_event_loop().create_future()
+
+    async def send(self, content: Optional[str] = None, *, embed: Any = None, **kwargs: Any) -> StubMessage:
+        message = await self.channel.send(content, embed=embed, **kwargs)
+        if self.firstResponse is None:
+            self.firstResponse = time.perf_counter() - self.created
+            self.responded.set_result(None)
+        return message
+
+
+class StubDiscord:
+    '''
+        Guilds and channels the bot can see. `install` points the bot's channel/guild lookups at the stubs
+    '''
+
+    def __init__(self, channelLatency: float = 0.0):
+        self.channelLatency = channelLatency
+        self.guilds: Dict[int, StubGuild] = {}
+        self.channels: Dict[int, StubChannel] = {}
+
+    def add_guild(self, gid: int, shard_id: int = 0) -> StubGuild:
+        guild = self.guilds[gid] = StubGuild(gid, shard_id=shard_id)
+        return guild
+
+    def add_channel(self, guild: StubGuild, cid: int) -> StubChannel:
+        channel = self.channels[cid] = StubChannel(cid, guild, self.channelLatency)
+        guild.channels.append(channel)
+        return channel
+
+    def get_channel(self, cid: int) -> Optional[StubChannel]:
+        return self.channels.get(int(cid))
+
+    def get_guild(self, gid: int) -> Optional[StubGuild]:
+        return self.guilds.get(int(gid))
+
+    def context(self, bot: Any, gid: int, uid: int) -> StubContext:
+        guild = self.guilds[gid]
+        author = guild.members.setdefault(uid, StubUser(uid))
+        return StubContext(bot, guild, guild.channels[0], author)
+
+    def install(self, bot: Any) -> None:
+        bot.get_channel = self.get_channel
+        bot.get_guild = self.get_guild
+
+    @property
+    def sent(self) -> int:
+        return sum(channel.sent for channel in self.channels.values())
+
+    @property
+    def embeds(self) -> int:
+        return sum(channel.embeds for channel in self.channels.values())
@@ -5,12 +5,12 @@ import logging
 import os
 import random
 import time
-from typing import List, Mapping, Optional, Union, cast
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple, Union, cast
 import locale
 from utils import chunk
 
 from flag import flag
-import requests
+from aiohttp import web
 from discord import Color, Embed, Emoji, Message
 from discord.activity import Game
 from discord.channel import TextChannel
@@ -21,7 +21,22 @@ from dotenv import load_dotenv
 from humanize import naturaltime
 
 import osu
+import api
 import backend
+from cache import BeatmapCache, LRUCache, ProfileCache
+from delivery import DeliveryQueue
+from metrics import SWEEP_BUCKETS, Metrics, serve_metrics
+from osutrack import CircuitOpen, OsuTrackClient
+from leaderboards import LEADERBOARD_ORDERINGS, GuildLeaderboards
+from paginator import Paginators
+from planner import DeliveryPlan, DeliveryPlanner
+from pollqueue import DetectedScores, PolledScores, ScoreQueue, detect_new_scores
+from ppcalc import LocalCalculator
+from ratelimit import BACKGROUND, PRIORITY_NAMES, TokenBucketLimiter
+from scheduler import PollScheduler
+from timers import DeferredActions
+from snapshots import TopScoreSnapshots
+from history import ScoreHistory
 from honk import get_honk
 
 logger = logging.getLogger('discord')
@@ -38,9 +53,39 @@ load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 OSU_API_KEY = os.getenv('OSU_API_KEY')
 DEFAULT_PREFIX = os.getenv('DEFAULT_PREFIX') or '$'
-
-AMEO_API_ENDPOINT = 'https://osutrack-api.ameo.dev/'
-OSU_API_ENDPOINT = 'https://osu.ppy.sh/api/'
+PROFILE_CACHE_TTL = float(os.getenv('PROFILE_CACHE_TTL') or 60)
+PROFILE_CACHE_STALE_TTL = float(os.getenv('PROFILE_CACHE_STALE_TTL') or 1800)
+SCORE_EMBED_CACHE_SIZE = int(os.getenv('SCORE_EMBED_CACHE_SIZE') or 1024)
+OSUTRACK_CACHE_TTL = float(os.getenv('OSUTRACK_CACHE_TTL') or 60)
+LEADERBOARD_FANOUT = int(os.getenv('LEADERBOARD_FANOUT') or 8)
+# auto update checks for due users every AUTO_UPDATE_TICK seconds, each user's poll interval adapts between
+# AUTO_UPDATE_MIN_INTERVAL (right after a new top score) and AUTO_UPDATE_MAX_INTERVAL (long idle)
+AUTO_UPDATE_TICK = float(os.getenv('AUTO_UPDATE_TICK') or 30)
+AUTO_UPDATE_MIN_INTERVAL = float(os.getenv('AUTO_UPDATE_MIN_INTERVAL') or 180)
+AUTO_UPDATE_MAX_INTERVAL = float(os.getenv('AUTO_UPDATE_MAX_INTERVAL') or 3600)
+# local: this process polls its users. workers: separate poller processes (poller.py) poll and this process only
+# delivers what they queue, checked every POLLED_SCORES_TICK seconds
+AUTO_UPDATE_MODE = os.getenv('AUTO_UPDATE_MODE') or 'local'
+POLLED_SCORES_TICK = float(os.getenv('POLLED_SCORES_TICK') or 5)
+# shared osu! api budget, background requests leave OSU_API_RESERVE requests for commands and are dropped
+# (retried next poll) if they'd have to wait longer than OSU_API_MAX_BACKGROUND_WAIT seconds. With
+# AUTO_UPDATE_MODE=workers the pollers get POLLER_API_SHARE of it (see poller.py) and this process the rest
+OSU_API_RATE_LIMIT = float(os.getenv('OSU_API_RATE_LIMIT') or 120)
+POLLER_API_SHARE = float(os.getenv('POLLER_API_SHARE') or 0.5)
+OSU_API_BURST = float(os.getenv('OSU_API_BURST') or 30)
+OSU_API_RESERVE = float(os.getenv('OSU_API_RESERVE') or 5)
+OSU_API_MAX_BACKGROUND_WAIT = float(os.getenv('OSU_API_MAX_BACKGROUND_WAIT') or 30)
+# .osu files used to calculate star ratings/pp locally, missing ones are downloaded in the background
+BEATMAP_DIR = os.getenv('BEATMAP_DIR') or 'beatmaps'
+# prometheus text metrics are served at http://METRICS_HOST:METRICS_PORT/metrics, METRICS_PORT=0 turns this off
+METRICS_HOST = os.getenv('METRICS_HOST') or '127.0.0.1'
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 9464)
+# sharding: SHARD_COUNT total shards (default: discord's recommendation), SHARD_IDS the comma separated shards this
+# process runs (default: all of them). Auto updates only cover guilds on this process' shards
+SHARD_COUNT = int(os.getenv('SHARD_COUNT') or 0) or None
+SHARD_IDS = [int(shardId) for shardId in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+if SHARD_IDS is not None and SHARD_COUNT is None:
+    raise Exception('SHARD_IDS requires SHARD_COUNT to be set')
 
 EMBED_COLOR = Color.from_rgb(255, 165, 0)
 KEKW_EMOTE = '<:KEKW:805177941814018068>'
@@ -58,6 +103,11 @@ OSU_SCORE_EMOJI_MAP: Mapping[osu.ScoreRank, str] = {
     'D': '<:osuD:873655369698783262>',
     'F': f'ℱ {KEKW_EMOTE}',
 }
+# stats the leaderboard rows don't already show, added when sorting by them
+LEADERBOARD_EXTRA_STATS = {
+    'acc': lambda user: f' | {user.accuracy:.2f}%',
+    'playcount': lambda user: f' | {user.playcount:n} plays',
+}
 OSU_HIT_EMOJI_MAP = {
     'miss': '<:osuMiss:849349136955867166>',
     '50':   '<:osu50:849353678774206465>',
@@ -72,14 +122,142 @@ def get_prefix(bot: commands.Bot, message: Message):
     prefix = DEFAULT_PREFIX
     guild = message.guild
     if guild:
-        prefix = backend.read_guild_data(guild.id, 'prefix')
+        prefix = backend.read_guild_prefix(guild.id)
     return prefix if prefix else DEFAULT_PREFIX
 
 
-bot = commands.Bot(
+beatmapCache = BeatmapCache()
+profileCache = ProfileCache(ttl=PROFILE_CACHE_TTL, staleTTL=PROFILE_CACHE_STALE_TTL)
+# rendered score embeds keyed by (score_id, render variant) as (embed dict, description before/after the timedelta).
+# the same top score gets posted to every registered guild and shown again by $top/$tr
+scoreEmbedCache: LRUCache[Tuple[str, Tuple[Any, ...]], Tuple[Dict[str, Any], str, str]] = LRUCache(SCORE_EMBED_CACHE_SIZE)
+apiShare = 1 - POLLER_API_SHARE if AUTO_UPDATE_MODE == 'workers' else 1
+apiLimiter = TokenBucketLimiter(
+    OSU_API_RATE_LIMIT * apiShare,
+    burst=OSU_API_BURST * apiShare,
+    reserve=OSU_API_RESERVE,
+    maxBackgroundWait=OSU_API_MAX_BACKGROUND_WAIT,
+)
+botMetrics = Metrics()
+guildLeaderboards = GuildLeaderboards()
+osuApi = api.OsuApiClient(
+    OSU_API_KEY, beatmapCache=beatmapCache, profileCache=profileCache, limiter=apiLimiter, metrics=botMetrics
+)
+osuApi.profileListeners.append(guildLeaderboards.update_profile)
+osuTrack = OsuTrackClient(osuApi, ttl=OSUTRACK_CACHE_TTL)
+localCalculator = LocalCalculator(BEATMAP_DIR)
+topScoreSnapshots = TopScoreSnapshots(
+    backend.database_path(), scope=f'shards-{"-".join(map(str, SHARD_IDS))}' if SHARD_IDS is not None else ''
+)
+deliveryQueue = DeliveryQueue()
+scoreQueue = ScoreQueue(backend.database_path())
+scoreHistory = ScoreHistory(backend.database_path())
+deferredActions = DeferredActions()
+paginators = Paginators(deferredActions)
+pollScheduler = PollScheduler(
+    minInterval=AUTO_UPDATE_MIN_INTERVAL,
+    maxInterval=AUTO_UPDATE_MAX_INTERVAL,
+    initialInterval=min(max(600, AUTO_UPDATE_MIN_INTERVAL), AUTO_UPDATE_MAX_INTERVAL),
+)
+
+
+commandLatency = botMetrics.histogram('bonkers_command_seconds', 'Command latency', ('command',))
+commandsTotal = botMetrics.counter('bonkers_commands_total', 'Commands run by outcome', ('command', 'status'))
+commandErrors = botMetrics.counter('bonkers_command_errors_total', 'Command errors by type', ('command', 'error'))
+sweepDuration = botMetrics.histogram('bonkers_auto_update_sweep_seconds', 'Auto update sweep duration', buckets=SWEEP_BUCKETS)
+sweepPolls = botMetrics.counter('bonkers_auto_update_polls_total', 'Auto update polls by result', ('result',))
+sweepDueUsers = botMetrics.gauge('bonkers_auto_update_due_users', 'Users that were due in the last auto update sweep')
+shardUsers = botMetrics.gauge('bonkers_auto_update_shard_users', 'Users with auto updates per shard', ('shard',))
+# stats the other components already keep, read whenever metrics are collected
+botMetrics.gauge('bonkers_auto_update_scheduled_users', 'Users scheduled for auto updates', callback=lambda: len(pollScheduler))
+botMetrics.gauge(
+    'bonkers_auto_update_overdue_seconds', 'How long the most overdue user has been waiting for their poll',
+    callback=lambda: max(time.time() - (pollScheduler.next_poll_time() or time.time()), 0),
+)
+botMetrics.gauge(
+    'bonkers_leaderboard_profiles', 'Profiles held by the materialized guild leaderboards',
+    callback=lambda: guildLeaderboards.stats['profiles'],
+)
+botMetrics.gauge('bonkers_score_history_scores', 'Scores kept in the local score history', callback=lambda: len(scoreHistory))
+botMetrics.gauge('bonkers_open_paginators', 'Paginated messages still accepting page changes', callback=lambda: len(paginators))
+botMetrics.gauge('bonkers_polled_scores_backlog', 'Polled score batches waiting in the local queue', callback=lambda: len(scoreQueue))
+botMetrics.gauge('bonkers_delivery_backlog', 'Messages waiting to be delivered', callback=lambda: deliveryQueue.backlog)
+botMetrics.counter(
+    'bonkers_delivery_messages_total', 'Auto update messages by outcome', ('status',),
+    callback=lambda: {('sent',): deliveryQueue.sent, ('failed',): deliveryQueue.failed},
+)
+botMetrics.counter(
+    'bonkers_cache_lookups_total', 'Cache lookups by result', ('cache', 'result'),
+    callback=lambda: {
+        ('beatmap', 'hit'): beatmapCache.stats['hits'],
+        ('beatmap', 'disk_hit'): beatmapCache.stats['disk_hits'],
+        ('beatmap', 'miss'): beatmapCache.stats['misses'],
+        ('profile', 'hit'): profileCache.stats['hits'],
+        ('profile', 'stale_hit'): profileCache.stats['stale_hits'],
+        ('profile', 'miss'): profileCache.stats['misses'],
+        ('score_embed', 'hit'): scoreEmbedCache.hits,
+        ('score_embed', 'miss'): scoreEmbedCache.misses,
+    },
+)
+botMetrics.gauge(
+    'bonkers_cache_entries', 'Entries held in memory per cache', ('cache',),
+    callback=lambda: {
+        ('beatmap',): beatmapCache.stats['size'],
+        ('profile',): profileCache.stats['size'],
+        ('score_embed',): len(scoreEmbedCache),
+    },
+)
+botMetrics.gauge(
+    'bonkers_osutrack_circuit_open', 'Whether osu!track calls are failing fast (1) or going through (0)',
+    callback=lambda: int(osuTrack.breaker.state == 'open'),
+)
+botMetrics.counter(
+    'bonkers_osutrack_updates_total', 'osu!track update calls by outcome', ('result',),
+    callback=lambda: {
+        ('cached',): osuTrack.stats['hits'],
+        ('retried',): osuTrack.retried,
+        ('rejected',): osuTrack.rejected,
+    },
+)
+botMetrics.gauge('bonkers_api_rate_limit_per_minute', 'Configured osu! api requests per minute', callback=lambda: apiLimiter.perMinute)
+botMetrics.gauge('bonkers_api_requests_last_minute', 'osu! api requests made in the last minute', callback=lambda: apiLimiter.requests_last_minute)
+botMetrics.gauge('bonkers_api_rate_limit_tokens', 'Rate limit tokens available', callback=lambda: apiLimiter.stats['tokens'])
+botMetrics.gauge(
+    'bonkers_api_rate_limit_queued', 'Requests waiting for the rate limiter', ('priority',),
+    callback=lambda: {(name,): apiLimiter.stats[f'{name}_queued'] for name in PRIORITY_NAMES.values()},
+)
+botMetrics.counter('bonkers_api_rate_limit_shed_total', 'Background requests dropped by the rate limiter', callback=lambda: apiLimiter.shed)
+
+
+class BonkersBot(commands.AutoShardedBot):
+    metricsServer: Optional[web.AppRunner] = None
+
+    async def start(self, *args, **kwargs):
+        if METRICS_PORT:
+            try:
+                self.metricsServer = await serve_metrics(botMetrics, METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                logger.error(f'Failed to start metrics server on {METRICS_HOST}:{METRICS_PORT}: {e}')
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        await osuApi.close()
+        if self.metricsServer:
+            await self.metricsServer.cleanup()
+        await super().close()
+
+    async def on_command_error(self, context: Context, exception: Exception):
+        command = context.command.qualified_name if context.command else 'unknown'
+        commandErrors.inc(command=command, error=type(exception).__name__)
+        await super().on_command_error(context, exception)
+
+
+bot = BonkersBot(
     command_prefix=get_prefix,
     case_insensitive=True,
     activity=Game('$help, feel free to @Honkers with any feedback'),
+    shard_count=SHARD_COUNT,
+    shard_ids=SHARD_IDS,
 )
 
 
@@ -88,6 +266,23 @@ async def on_ready():
     print(f'{bot.user} has connected to Discord!')
 
 
+@bot.event
+async def on_reaction_add(reaction, user):
+    await paginators.dispatch(reaction, user)
+
+
+@bot.before_invoke
+async def before_command(ctx: Context):
+    ctx.started = time.perf_counter()  # type: ignore
+
+
+@bot.after_invoke
+async def after_command(ctx: Context):
+    command = ctx.command.qualified_name
+    commandLatency.observe(time.perf_counter() - ctx.started, command=command)  # type: ignore
+    commandsTotal.inc(command=command, status='error' if ctx.command_failed else 'ok')
+
+
 @bot.command(help='Says Hello!')
 async def hello(ctx: Context):
     await ctx.send('Hello!')
@@ -111,8 +306,7 @@ async def bonk(ctx: Context):
 @bot.command(help='honk')
 async def honk(ctx: Context):
     message = await ctx.send(get_honk())
-    time.sleep(5)
-    await message.edit(content=random.choice(['🎺', '📯', '🇭 🇴 🇳 🇰']))
+    deferredActions.schedule(5, message.edit, content=random.choice(['🎺', '📯', '🇭 🇴 🇳 🇰']))
 
 
 @bot.command(
@@ -124,17 +318,21 @@ async def osu_update(ctx: Context, *, u: Optional[str] = None, showhs: bool = Tr
         u = get_osuid(ctx)
     if not u:
         return await ctx.send(f'No osu profile set for user {reply_mention(ctx)}. You can register your osu profile using the $register command or specify an osu user id to update directly with $update <uid>.')
-    user = get_user(u)
+    user = await get_user(u)
     if not user:
         return await ctx.send(f'invalid user')
-    osuid = user['user_id']
-    response = requests.post(f'{AMEO_API_ENDPOINT}update', params={'user': osuid, 'mode': 0})
-    if response.status_code != 200:
-        if response.status_code == 400:
+    osuid = user.user_id
+    try:
+        r = await osuTrack.update(osuid, 0)
+    except CircuitOpen:
+        return await ctx.send(f'osu!track seems to be down right now {SADGE_EMOTE} Try again in a bit.')
+    except api.ApiError as e:
+        if e.status == 400:
             return await ctx.send(f'Invalid update request, please make sure a valid user id was given/registered.')
         else:
             return await ctx.send('Something went wrong :( Try going to https://ameobea.me/osutrack/ to make sure you account stats are initialized.')
-    r = response.json()
+    if showhs:
+        await osuApi.attach_beatmaps(r['newhs'][:5])
     updateEmbed = Embed(
         title=f'osu!track update for {r["username"]}', type='rich', color=EMBED_COLOR,
         description=(
@@ -167,12 +365,13 @@ async def osu_top(ctx: Context, rank: int = 1, *, u: Optional[str] = None):
         u = get_osuid(ctx)
     if not u:
         return await ctx.send('invalid user')
-    topScores = get_top_scores(u=u, limit=rank)
+    topScores, user = await asyncio.gather(get_top_scores(u=u, limit=rank), get_user(u))
     if not topScores:
         return await ctx.send(f'No top scores found for user {u}. Make sure to provide a valid osu username/id.')
+    record_score_history(topScores)
     score = topScores[rank - 1]
-    user = get_user(u)
-    await ctx.send(embed=get_score_embed(score, user['user_id'], user['username']))
+    await osuApi.attach_beatmaps([score])
+    await ctx.send(embed=get_score_embed(score, user.user_id, user.username))
 
 
 @ bot.command(
@@ -186,12 +385,13 @@ async def osu_toprange(ctx: Context, rankstart: int = 1, rankend: int = 10, *, u
         u = get_osuid(ctx)
     if not u:
         return await ctx.send('invalid user')
-    topScores = get_top_scores(u, rankend)
+    topScores, user = await asyncio.gather(get_top_scores(u, rankend), get_user(u))
     if not topScores:
         return await ctx.send(f'No top scores found for user {u}. Make sure to provide a valid osu username/id.')
+    record_score_history(topScores)
     scores = topScores[rankstart - 1: rankend]
+    await osuApi.attach_beatmaps(scores)
     chunkedScores = chunk(scores, 10)
-    user = get_user(u)
     first = True
     for scoreChunk in chunkedScores:
         toprangeEmbed = Embed(
@@ -201,9 +401,9 @@ async def osu_toprange(ctx: Context, rankstart: int = 1, rankend: int = 10, *, u
         )
         if first:
             toprangeEmbed.set_author(
-                name=f'Top {rankstart} - {rankend} scores for {user["username"]}',
-                url=osu.profile_link(user["user_id"]),
-                icon_url=osu.profile_thumb(user["user_id"]),
+                name=f'Top {rankstart} - {rankend} scores for {user.username}',
+                url=osu.profile_link(user.user_id),
+                icon_url=osu.profile_thumb(user.user_id),
             )
             first = False
         await ctx.send(embed=toprangeEmbed)
@@ -217,22 +417,15 @@ async def osu_register(ctx: Context, *, u: Optional[str] = None):
     if not u:
         return await ctx.send('Please specify an osu profile username/id!')
     else:
-        user = get_user(u)
+        user = await get_user(u)
         if not user:
             return await ctx.send(f'User {u} not found, you can try using an osu id instead')
 
-        registeredGuilds = set(backend.read_user_data(ctx.author.id, 'guilds') or [])
-        registeredGuilds.add(ctx.guild.id)
-        backend.write_user_data(
-            ctx.author.id,
-            data={
-                'osuid': user['user_id'],
-                'guilds': list(registeredGuilds),
-            },
-        )
+        backend.write_user_data(ctx.author.id, data={'osuid': user.user_id})
+        backend.add_user_guild(ctx.author.id, ctx.guild.id)
         await ctx.message.add_reaction('✅')
-        await ctx.send(f'User {user["username"]} is now registered to {reply_mention(ctx)}. Here\'s your inital osu!track update')
-        await osu_update(ctx, u=user['user_id'], showhs=False)
+        await ctx.send(f'User {user.username} is now registered to {reply_mention(ctx)}. Here\'s your inital osu!track update')
+        await osu_update(ctx, u=user.user_id, showhs=False)
 
 
 @ bot.command(
@@ -244,7 +437,7 @@ async def osu_profile(ctx: Context, *, u: Optional[str] = ''):
         u = get_osuid(ctx)
     if not u:
         return await ctx.send('No osu account registered!')
-    user = get_user(u)
+    user = await get_user(u)
     if not user:
         return await ctx.send(f'User {u} not found, you can try using an osu id instead')
     await ctx.send(embed=get_user_embed(user))
@@ -254,7 +447,7 @@ async def osu_profile(ctx: Context, *, u: Optional[str] = ''):
 async def osu_map(ctx: Context, beatmapid: str):
     if not beatmapid:
         return await ctx.send('No beatmap id specified!')
-    beatmap = get_beatmap(beatmapid)
+    beatmap = await get_beatmap(beatmapid)
     if not beatmap:
         return await ctx.send('Beatmap not found!')
     return await ctx.send(embed=get_beatmap_embed(beatmap))
@@ -262,89 +455,67 @@ async def osu_map(ctx: Context, beatmapid: str):
 
 @bot.command(
     aliases=('l', 'sl'),
-    help='displays a leaderboard for registered osu profiles in this server'
+    help='$leaderboard (<mode=osu>) (<rank/pp/acc/playcount/level>) displays a leaderboard for registered osu profiles in this server'
 )
 async def osu_leaderboard(ctx: Context, *, modeString: Optional[str] = '0'):
+    words = (modeString or '').split()
+    ordering = words.pop().lower() if words and words[-1].lower() in LEADERBOARD_ORDERINGS else 'rank'
+    modeString = ' '.join(words) or '0'
     mode = get_mode(modeString)
     if mode is None:
         return await ctx.send(f'Invalid gamemode {modeString}')
-    gid = ctx.guild.id
-    userData = backend.read_all_data(backend.USER_DATA)
-    guildUsers: List[osu.User] = []
-    for uid, userData in userData.items():
-        if 'osuid' not in userData or 'guilds' not in userData:
-            continue
-        registeredGuilds = userData['guilds']
-        if gid in registeredGuilds:
-            user = get_user(userData['osuid'], mode)
+    board, missing = guildLeaderboards.get(ctx.guild.id, mode)
+    # members seen for the first time are fetched now, everyone else comes from the board and is refreshed in the
+    # background once their profile is older than PROFILE_CACHE_TTL
+    if missing:
+        profiles = await osuApi.get_user_profiles([osuid for _, osuid in missing], mode, concurrency=LEADERBOARD_FANOUT)
+        for (uid, osuid), user in zip(missing, profiles):
             if user:
-                guildUsers.append(user)
+                # profiles can come from the cache, up to PROFILE_CACHE_STALE_TTL old
+                guildLeaderboards.update_profile(user, mode, profileCache.fetched_at(osuid, mode))
             else:
                 await ctx.send(
-                    f'Profile retrieval failed for user {osu.profile_link(userData["osuid"])} <@{uid}>'
+                    f'Profile retrieval failed for user {osu.profile_link(osuid)} <@{uid}>'
                 )
-    guildUsers.sort(key=lambda user: (int(user['pp_rank'] or 0) or float('inf'), -float(user['level'] or 0)))
+    for osuid in board.stale(PROFILE_CACHE_TTL):
+        osuApi.refresh_user(osuid, mode)
+    guildUsers = board.ranking(ordering)
+    oldest = board.oldest()
+    freshness = f' · updated {naturaltime(dt.timedelta(seconds=time.time() - oldest))}' if oldest else ''
     chunksize = 10
     chunkedGuildUsers = chunk(guildUsers, chunksize)
 
     pages = len(chunkedGuildUsers)
-    cidx = 0
-    # send first leaderboard page
+
     def leaderboardContent(cidx: int) -> str:
         leaderboardRows = []
         for i, user in enumerate(chunkedGuildUsers[cidx]):
             leaderboardRows.append(
                 f'**#{(cidx * chunksize) + i + 1}** '
-                f'{flag(user["country"])} [{user["username"]}]({osu.profile_link(user["user_id"])}) - '
-                f'#{int(user["pp_rank"] or 0):n} | '
-                f'{float(user["pp_raw"] or 0):n}pp | '
-                f'LVL {float(user["level"] or 0):.2f}'
+                f'{flag(user.country)} [{user.username}]({osu.profile_link(user.user_id)}) - '
+                f'#{user.pp_rank:n} | '
+                f'{user.pp_raw:n}pp | '
+                f'LVL {user.level:.2f}'
+                f'{LEADERBOARD_EXTRA_STATS[ordering](user) if ordering in LEADERBOARD_EXTRA_STATS else ""}'
             )
         return '\n'.join(leaderboardRows)
 
-    ldict = {
-        'type': 'rich',
-        'color': EMBED_COLOR.value,
-        'description': leaderboardContent(cidx),
-        'author': {
-            'name': f'{osu.MODE_STRING_ENUM[mode]} leaderboard for {ctx.guild.name}',
-            'icon_url': str(ctx.guild.icon_url) or '',
-        },
-        'footer': {
-            'text': f'Page {cidx + 1}/{pages}'
-        },
-    }
-    leaderboardEmbed = Embed.from_dict(ldict)
-    message = await ctx.send(embed=leaderboardEmbed)
-    await message.add_reaction('◀')
-    await message.add_reaction('▶')
-
-    def check(reaction, user):
-        return user == ctx.author and (str(reaction.emoji) == '◀' or str(reaction.emoji) == '▶')
-
-    # handle pagination
-    while True:
-        try:
-            reaction, user = await bot.wait_for('reaction_add', timeout=15.0, check=check)
-        except asyncio.TimeoutError:
-            await message.clear_reaction(emoji='◀')
-            await message.clear_reaction(emoji='▶')
-            break
-        else:
-            # invalid page change
-            if (str(reaction) == '◀' and cidx == 0) or (str(reaction) == '▶' and cidx == pages - 1):
-                await message.remove_reaction(emoji=reaction, member=user)
-                continue
- 
-            if str(reaction) == '◀':
-                cidx -= 1
-            else: # str(reaction) == '▶'
-                cidx += 1
-            # update embed with new leaderboard page content
-            ldict['description'] = leaderboardContent(cidx)
-            ldict['footer']['text'] = f'Page {cidx + 1}/{pages}'
-            await message.edit(embed=Embed.from_dict(ldict))
-            await message.remove_reaction(emoji=reaction, member=user)
+    def leaderboardPage(cidx: int) -> Embed:
+        return Embed.from_dict({
+            'type': 'rich',
+            'color': EMBED_COLOR.value,
+            'description': leaderboardContent(cidx) if pages else 'No registered users',
+            'author': {
+                'name': f'{osu.MODE_STRING_ENUM[mode]} leaderboard for {ctx.guild.name}{f" by {ordering}" if ordering != "rank" else ""}',
+                'icon_url': str(ctx.guild.icon_url) or '',
+            },
+            'footer': {
+                'text': f'Page {cidx + 1}/{max(pages, 1)}{freshness}'
+            },
+        })
+
+    # page changes are handled by the on_reaction_add listener (see paginator.Paginators)
+    await paginators.open(ctx, ctx.author.id, pages, leaderboardPage)
 
     # old leaderboard code - sends entire leaderboard in chunks all at once
 
@@ -354,10 +525,10 @@ async def osu_leaderboard(ctx: Context, *, modeString: Optional[str] = '0'):
     #     for i, user in enumerate(userChunk):
     #         leaderboardRows.append(
     #             f'**#{(cidx * chunksize) + i + 1}** '
-    #             f'{flag(user["country"])} [{user["username"]}]({osu.profile_link(user["user_id"])}) - '
-    #             f'#{int(user["pp_rank"] or 0):n} | '
-    #             f'{float(user["pp_raw"] or 0):n}pp | '
-    #             f'LVL {float(user["level"] or 0):.2f}'
+    #             f'{flag(user.country)} [{user.username}]({osu.profile_link(user.user_id)}) - '
+    #             f'#{int(user.pp_rank or 0):n} | '
+    #             f'{float(user.pp_raw or 0):n}pp | '
+    #             f'LVL {float(user.level or 0):.2f}'
     #         )
 
     #     leaderboardEmbed = Embed(
@@ -385,65 +556,82 @@ async def osu_recent(ctx: Context, index: int = 1, *, u: Optional[str] = None):
         u = get_osuid(ctx)
     if not u:
         return await ctx.send('invalid user')
-    recentScores = get_recent_scores(u=u, limit=index)
+    recentScores, user = await asyncio.gather(get_recent_scores(u=u, limit=index), get_user(u))
     if not recentScores:
         return await ctx.send(f'An error occured while retrieving recent scores for user {u}. Make sure to provide a valid osu username/id.')
+    record_score_history(recentScores)
     try:
         score = recentScores[index - 1]
     except IndexError:
         return await ctx.send(f'Recent score #{index} not found.')
-    user = get_user(u)
-    await ctx.send(embed=get_score_embed(score, user['user_id'], user['username']))
+    await attach_score_details([score])
+    await ctx.send(embed=get_score_embed(score, user.user_id, user.username))
 
 
-@ tasks.loop(minutes=10)
+@ tasks.loop(seconds=AUTO_UPDATE_TICK)
 async def osu_auto_update():
-    print(f'Running top score update for {dt.datetime.now()}')
-    logger.debug(f'Running top score update for {dt.datetime.now()}')
-
     # allRecentTopScores = {}
-    allUserData = backend.read_all_data(backend.USER_DATA)
     allGuildData = backend.read_all_data(backend.GUILD_DATA)
 
-    for uid, userData in allUserData.items():
-        if 'osuid' not in userData or 'guilds' not in userData:
+    # only members of guilds with an update channel set on one of our shards need to be polled, members of guilds
+    # on other shard groups are polled (and delivered to) by the process running those shards
+    userGuilds: Dict[str, List[int]] = {}
+    userOsuids: Dict[str, str] = {}
+    usersByShard: Dict[int, Set[str]] = {}
+    hostedGuildData: Dict[str, backend.GuildData] = {}
+    for gid, guildData in allGuildData.items():
+        if not guildData.get('osu_update_channel'):
             continue
-        registeredGuilds = userData['guilds']
-        if not len(registeredGuilds):
+        shardId = guild_shard_id(int(gid))
+        if not hosts_shard(shardId):
             continue
-        osuid = userData['osuid']
-        topScores = get_top_scores(u=osuid, limit=100)
-        recentTopScores = list(filter(is_recent_score, topScores))
-        if len(recentTopScores):
-            user = get_user(osuid)
-            print(f'{user["username"]}: {len(recentTopScores)} top scores')
-            logger.debug(f'{user["username"]}: {len(recentTopScores)} top scores')
-            for gid in registeredGuilds:
-                guildData = allGuildData.get(str(gid), {})
-                cid = guildData.get('osu_update_channel')
-                if not cid:
-                    logger.warning(f'registered guild {gid} has no auto update channel set')
-                    continue
-                channel = bot.get_channel(cid)
-                if not channel or channel.type != ChannelType.text:
-                    print(f'Top score update failed: invalid channel ID {cid}')
-                    logger.error(f'Top score update failed: invalid channel ID {cid}')
-                    continue
-                channel = cast(TextChannel, channel)
-
-                # filter scores on osu_update_cutoff
-                scoreCutoff = min(guildData.get('osu_update_score_rank_cutoff', 100), 100)
-                ppCutoff = max(guildData.get('osu_update_score_pp_cutoff', 0), 0)
-                filteredRecentTopScores = list(filter(
-                    lambda score : score['ranking'] < scoreCutoff, recentTopScores
-                ))
-                filteredRecentTopScores = list(filter(
-                    lambda score : float(score['pp']) >= ppCutoff or score['ranking'] < 5, filteredRecentTopScores
-                ))
-                if len(filteredRecentTopScores):
-                    await channel.send(f'New top scores for <@{uid}>')
-                    for score in filteredRecentTopScores:
-                        await channel.send(embed=get_score_embed(score, osuid, user['username']))
+        hostedGuildData[gid] = guildData
+        for uid, osuid in backend.read_guild_members(gid).items():
+            userGuilds.setdefault(uid, []).append(int(gid))
+            userOsuids[uid] = osuid
+            usersByShard.setdefault(shardId, set()).add(uid)
+    shardUsers.values.clear()
+    for shardId, uids in usersByShard.items():
+        shardUsers.set(len(uids), shard=shardId)
+
+    pollScheduler.sync(userGuilds.keys())
+    dueUsers = pollScheduler.due()
+    sweepDueUsers.set(len(dueUsers))
+    if not dueUsers:
+        return
+    sweepStart = time.perf_counter()
+    print(f'Running top score update for {len(dueUsers)} users at {dt.datetime.now()}')
+    logger.debug(f'Running top score update for {len(dueUsers)} users at {dt.datetime.now()}')
+
+    planner = DeliveryPlanner(hostedGuildData, get_update_channel)
+    plan = DeliveryPlan()
+    # osuid -> scores to snapshot once the user's new scores are delivered
+    deferredSnapshots: Dict[str, DetectedScores] = {}
+
+    async def poll(uid: str):
+        api.request_priority.set(BACKGROUND)
+        active = None
+        try:
+            active = await osu_auto_update_user(uid, userOsuids[uid], userGuilds[uid], planner, plan, deferredSnapshots)
+        finally:
+            pollScheduler.reschedule(uid, active)
+            sweepPolls.inc(result='failed' if active is None else 'new' if active else 'idle')
+
+    # users are updated concurrently so one slow api response doesn't hold up everyone else
+    await asyncio.gather(*(poll(uid) for uid in dueUsers))
+    # sent in the background so polling never waits on discord
+    deliveries = plan.send(deliveryQueue, get_score_embed)
+    for (_, uid), delivery in deliveries.items():
+        osuid = userOsuids[uid]
+        if osuid in deferredSnapshots:
+            save_snapshot_when_delivered(
+                osuid, deferredSnapshots.pop(osuid),
+                [delivery for (_, deliveryUid), delivery in deliveries.items() if deliveryUid == uid],
+            )
+    sweepDuration.observe(time.perf_counter() - sweepStart)
+    logger.debug(f'Beatmap cache stats: {beatmapCache.stats}')
+    logger.debug(f'osu! api rate limit stats: {apiLimiter.stats}')
+    logger.debug(f'Delivery backlog: {deliveryQueue.backlog}, sent {deliveryQueue.sent}, failed {deliveryQueue.failed}')
 
     # if len(allRecentTopScores):
     #     print(allRecentTopScores)
@@ -453,24 +641,128 @@ async def osu_auto_update():
     #             await channel.send(f'New top scores for <@{uid}>')
     #             user = get_user(osuid)
     #             for score in scores:
-    #                 await channel.send(embed=get_score_embed(score, osuid, user['username']))
+    #                 await channel.send(embed=get_score_embed(score, osuid, user.username))
     # else:
     #     await channel.send(f'No top scores in past hour {SADGE_EMOTE}')
 
 
+async def osu_auto_update_user(
+    uid: str,
+    osuid: str,
+    registeredGuilds: List[int],
+    planner: DeliveryPlanner,
+    plan: DeliveryPlan,
+    deferredSnapshots: Dict[str, DetectedScores],
+) -> Optional[bool]:
+    # returns whether the user had new top scores, or None if they couldn't be checked
+    detected = await detect_new_scores(osuApi, topScoreSnapshots, osuid)
+    if detected is None:
+        return None
+    if detected.newScores and detected.user:
+        print(f'{detected.user.username}: {len(detected.newScores)} top scores')
+        logger.debug(f'{detected.user.username}: {len(detected.newScores)} top scores')
+        planner.plan(plan, uid, osuid, detected.user.username, detected.newScores, registeredGuilds)
+    record_score_history(detected.topScores)
+    if plan.has(uid):
+        # the snapshot is saved once the scores are delivered so a failed send or crash means they're found again,
+        # until then they're held so later polls don't queue them a second time
+        topScoreSnapshots.hold(osuid, detected.newScores)
+        deferredSnapshots[osuid] = detected
+    elif not topScoreSnapshots.holding(osuid):
+        # saving now would include held scores whose delivery may still fail, the pending save covers them
+        topScoreSnapshots.save(osuid, detected.topScores)
+    return len(detected.newScores) > 0
+
+
+def save_snapshot_when_delivered(osuid: str, detected: DetectedScores, deliveries: List['asyncio.Future[bool]']) -> None:
+    def done(settled: 'asyncio.Future[List[bool]]') -> None:
+        try:
+            if settled.cancelled():
+                return
+            if all(settled.result()):
+                topScoreSnapshots.save(osuid, detected.topScores)
+            else:
+                logger.warning(f'Top score delivery for {osuid} failed, their new scores are retried next update')
+        finally:
+            topScoreSnapshots.release(osuid, detected.newScores)
+
+    asyncio.gather(*deliveries).add_done_callback(done)
+
+
+def get_update_channel(cid: int) -> Optional[TextChannel]:
+    channel = bot.get_channel(cid)
+    if not channel or channel.type != ChannelType.text:
+        return None
+    return cast(TextChannel, channel)
+
+
+@ tasks.loop(seconds=POLLED_SCORES_TICK)
+async def deliver_polled_scores():
+    # AUTO_UPDATE_MODE=workers: delivers the scores poller processes found for guilds on our shards
+    polledScores = scoreQueue.take(lambda gid: hosts_shard(guild_shard_id(gid)))
+    if not polledScores:
+        return
+    gids = {str(polled.gid) for polled in polledScores}
+    allGuildData = backend.read_all_data(backend.GUILD_DATA)
+    planner = DeliveryPlanner({gid: allGuildData[gid] for gid in gids if gid in allGuildData}, get_update_channel)
+    plan = DeliveryPlan()
+    for polled in polledScores:
+        planner.plan(plan, polled.uid, polled.osuid, polled.username, polled.scores, (polled.gid,))
+        record_score_history(polled.scores)
+    deliveries = plan.send(deliveryQueue, get_score_embed)
+    for polled in polledScores:
+        channel = planner.channels.get(polled.gid)
+        delivery = deliveries.get((channel.id, polled.uid)) if channel else None  # type: ignore
+        if delivery is not None:
+            requeue_when_failed(polled, delivery)
+
+
+def requeue_when_failed(polled: PolledScores, delivery: 'asyncio.Future[bool]') -> None:
+    # taken rows are gone from the queue, ones that couldn't be delivered go back in for the next drain
+    def done(settled: 'asyncio.Future[bool]') -> None:
+        if not settled.cancelled() and not settled.result():
+            logger.warning(f'Top score delivery for {polled.osuid} to guild {polled.gid} failed, requeued')
+            scoreQueue.push((polled.gid,), polled.uid, polled.osuid, polled.username, polled.scores)
+
+    delivery.add_done_callback(done)
+
+
+def record_score_history(scores: List[osu.Score]) -> None:
+    # history is a side record, a failed write (e.g. the database is locked by another process for too long) must
+    # never fail the poll or command that saw the scores
+    try:
+        scoreHistory.record(scores)
+    except Exception as e:
+        logger.exception(f'Recording score history failed: {e}')
+
+
+@ tasks.loop(hours=1)
+async def compact_score_history():
+    # most compaction happens as segments pile up on writes, this catches users who are rarely written to
+    try:
+        compacted = scoreHistory.compact()
+    except Exception as e:
+        logger.exception(f'Compacting score history failed: {e}')
+        return
+    logger.debug(f'Compacted score history of {compacted} users, {scoreHistory.stats}')
+
+
+def guild_shard_id(gid: int) -> int:
+    # https://discord.com/developers/docs/topics/gateway#sharding-sharding-formula
+    return (gid >> 22) % (bot.shard_count or 1)
+
+
+def hosts_shard(shardId: int) -> bool:
+    return bot.shard_ids is None or shardId in bot.shard_ids
+
+
 @osu_auto_update.before_loop
+@deliver_polled_scores.before_loop
 async def before_osu_auto_update():
     print('waiting for bot to log on')
     await bot.wait_until_ready()  # wait until the bot logs on
 
 
-def is_recent_score(score, timedelta=dt.timedelta(minutes=10, seconds=5)) -> bool:
-    '''
-        Returns True if `score` was submitted within `timedelta` (default 1 day) time before datetime.utcnow()
-    '''
-    return dt.datetime.utcnow() - dt.datetime.fromisoformat(score['date']) < timedelta
-
-
 @bot.command(help='Changes the prefix for commands to be recognized by Bonkers')
 @commands.has_permissions(administrator=True)
 async def set_bonkers_prefix(ctx: Context, prefix: str):
@@ -497,12 +789,7 @@ async def osu_unregister(ctx: Context):
         mentionedIDs.append(ctx.author.id)
 
     for uid in mentionedIDs:
-        registeredGuilds = backend.read_user_data(uid, 'guilds') or []
-        try:
-            registeredGuilds.remove(ctx.guild.id)
-        except ValueError:
-            pass
-        backend.write_user_data(uid, data={'guilds': registeredGuilds})
+        backend.remove_user_guild(uid, ctx.guild.id)
 
     await ctx.message.add_reaction('✅')
     await ctx.send(
@@ -555,6 +842,17 @@ async def set_osu_auto_update_pp_cutoff(ctx: Context, cutoff: float):
 async def enable_osu_automatic_updates_error(ctx: Context, error):
     await ctx.send('You must be an admin to set the top score update pp cutoff')
 
+@bot.command(name='stats', help='Shows command latencies, osu! api usage, auto update and cache stats')
+@commands.has_permissions(administrator=True)
+async def bonkers_stats(ctx: Context):
+    await ctx.send(embed=get_stats_embed())
+
+
+@bonkers_stats.error
+async def bonkers_stats_error(ctx: Context, error):
+    await ctx.send('You must be an admin to view bot stats')
+
+
 @ bot.command(aliases=('dt', 'test'), help='Super secret command used for testing during development')
 @ commands.has_permissions(administrator=True)
 async def dev_test(ctx):
@@ -585,54 +883,142 @@ async def dev_test(ctx):
 
 
 def get_score_embed(score: osu.Score, osuid: str, username: str) -> Embed:
-    if 'meta' not in score:
-        score['meta'] = get_beatmap(score["beatmap_id"])
-    bmp = score['meta']
-    title = f'{bmp["title"]} [{bmp["version"]}] | {float(bmp["difficultyrating"]):.2f}★'
-
-    description = (
-        f'**[{title}]({osu.beatmap_link(score["beatmap_id"])})\n'
-        f'{osu_score_emoji(score["rank"])} | '
-        f'{osu.mod_string(int(score["enabled_mods"]))} | '
-        f'{get_score_acc(score)}% ({score["maxcombo"]}/{bmp["max_combo"]}) | '
-        f'{score["pp"] if "pp" in score else "?"}pp | ' 
-        f'{get_score_timedelta(score)}**\n'
-        f'{OSU_HIT_EMOJI_MAP["300"]} {score["count300"]} '
-        f'{OSU_HIT_EMOJI_MAP["100"]} {score["count100"]}'
-        f'{OSU_HIT_EMOJI_MAP["50"]} {score["count50"]} '
-        f'{OSU_HIT_EMOJI_MAP["miss"]} {score["countmiss"]}\n\n'
-        f'**Beatmap Info** ({bmp["beatmap_id"]})'
+    # score.meta must already be filled in (see OsuApiClient.attach_beatmaps). Recent scores have no score id so
+    # they're rendered every time
+    key = (score.score_id, (score.ranking, osuid, username, score.pp))
+    template = scoreEmbedCache.get(key) if score.score_id else None
+    if template is None:
+        template = render_score_embed(score, osuid, username)
+        if score.score_id:
+            scoreEmbedCache.put(key, template)
+    embed, before, after = template
+    return Embed.from_dict({**embed, 'description': f'{before}{get_score_timedelta(score)}{after}'})
+
+
+def render_score_embed(score: osu.Score, osuid: str, username: str) -> Tuple[Dict[str, Any], str, str]:
+    # everything but the "x minutes ago" part, see get_score_embed
+    osu.update_score_difficulty(score)
+    bmp = score.meta
+    title = f'{bmp.title} [{bmp.version}] | {bmp.difficultyrating:.2f}★'
+
+    before = (
+        f'**[{title}]({osu.beatmap_link(score.beatmap_id)})\n'
+        f'{osu_score_emoji(score.rank)} | '
+        f'{osu.mod_string(score.enabled_mods)} | '
+        f'{score.accuracy}% ({score.maxcombo}/{bmp.max_combo}) | '
+        f'{format_pp(score.pp)}pp | '
+    )
+    after = (
+        f'**\n'
+        f'{OSU_HIT_EMOJI_MAP["300"]} {score.count300} '
+        f'{OSU_HIT_EMOJI_MAP["100"]} {score.count100}'
+        f'{OSU_HIT_EMOJI_MAP["50"]} {score.count50} '
+        f'{OSU_HIT_EMOJI_MAP["miss"]} {score.countmiss}\n\n'
+        f'**Beatmap Info** ({bmp.beatmap_id})'
     )
-    if int(score.get('replay_available', 0)) == 1:
-        description += f' ([Replay]({osu.score_replay_link(score["score_id"])}))'
-    description += (
-        f'\nLength **{format_seconds(int(bmp["total_length"]))}** ~ '
-        f'CS**{bmp["diff_size"]}** '
-        f'AR**{bmp["diff_approach"]}** '
-        f'OD**{bmp["diff_overall"]}** '
-        f'HP**{bmp["diff_drain"]}** ~ '
-        f'**{bmp["bpm"]}** BPM ~ '
-        f'**{float(bmp["difficultyrating"]):.2f}**★'
+    if score.replay_available == 1:
+        after += f' ([Replay]({osu.score_replay_link(score.score_id)}))'
+    after += (
+        f'\nLength **{format_seconds(bmp.total_length)}** ~ '
+        f'CS**{osu.format_stat(bmp.diff_size)}** '
+        f'AR**{osu.format_stat(bmp.diff_approach)}** '
+        f'OD**{osu.format_stat(bmp.diff_overall)}** '
+        f'HP**{osu.format_stat(bmp.diff_drain)}** ~ '
+        f'**{osu.format_stat(bmp.bpm)}** BPM ~ '
+        f'**{bmp.difficultyrating:.2f}**★'
     )
 
     scoreEmbed = Embed(
         type='rich',
         color=EMBED_COLOR,
-        description=description,
     )
-    authortitle = f'{username} - #{score["ranking"] + 1} Top Play' if 'ranking' in score and score['ranking'] >= 0 else username
+    authortitle = f'{username} - #{score.ranking + 1} Top Play' if score.ranking >= 0 else username
     scoreEmbed.set_author(name=authortitle, url=osu.profile_link(osuid), icon_url=osu.profile_thumb(osuid))
-    scoreEmbed.set_thumbnail(url=osu.beatmap_thumb(bmp['beatmapset_id']))
-    return scoreEmbed
+    scoreEmbed.set_thumbnail(url=osu.beatmap_thumb(bmp.beatmapset_id))
+    return scoreEmbed.to_dict(), before, after
+
+
+def get_stats_embed() -> Embed:
+    def ms(seconds: Optional[float]) -> str:
+        return f'{seconds * 1000:.0f}ms' if seconds is not None else '?'
+
+    def ratio(hits: float, total: float) -> str:
+        return f'{hits / total * 100:.1f}%' if total else '-'
+
+    commandRows = []
+    commands = sorted(commandLatency.label_values(), key=lambda labels: -commandLatency.count(command=labels[0]))
+    for (command,) in commands[:10]:
+        commandRows.append(
+            f'`{command}` {commandLatency.count(command=command)} runs | '
+            f'p50 {ms(commandLatency.quantile(0.5, command=command))} | '
+            f'p99 {ms(commandLatency.quantile(0.99, command=command))} | '
+            f'{commandsTotal.get(command=command, status="error"):.0f} errors'
+        )
+
+    apiRows = []
+    for (endpoint,) in osuApi.requestLatency.label_values():
+        requests = osuApi.requestLatency.count(endpoint=endpoint)
+        errors = requests - osuApi.requestsTotal.get(endpoint=endpoint, status=200)
+        apiRows.append(
+            f'`{endpoint}` {requests} calls | {errors:.0f} errors | '
+            f'p50 {ms(osuApi.requestLatency.quantile(0.5, endpoint=endpoint))} | '
+            f'p99 {ms(osuApi.requestLatency.quantile(0.99, endpoint=endpoint))}'
+        )
+    limiterStats = apiLimiter.stats
+    apiRows.append(
+        f'**{apiLimiter.requests_last_minute}/{apiLimiter.perMinute:.0f}** requests in the last minute | '
+        f'{limiterStats["tokens"]:.0f} tokens | '
+        f'{limiterStats["interactive_queued"] + limiterStats["background_queued"]:.0f} queued | '
+        f'{apiLimiter.shed} shed | {osuApi.coalesced} coalesced'
+    )
+    osuTrackStats = osuTrack.stats
+    apiRows.append(
+        f'osu!track: circuit {osuTrackStats["state"]} (opened {osuTrackStats["opened"]}x) | '
+        f'{osuTrackStats["retried"]} retries | {osuTrackStats["rejected"]} failed fast | '
+        f'{osuTrackStats["hits"]} cached'
+    )
+
+    sweeps = sweepDuration.count()
+    autoUpdateRows = [
+        f'{len(pollScheduler)} users scheduled | {sweepDueUsers.get():.0f} due last sweep | '
+        f'{botMetrics["bonkers_auto_update_overdue_seconds"].get():.0f}s overdue',
+        f'{sweeps} sweeps | avg {ms(sweepDuration.sum() / sweeps if sweeps else None)} | '
+        f'p99 {ms(sweepDuration.quantile(0.99))}',
+        f'polls: {sweepPolls.get(result="new"):.0f} new scores | {sweepPolls.get(result="idle"):.0f} idle | '
+        f'{sweepPolls.get(result="failed"):.0f} failed',
+        f'deliveries: {deliveryQueue.backlog} queued | {deliveryQueue.sent} sent | {deliveryQueue.failed} failed',
+    ]
+
+    beatmapStats, profileStats, historyStats = beatmapCache.stats, profileCache.stats, scoreHistory.stats
+    beatmapHits = beatmapStats['hits'] + beatmapStats['disk_hits']
+    profileHits = profileStats['hits'] + profileStats['stale_hits']
+    cacheRows = [
+        f'beatmaps: {ratio(beatmapHits, beatmapHits + beatmapStats["misses"])} hits '
+        f'({beatmapStats["disk_hits"]} from disk) | {beatmapStats["size"]} in memory',
+        f'profiles: {ratio(profileHits, profileHits + profileStats["misses"])} hits '
+        f'({profileStats["stale_hits"]} stale) | {profileStats["size"]} in memory',
+        f'score embeds: {ratio(scoreEmbedCache.hits, scoreEmbedCache.hits + scoreEmbedCache.misses)} hits | '
+        f'{len(scoreEmbedCache)} in memory',
+        f'score history: {historyStats["scores"]} scores of {historyStats["users"]} users | '
+        f'{historyStats["segments"]} segments',
+    ]
+
+    statsEmbed = Embed(type='rich', color=EMBED_COLOR)
+    statsEmbed.set_author(name='Bonkers stats')
+    statsEmbed.add_field(name='Commands', value='\n'.join(commandRows) or 'No commands run yet', inline=False)
+    statsEmbed.add_field(name='osu! api', value='\n'.join(apiRows), inline=False)
+    statsEmbed.add_field(name='Auto updates', value='\n'.join(autoUpdateRows), inline=False)
+    statsEmbed.add_field(name='Caches', value='\n'.join(cacheRows), inline=False)
+    return statsEmbed
 
 
 def get_user_embed(user: osu.User) -> Embed:
-    osuid = user['user_id']
+    osuid = user.user_id
     userEmbed = Embed(
         title=(
-            f'{flag(user["country"])} {user["username"]} - {float(user["pp_raw"]):n}pp | '
-            f'#{int(user["pp_rank"]):n} | '
-            f'{user["country"]} #{int(user["pp_country_rank"]):n}'
+            f'{flag(user.country)} {user.username} - {user.pp_raw:n}pp | '
+            f'#{user.pp_rank:n} | '
+            f'{user.country} #{user.pp_country_rank:n}'
         ),
         url=osu.profile_link(osuid),
         type='rich',
@@ -640,42 +1026,42 @@ def get_user_embed(user: osu.User) -> Embed:
     )
     userEmbed.add_field(
         name='Ranked Score',
-        value=f'{int(user["ranked_score"]):n}',
+        value=f'{user.ranked_score:n}',
         inline=True
     )
     userEmbed.add_field(
         name='Total score',
-        value=f'{int(user["total_score"]):n}',
+        value=f'{user.total_score:n}',
         inline=True,
     )
     userEmbed.add_field(
         name='Hit Accuracy',
-        value=f'{float(user["accuracy"]):.2f}%',
+        value=f'{user.accuracy:.2f}%',
         inline=True,
     )
     userEmbed.add_field(
         name='Play Count',
-        value=f'{int(user["playcount"]):n}',
+        value=f'{user.playcount:n}',
         inline=True,
     )
     userEmbed.add_field(
         name='Play Time',
-        value=format_seconds(int(user["total_seconds_played"])),
+        value=format_seconds(user.total_seconds_played),
         inline=True,
     )
     userEmbed.add_field(
         name='Level',
-        value=f'{user["level"]}',
+        value=f'{user.level}',
         inline=True,
     )
     userEmbed.add_field(
         name='Grades',
         value=(
-            f'{osu_score_emoji("XH")} \u200b {int(user["count_rank_ssh"]):n} \u200b '
-            f'{osu_score_emoji("SS")} \u200b {int(user["count_rank_ss"]):n} \u200b '
-            f'{osu_score_emoji("SH")} \u200b {int(user["count_rank_sh"]):n} \u200b '
-            f'{osu_score_emoji("S")} \u200b {int(user["count_rank_s"]):n} \u200b '
-            f'{osu_score_emoji("A")} \u200b {int(user["count_rank_a"]):n}'
+            f'{osu_score_emoji("XH")} \u200b {user.count_rank_ssh:n} \u200b '
+            f'{osu_score_emoji("SS")} \u200b {user.count_rank_ss:n} \u200b '
+            f'{osu_score_emoji("SH")} \u200b {user.count_rank_sh:n} \u200b '
+            f'{osu_score_emoji("S")} \u200b {user.count_rank_s:n} \u200b '
+            f'{osu_score_emoji("A")} \u200b {user.count_rank_a:n}'
         ),
         inline=False,
     )
@@ -685,28 +1071,28 @@ def get_user_embed(user: osu.User) -> Embed:
 
 def get_beatmap_embed(bmp: osu.Beatmap):
     beatmapEmbed = Embed(
-        title=f'{bmp["title"]} [{bmp["version"]}] | {float(bmp["difficultyrating"]):.2f}★',
-        url=osu.beatmap_link(bmp['beatmap_id']),
+        title=f'{bmp.title} [{bmp.version}] | {bmp.difficultyrating:.2f}★',
+        url=osu.beatmap_link(bmp.beatmap_id),
         color=EMBED_COLOR,
     )
     beatmapEmbed.add_field(
-        name=f'Beatmap Info ({bmp["beatmap_id"]}) ({osu.BEATMAP_STATUS_ENUM[int(bmp["approved"])]})',
+        name=f'Beatmap Info ({bmp.beatmap_id}) ({osu.BEATMAP_STATUS_ENUM[bmp.approved]})',
         value=(
-            f'Length **{format_seconds(int(bmp["total_length"]))}** ~ '
-            f'Max Combo **{bmp["max_combo"]}**\n'
-            f'CS**{bmp["diff_size"]}** '
-            f'AR**{bmp["diff_approach"]}** '
-            f'OD**{bmp["diff_overall"]}** '
-            f'HP**{bmp["diff_drain"]}** ~ '
-            f'**{bmp["bpm"]}** BPM ~ '
-            f'**{float(bmp["difficultyrating"]):.2f}**★'
+            f'Length **{format_seconds(bmp.total_length)}** ~ '
+            f'Max Combo **{bmp.max_combo}**\n'
+            f'CS**{osu.format_stat(bmp.diff_size)}** '
+            f'AR**{osu.format_stat(bmp.diff_approach)}** '
+            f'OD**{osu.format_stat(bmp.diff_overall)}** '
+            f'HP**{osu.format_stat(bmp.diff_drain)}** ~ '
+            f'**{osu.format_stat(bmp.bpm)}** BPM ~ '
+            f'**{bmp.difficultyrating:.2f}**★'
         ),
         inline=False
     )
-    beatmapEmbed.set_thumbnail(url=osu.beatmap_thumb(bmp['beatmapset_id']))
+    beatmapEmbed.set_thumbnail(url=osu.beatmap_thumb(bmp.beatmapset_id))
     beatmapEmbed.set_footer(
-        text=f'Mapped by {bmp["creator"]}',
-        icon_url=osu.profile_thumb(bmp['creator_id'])
+        text=f'Mapped by {bmp.creator}',
+        icon_url=osu.profile_thumb(bmp.creator_id)
     )
     return beatmapEmbed
 
@@ -740,14 +1126,16 @@ def format_seconds(seconds: int) -> str:
 
 
 def format_score_inline(score: osu.Score) -> str:
-    if 'meta' not in score:
-        score['meta'] = get_beatmap(score["beatmap_id"])
-    meta = score['meta']
-    title = format_title(meta['title'], meta['version'])
-    modString = f'**{osu.mod_string(int(score["enabled_mods"]))}**' if int(score["enabled_mods"]) > 0 else ''
-    return f'**#{score["ranking"] + 1}**: [{title}](https://osu.ppy.sh/b/{score["beatmap_id"]}){modString} \t| \
-        {osu_score_emoji(score["rank"])} {get_score_acc(score)}% \t| \
-        {score["pp"]}pp'
+    meta = score.meta
+    title = format_title(meta.title, meta.version)
+    modString = f'**{osu.mod_string(score.enabled_mods)}**' if score.enabled_mods > 0 else ''
+    return f'**#{score.ranking + 1}**: [{title}](https://osu.ppy.sh/b/{score.beatmap_id}){modString} \t| \
+        {osu_score_emoji(score.rank)} {score.accuracy}% \t| \
+        {format_pp(score.pp)}pp'
+
+
+def format_pp(pp: Optional[float]) -> str:
+    return osu.format_stat(pp) if pp is not None else '?'
 
 
 def format_title(title: str, diff: str):
@@ -768,71 +1156,77 @@ def reply_mention(ctx: Context) -> str:
     return f'<@{ctx.author.id}>'
 
 
-def get_user(u: str, mode: int = 0) -> Optional[osu.User]:
-    try:
-        return requests.post(
-            f'{OSU_API_ENDPOINT}get_user',
-            params={'k': OSU_API_KEY, 'u': u, 'm': mode}
-        ).json()[0]
-    except:
-        return None
+async def attach_score_details(scores: List[osu.Score]) -> None:
+    '''
+        Fills in score.meta from local .osu files where we have them (falling back to the api) and calculates pp
+        for scores that don't come with it (recent plays)
+    '''
+    missing: List[osu.Score] = []
+    for score in scores:
+        if score.meta is None:
+            meta = localCalculator.beatmap_meta(score.beatmap_id, score.enabled_mods)
+            if meta is None:
+                missing.append(score)
+            else:
+                score.meta = meta
+    if missing:
+        await osuApi.attach_beatmaps(missing)
+    for score in scores:
+        if score.pp is None and score.rank != 'F':
+            score.pp = localCalculator.score_pp(score)
+    for beatmapid in {score.beatmap_id for score in scores if not localCalculator.has_beatmap(score.beatmap_id)}:
+        download_beatmap_file(beatmapid)
 
 
-def get_beatmap(beatmapid: str) -> Optional[osu.Beatmap]:
-    try:
-        return requests.post(f'{OSU_API_ENDPOINT}get_beatmaps', params={'k': OSU_API_KEY, 'b': beatmapid}).json()[0]
-    except:
-        return None
+beatmapDownloads: Dict[str, 'asyncio.Task[None]'] = {}
 
 
-def get_top_scores(u: str, limit: int) -> List[osu.Score]:
-    response = requests.post(
-        f'{OSU_API_ENDPOINT}get_user_best',
-        params={'k': OSU_API_KEY, 'u': u, 'limit': limit}
-    )
-    try:
-        topScores = response.json()
-        for i, score in enumerate(topScores):
-            score["ranking"] = i
-        return topScores
-    except:
-        logger.critical(f'get_user_best api call failed! Reponse: {response.text}')
-        return []
-
-
-def get_recent_scores(u: str, limit: int, mode: int = 0) -> List[osu.Score]:
-    response = requests.post(
-        f'{OSU_API_ENDPOINT}get_user_recent',
-        params={'k': OSU_API_KEY, 'u': u, 'limit': limit, 'm': mode}
-    )
-    try:
-        topScores = response.json()
-        print(len(topScores))
-        return topScores
-    except:
-        logger.critical(f'get_user_best api call failed! Reponse: {response.text}')
-        return []
+def download_beatmap_file(beatmapid: str) -> None:
+    async def download():
+        api.request_priority.set(BACKGROUND)
+        try:
+            text = await osuApi.get_beatmap_file(beatmapid)
+            if text:
+                localCalculator.save_beatmap(beatmapid, text)
+        except OSError as e:
+            logger.warning(f'Failed to save beatmap file {beatmapid}: {e}')
+        finally:
+            del beatmapDownloads[beatmapid]
+
+    if beatmapid not in beatmapDownloads:
+        beatmapDownloads[beatmapid] = asyncio.ensure_future(download())
+
 
+async def get_user(u: str, mode: int = 0) -> Optional[osu.User]:
+    return await osuApi.get_user(u, mode)
 
-def get_score_acc(score: osu.Score):
-    countmiss = int(score["countmiss"])
-    count50 = int(score["count50"])
-    count100 = int(score["count100"])
-    count300 = int(score["count300"])
-    # see https://osu.ppy.sh/wiki/en/Accuracy
-    acc = (count50 + 2 * count100 + 6 * count300) / (countmiss + count50 + count100 + count300) / 6 * 100
-    return round(acc, 2)
+
+async def get_beatmap(beatmapid: str) -> Optional[osu.Beatmap]:
+    return await osuApi.get_beatmap(beatmapid)
+
+
+async def get_top_scores(u: str, limit: int) -> Optional[List[osu.Score]]:
+    return await osuApi.get_top_scores(u, limit)
+
+
+async def get_recent_scores(u: str, limit: int, mode: int = 0) -> List[osu.Score]:
+    return await osuApi.get_recent_scores(u, limit, mode)
 
 
 def get_score_timedelta(score: osu.Score) -> str:
-    return cast(str, naturaltime(dt.datetime.utcnow() - dt.datetime.fromisoformat(score['date'])))
+    return cast(str, naturaltime(dt.datetime.utcnow() - score.playedAt))
 
 
 def osu_score_emoji(rank: osu.ScoreRank) -> Union[Emoji, str]:
     return OSU_SCORE_EMOJI_MAP[rank] if rank in OSU_SCORE_EMOJI_MAP else f'**{rank}**'
 
 
-if not TOKEN:
-    raise Exception('no discord bot token DISCORD_TOKEN provided in .env file')
-osu_auto_update.start()
-bot.run(TOKEN)
+if __name__ == '__main__':
+    if not TOKEN:
+        raise Exception('no discord bot token DISCORD_TOKEN provided in .env file')
+    compact_score_history.start()
+    if AUTO_UPDATE_MODE == 'workers':
+        deliver_polled_scores.start()
+    else:
+        osu_auto_update.start()
+    bot.run(TOKEN)
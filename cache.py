@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+import osu
+
+logger = logging.getLogger('discord')
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise Exception(f'Invalid cache capacity {capacity}')
+        self.capacity = capacity
+        self._entries: 'OrderedDict[K, V]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: K) -> Optional[V]:
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def peek(self, key: K) -> Optional[V]:
+        # like get, without counting a hit/miss or refreshing the entry's recency
+        return self._entries.get(key)
+
+    def put(self, key: K, value: V) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        return self._entries.pop(key, None)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# ranked, approved and loved beatmap metadata never changes so it is kept forever,
+# everything else (qualified, pending, WIP, graveyard) can still be edited by the mapper
+PERMANENT_BEATMAP_STATUSES = {1, 2, 4}
+UNRANKED_BEATMAP_TTL = 60 * 60
+
+
+class BeatmapCache:
+    '''
+        Two tier (in memory LRU + one json file per beatmap on disk) cache of beatmap metadata keyed by beatmap_id
+    '''
+
+    def __init__(self, directory: str = 'beatmap_cache', capacity: int = 2048, unrankedTTL: float = UNRANKED_BEATMAP_TTL):
+        self.directory = directory
+        self.unrankedTTL = unrankedTTL
+        self._memory: LRUCache[str, Tuple[osu.Beatmap, float]] = LRUCache(capacity)
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def is_fresh(self, beatmap: osu.Beatmap, cachedAt: float) -> bool:
+        if beatmap.approved in PERMANENT_BEATMAP_STATUSES:
+            return True
+        return time.time() - cachedAt < self.unrankedTTL
+
+    @staticmethod
+    def key(beatmapid: str, mods: int = 0) -> str:
+        # mod adjusted metadata (see osu.modded_beatmap) is cached separately per difficulty mod combination
+        return f'{beatmapid}_{mods}' if mods else f'{beatmapid}'
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, beatmapid: str, mods: int = 0) -> Optional[osu.Beatmap]:
+        key = self.key(beatmapid, mods)
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = self.read_disk(key)
+            if entry is not None and self.is_fresh(*entry):
+                self._memory.put(key, entry)
+                self.diskHits += 1
+                return entry[0]
+        elif self.is_fresh(*entry):
+            self.hits += 1
+            return entry[0]
+        self._memory.pop(key)
+        self.misses += 1
+        return None
+
+    def put(self, beatmap: osu.Beatmap, mods: int = 0) -> None:
+        key = self.key(beatmap.beatmap_id, mods)
+        cachedAt = time.time()
+        self._memory.put(key, (beatmap, cachedAt))
+        path = self.path(key)
+        try:
+            with open(f'{path}.tmp', 'w') as fp:
+                json.dump({'cached_at': cachedAt, 'beatmap': beatmap.to_dict()}, fp)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning(f'Failed to write beatmap cache file {path}: {e}')
+
+    def read_disk(self, key: str) -> Optional[Tuple[osu.Beatmap, float]]:
+        try:
+            with open(self.path(key), 'r') as fp:
+                entry = json.load(fp)
+            return osu.Beatmap.from_api(entry['beatmap']), float(entry['cached_at'])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Invalid beatmap cache file for {key}: {e}')
+            return None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'disk_hits': self.diskHits,
+            'misses': self.misses,
+            'size': len(self._memory),
+        }
+
+
+class ProfileCache:
+    '''
+        osu! user profiles keyed by (osuid, mode). Entries younger than `ttl` are fresh, entries younger than
+        `staleTTL` can still be served while a refresh happens in the background (stale-while-revalidate)
+    '''
+
+    def __init__(self, ttl: float = 60, staleTTL: float = 60 * 30, capacity: int = 4096):
+        self.ttl = ttl
+        self.staleTTL = max(staleTTL, ttl)
+        self._entries: LRUCache[Tuple[str, int], Tuple[osu.User, float]] = LRUCache(capacity)
+        self.hits = 0
+        self.staleHits = 0
+        self.misses = 0
+
+    def get(self, osuid: str, mode: int) -> Tuple[Optional[osu.User], bool]:
+        # returns (profile, fresh), profile is None if there is nothing servable cached
+        entry = self._entries.get((str(osuid), mode))
+        if entry is not None:
+            age = time.monotonic() - entry[1]
+            if age < self.ttl:
+                self.hits += 1
+                return entry[0], True
+            if age < self.staleTTL:
+                self.staleHits += 1
+                return entry[0], False
+        self.misses += 1
+        return None, False
+
+    def put(self, osuid: str, mode: int, user: osu.User) -> None:
+        self._entries.put((str(osuid), mode), (user, time.monotonic()))
+
+    def fetched_at(self, osuid: str, mode: int) -> Optional[float]:
+        # wall clock time (time.time()) the cached profile was fetched at
+        entry = self._entries.peek((str(osuid), mode))
+        return time.time() - (time.monotonic() - entry[1]) if entry is not None else None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'stale_hits': self.staleHits,
+            'misses': self.misses,
+            'size': len(self._entries),
+        }
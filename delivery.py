@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from discord import Embed, HTTPException
+from discord.abc import Messageable
+
+logger = logging.getLogger('discord')
+
+# discord limits (https://discord.com/developers/docs/resources/channel#embed-object-embed-limits)
+MESSAGE_CONTENT_LIMIT = 2000
+EMBED_TOTAL_LIMIT = 6000
+EMBED_FIELD_LIMIT = 25
+EMBED_FIELD_NAME_LIMIT = 256
+EMBED_FIELD_VALUE_LIMIT = 1024
+
+# discord allows 5 messages per 5 seconds per channel. discord.py follows the rate limit headers of each bucket, this
+# only spreads a channel's sends out so batches don't drain the bucket in one burst
+CHANNEL_SEND_INTERVAL = 1.0
+# sends failing with these won't work later either (channel deleted, missing permissions)
+PERMANENT_FAILURE_STATUSES = {403, 404}
+
+
+class Delivery(NamedTuple):
+    content: str
+    embeds: List[Embed]
+
+
+def truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else f'{text[:limit - 3]}...'
+
+
+def combine_embeds(embeds: List[Embed]) -> List[Tuple[Embed, List[int]]]:
+    '''
+        Packs many embeds into as few embeds as possible by turning each one into a field (author name as the field
+        name, description as the value) while staying under the embed size limits. Each combined embed comes with the
+        indexes of the embeds it holds
+    '''
+    combined: List[Tuple[Embed, List[int]]] = []
+    current: Optional[Embed] = None
+    size = 0
+    for i, embed in enumerate(embeds):
+        name = truncate(str(embed.author.name) if embed.author.name else '\u200b', EMBED_FIELD_NAME_LIMIT)
+        value = truncate(str(embed.description) if embed.description else '\u200b', EMBED_FIELD_VALUE_LIMIT)
+        if current is None or len(current.fields) >= EMBED_FIELD_LIMIT or size + len(name) + len(value) > EMBED_TOTAL_LIMIT:
+            current = Embed(type='rich', color=embed.color)
+            if embed.thumbnail.url:
+                current.set_thumbnail(url=embed.thumbnail.url)
+            combined.append((current, []))
+            size = 0
+        current.add_field(name=name, value=value, inline=False)
+        combined[-1][1].append(i)
+        size += len(name) + len(value)
+    return combined
+
+
+class DeliveryQueue:
+    '''
+        Outbound message queue per channel. Each channel is drained by its own background task which packs everything
+        queued since its last send into as few messages as possible, so callers never wait on discord.
+
+        `enqueue` returns a future that resolves to True once the delivery is settled (sent, or dropped because it can
+        never be sent) and False if sending failed in a way that may work later, so the caller can retry it
+    '''
+
+    def __init__(self, sendInterval: float = CHANNEL_SEND_INTERVAL):
+        self.sendInterval = sendInterval
+        self._queues: Dict[int, Deque[Tuple[Delivery, 'asyncio.Future[bool]']]] = {}
+        self._channels: Dict[int, Messageable] = {}
+        self._workers: Dict[int, 'asyncio.Task[None]'] = {}
+        self._nextSend: Dict[int, float] = {}
+        self.sent = 0
+        self.failed = 0
+
+    def enqueue(self, channel: Messageable, content: str = '', embeds: List[Embed] = []) -> 'asyncio.Future[bool]':
+        cid = channel.id  # type: ignore
+        settled: 'asyncio.Future[bool]' = asyncio.get_event_loop().create_future()
+        self._channels[cid] = channel
+        self._queues.setdefault(cid, deque()).append((Delivery(content, list(embeds)), settled))
+        if cid not in self._workers:
+            self._workers[cid] = asyncio.ensure_future(self._drain(cid))
+        return settled
+
+    @property
+    def backlog(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def join(self) -> None:
+        # waits until everything queued so far has been sent (or given up on)
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def pack(self, deliveries: List[Delivery]) -> List[Tuple[Delivery, Set[int]]]:
+        # contents are joined into as few messages as fit, a lone embed is sent as is and several embeds are
+        # combined, with the contents going on the first message. Each message comes with the indexes of the
+        # deliveries that have content or embeds in it
+        messages: List[Tuple[Delivery, Set[int]]] = []
+        contents: List[str] = []
+        contentSources: Set[int] = set()
+        embeds: List[Embed] = []
+        embedSources: List[int] = []
+
+        def flush() -> None:
+            if len(embeds) > 1:
+                packedEmbeds = [(embed, {embedSources[i] for i in packed}) for embed, packed in combine_embeds(embeds)]
+            else:
+                packedEmbeds = [(embed, {source}) for embed, source in zip(embeds, embedSources)]
+            if contents or packedEmbeds:
+                first, firstSources = packedEmbeds[0] if packedEmbeds else (None, set())
+                messages.append((Delivery('\n'.join(contents), [first] if first else []), contentSources | firstSources))
+                messages.extend((Delivery('', [embed]), sources) for embed, sources in packedEmbeds[1:])
+            contents.clear()
+            contentSources.clear()
+            embeds.clear()
+            embedSources.clear()
+
+        for i, delivery in enumerate(deliveries):
+            content = truncate(delivery.content, MESSAGE_CONTENT_LIMIT)
+            if contents and len('\n'.join([*contents, content])) > MESSAGE_CONTENT_LIMIT:
+                flush()
+            if content:
+                contents.append(content)
+                contentSources.add(i)
+            embeds.extend(delivery.embeds)
+            embedSources.extend(i for _ in delivery.embeds)
+        flush()
+        return messages
+
+    async def _drain(self, cid: int) -> None:
+        queue = self._queues[cid]
+        channel = self._channels[cid]
+        pending: List[Tuple[Delivery, 'asyncio.Future[bool]']] = []
+        try:
+            while queue:
+                pending = list(queue)
+                queue.clear()
+                # a delivery packed into several messages is only settled once all of them are
+                unsettled: Set[int] = set()
+                for message, sources in self.pack([delivery for delivery, _ in pending]):
+                    if not await self._send(cid, channel, message):
+                        unsettled |= sources
+                for i, (_, future) in enumerate(pending):
+                    if not future.done():
+                        future.set_result(i not in unsettled)
+        except Exception as e:
+            logger.error(f'Message delivery worker for channel {cid} failed: {e}')
+        finally:
+            for _, future in pending:
+                if not future.done():
+                    future.set_result(False)
+            del self._workers[cid]
+            if not queue:
+                del self._queues[cid]
+                del self._channels[cid]
+        if queue:
+            # more was queued while a failed send was in progress
+            self._workers[cid] = asyncio.ensure_future(self._drain(cid))
+
+    async def _send(self, cid: int, channel: Messageable, message: Delivery) -> bool:
+        # False if the message wasn't sent but could be later. discord.py already waits out exhausted rate limit
+        # buckets and retries 429s itself, a 429 that reaches us means it gave up and is left to the caller's retry
+        delay = self._nextSend.get(cid, 0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._nextSend[cid] = time.monotonic() + self.sendInterval
+        try:
+            await channel.send(message.content or None, embed=message.embeds[0] if message.embeds else None)
+        except HTTPException as e:
+            logger.error(f'Message delivery to channel {cid} failed: {e}')
+            self.failed += 1
+            return e.status in PERMANENT_FAILURE_STATUSES
+        self.sent += 1
+        return True
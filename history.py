@@ -0,0 +1,264 @@
+import bisect
+import calendar
+import datetime as dt
+import math
+import sqlite3
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import backend
+import osu
+
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS score_history (
+    osuid       TEXT NOT NULL,
+    mode        INTEGER NOT NULL,
+    segment     INTEGER NOT NULL,
+    score_ids   BLOB NOT NULL,
+    beatmap_ids BLOB NOT NULL,
+    mods        BLOB NOT NULL,
+    pp          BLOB NOT NULL,
+    accuracy    BLOB NOT NULL,
+    dates       BLOB NOT NULL,
+    ranks       BLOB NOT NULL,
+    PRIMARY KEY (osuid, mode, segment)
+);
+'''
+
+# (column, array typecode). pp is NaN for scores without pp (e.g. failed recent plays), dates are unix seconds (UTC)
+# and ranks index into RANKS (UNKNOWN_RANK for ranks the api added after this list)
+HISTORY_COLUMNS = (
+    ('score_ids', 'q'),
+    ('beatmap_ids', 'q'),
+    ('mods', 'q'),
+    ('pp', 'd'),
+    ('accuracy', 'd'),
+    ('dates', 'q'),
+    ('ranks', 'b'),
+)
+UNKNOWN_RANK = '?'
+# stored codes are indexes into this, only ever append to it
+RANKS: Tuple[str, ...] = ('F', 'D', 'C', 'B', 'A', 'S', 'SH', 'X', 'XH', 'SS', 'SSH', UNKNOWN_RANK)
+# a user's segments are merged back into one once there are more than this many
+HISTORY_MAX_SEGMENTS = 16
+
+
+class HistoryScore(NamedTuple):
+    osuid: str
+    mode: int
+    score_id: int
+    beatmap_id: int
+    mods: int
+    pp: Optional[float]
+    accuracy: float
+    date: dt.datetime
+    rank: str
+
+
+def timestamp(date: dt.datetime) -> int:
+    return calendar.timegm(date.timetuple()) if date != dt.datetime.min else 0
+
+
+class UserHistory:
+    '''
+        One user's scores in one mode, a typed array per column. Rows are only ever appended; `dates` keeps row
+        numbers sorted by date for range queries
+    '''
+
+    def __init__(self, osuid: str, mode: int):
+        self.osuid = osuid
+        self.mode = mode
+        self.columns: Dict[str, array] = {name: array(typecode) for name, typecode in HISTORY_COLUMNS}
+        # (date, beatmap id) of every row, a play is identified by when and on what map it was set
+        # (recent plays that weren't submitted have no score id)
+        self.keys: Set[Tuple[int, int]] = set()
+        self.dates: List[Tuple[int, int]] = []
+        self.segments = 0
+
+    def __len__(self) -> int:
+        return len(self.columns['dates'])
+
+    def append(self, rows: Dict[str, array]) -> List[int]:
+        # returns the row numbers of the rows that weren't already stored
+        added = []
+        for i in range(len(rows['dates'])):
+            key = (rows['dates'][i], rows['beatmap_ids'][i])
+            if key in self.keys:
+                continue
+            self.keys.add(key)
+            row = len(self)
+            for name, _ in HISTORY_COLUMNS:
+                self.columns[name].append(rows[name][i])
+            bisect.insort(self.dates, (rows['dates'][i], row))
+            added.append(row)
+        return added
+
+    def score(self, row: int) -> HistoryScore:
+        pp = self.columns['pp'][row]
+        return HistoryScore(
+            self.osuid,
+            self.mode,
+            self.columns['score_ids'][row],
+            self.columns['beatmap_ids'][row],
+            self.columns['mods'][row],
+            None if math.isnan(pp) else pp,
+            self.columns['accuracy'][row],
+            dt.datetime.utcfromtimestamp(self.columns['dates'][row]),
+            RANKS[self.columns['ranks'][row]],
+        )
+
+
+class ScoreHistory:
+    '''
+        Every score the bot has seen, kept per (user, mode) as column arrays and indexed by beatmap so history is
+        answered without the osu! api. Writes are append only: each `record` stores its new rows as one more segment
+        (one row of array blobs) and a user's segments are compacted into one once they pile up.
+
+        Several processes (shard groups) may write the same user's history, so segment numbers are allocated and
+        compaction re-reads the user's stored segments inside the write transaction
+    '''
+
+    def __init__(self, path: str, maxSegments: int = HISTORY_MAX_SEGMENTS):
+        self.conn = backend.connect(path)
+        self.conn.executescript(HISTORY_SCHEMA)
+        self.maxSegments = maxSegments
+        self.users: Dict[Tuple[str, int], UserHistory] = {}
+        # (beatmap id, mode) -> (osu id, row) of every score on that beatmap
+        self.beatmaps: Dict[Tuple[int, int], List[Tuple[str, int]]] = {}
+        # mode -> (date, osu id, row) of every score in that mode, sorted on the first range query after new rows
+        self.dates: Dict[int, List[Tuple[int, str, int]]] = {}
+        self._unsorted: Set[int] = set()
+        self.load()
+
+    def __len__(self) -> int:
+        return sum(len(history) for history in self.users.values())
+
+    def load(self) -> None:
+        for row in self.conn.execute('SELECT * FROM score_history ORDER BY osuid, mode, segment'):
+            history = self._history(row['osuid'], row['mode'])
+            self._index(history, history.append(self._columns(row)))
+            history.segments += 1
+
+    @staticmethod
+    def _columns(row: sqlite3.Row) -> Dict[str, array]:
+        columns = {}
+        for name, typecode in HISTORY_COLUMNS:
+            columns[name] = array(typecode)
+            columns[name].frombytes(row[name])
+        return columns
+
+    def _history(self, osuid: str, mode: int) -> UserHistory:
+        history = self.users.get((osuid, mode))
+        if history is None:
+            history = self.users[(osuid, mode)] = UserHistory(osuid, mode)
+        return history
+
+    def _index(self, history: UserHistory, rows: Iterable[int]) -> None:
+        beatmapIds = history.columns['beatmap_ids']
+        dates = history.columns['dates']
+        modeDates = self.dates.setdefault(history.mode, [])
+        for row in rows:
+            self.beatmaps.setdefault((beatmapIds[row], history.mode), []).append((history.osuid, row))
+            modeDates.append((dates[row], history.osuid, row))
+        self._unsorted.add(history.mode)
+
+    def record(self, scores: Iterable[osu.Score], mode: int = 0) -> int:
+        # returns how many of the scores were new
+        byUser: Dict[str, Dict[str, array]] = {}
+        for score in scores:
+            if not score.user_id or not score.beatmap_id:
+                continue
+            columns = byUser.get(score.user_id)
+            if columns is None:
+                columns = byUser[score.user_id] = {name: array(typecode) for name, typecode in HISTORY_COLUMNS}
+            columns['score_ids'].append(int(score.score_id or 0))
+            columns['beatmap_ids'].append(int(score.beatmap_id))
+            columns['mods'].append(score.enabled_mods)
+            columns['pp'].append(score.pp if score.pp is not None else math.nan)
+            columns['accuracy'].append(score.accuracy)
+            columns['dates'].append(timestamp(score.playedAt))
+            columns['ranks'].append(RANKS.index(score.rank if score.rank in RANKS else UNKNOWN_RANK))
+
+        appended: List[Tuple[UserHistory, List[int]]] = []
+        for osuid, columns in byUser.items():
+            history = self._history(osuid, mode)
+            rows = history.append(columns)
+            if rows:
+                self._index(history, rows)
+                appended.append((history, rows))
+        if not appended:
+            return 0
+        with backend.transaction(self.conn) as conn:
+            for history, rows in appended:
+                segment, segments = conn.execute(
+                    'SELECT COALESCE(MAX(segment) + 1, 0), COUNT(*) FROM score_history WHERE osuid = ? AND mode = ?',
+                    (history.osuid, mode),
+                ).fetchone()
+                conn.execute(
+                    f'INSERT INTO score_history (osuid, mode, segment, {", ".join(name for name, _ in HISTORY_COLUMNS)}) '
+                    f'VALUES (?, ?, ?, {", ".join("?" for _ in HISTORY_COLUMNS)})',
+                    (history.osuid, mode, segment, *(self._segment(history, name, rows) for name, _ in HISTORY_COLUMNS)),
+                )
+                history.segments = segments + 1
+                if history.segments > self.maxSegments:
+                    self._compact(conn, history)
+        return sum(len(rows) for _, rows in appended)
+
+    @staticmethod
+    def _segment(history: UserHistory, name: str, rows: List[int]) -> bytes:
+        # rows are always appended at the end so a new segment is a slice of the column
+        return history.columns[name][rows[0]:rows[-1] + 1].tobytes()
+
+    def _compact(self, conn: sqlite3.Connection, history: UserHistory) -> None:
+        # other processes' segments are merged in first so rewriting the user as one segment doesn't drop them
+        for row in conn.execute(
+            'SELECT * FROM score_history WHERE osuid = ? AND mode = ?', (history.osuid, history.mode)
+        ).fetchall():
+            self._index(history, history.append(self._columns(row)))
+        conn.execute('DELETE FROM score_history WHERE osuid = ? AND mode = ?', (history.osuid, history.mode))
+        conn.execute(
+            f'INSERT INTO score_history (osuid, mode, segment, {", ".join(name for name, _ in HISTORY_COLUMNS)}) '
+            f'VALUES (?, ?, 0, {", ".join("?" for _ in HISTORY_COLUMNS)})',
+            (history.osuid, history.mode, *(history.columns[name].tobytes() for name, _ in HISTORY_COLUMNS)),
+        )
+        history.segments = 1
+
+    def compact(self) -> int:
+        # merges the segments of every user with more than one (including ones other processes wrote), returns how
+        # many users were compacted
+        with backend.transaction(self.conn) as conn:
+            compacted = conn.execute(
+                'SELECT osuid, mode FROM score_history GROUP BY osuid, mode HAVING COUNT(*) > 1'
+            ).fetchall()
+            for osuid, mode in compacted:
+                self._compact(conn, self._history(osuid, mode))
+        return len(compacted)
+
+    def user_scores(self, osuid: str, mode: int = 0) -> List[HistoryScore]:
+        # oldest first
+        history = self.users.get((str(osuid), mode))
+        return [history.score(row) for _, row in history.dates] if history else []
+
+    def beatmap_scores(self, beatmapid: int, mode: int = 0) -> List[HistoryScore]:
+        return [
+            self.users[(osuid, mode)].score(row) for osuid, row in self.beatmaps.get((int(beatmapid), mode), ())
+        ]
+
+    def between(self, start: dt.datetime, end: dt.datetime, mode: int = 0) -> List[HistoryScore]:
+        # scores set in [start, end) by anyone, oldest first
+        dates = self.dates.get(mode, [])
+        if mode in self._unsorted:
+            # rows mostly arrive in date order, so this is close to linear
+            dates.sort()
+            self._unsorted.discard(mode)
+        lo = bisect.bisect_left(dates, (timestamp(start),))
+        hi = bisect.bisect_left(dates, (timestamp(end),))
+        return [self.users[(osuid, mode)].score(row) for _, osuid, row in dates[lo:hi]]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            'scores': len(self),
+            'users': len(self.users),
+            'segments': sum(history.segments for history in self.users.values()),
+        }
@@ -0,0 +1,120 @@
+import bisect
+import time
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+import backend
+import osu
+
+INF = float('inf')
+
+# sort key per leaderboard ordering, ties go to the lower osu id
+LEADERBOARD_ORDERINGS: Mapping[str, Callable[[osu.User], Tuple[float, ...]]] = {
+    'rank': lambda user: (user.pp_rank or INF, -user.level),
+    'pp': lambda user: (-user.pp_raw, user.pp_rank or INF),
+    'acc': lambda user: (-user.accuracy,),
+    'playcount': lambda user: (-user.playcount,),
+    'level': lambda user: (-user.level,),
+}
+
+
+class Leaderboard:
+    '''
+        Materialized leaderboard for one (guild, mode): the latest profile of every member plus one sorted list per
+        ordering, kept sorted as profiles come in so reading a page never sorts
+    '''
+
+    def __init__(self, gid: int, mode: int):
+        self.gid = gid
+        self.mode = mode
+        # discord user id -> osu id, as registered
+        self.members: Dict[str, str] = {}
+        # osu id -> (profile, when it was fetched)
+        self.profiles: Dict[str, Tuple[osu.User, float]] = {}
+        self.orders: Dict[str, List[Tuple[Tuple[float, ...], int, str]]] = {name: [] for name in LEADERBOARD_ORDERINGS}
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    @staticmethod
+    def entry(ordering: str, user: osu.User) -> Tuple[Tuple[float, ...], int, str]:
+        return LEADERBOARD_ORDERINGS[ordering](user), int(user.user_id or 0), user.user_id
+
+    def update(self, user: osu.User, fetchedAt: float) -> None:
+        self.remove(user.user_id)
+        self.profiles[user.user_id] = (user, fetchedAt)
+        for ordering, entries in self.orders.items():
+            bisect.insort(entries, self.entry(ordering, user))
+
+    def remove(self, osuid: str) -> None:
+        previous = self.profiles.pop(osuid, None)
+        if previous is None:
+            return
+        for ordering, entries in self.orders.items():
+            entry = self.entry(ordering, previous[0])
+            i = bisect.bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+
+    def ranking(self, ordering: str = 'rank') -> List[osu.User]:
+        return [self.profiles[osuid][0] for _, _, osuid in self.orders[ordering]]
+
+    def oldest(self) -> Optional[float]:
+        # fetch time of the oldest profile, i.e. how stale the board can be
+        return min((fetchedAt for _, fetchedAt in self.profiles.values()), default=None)
+
+    def stale(self, maxAge: float) -> List[str]:
+        cutoff = time.time() - maxAge
+        return [osuid for osuid, (_, fetchedAt) in self.profiles.items() if fetchedAt < cutoff]
+
+
+class GuildLeaderboards:
+    '''
+        Leaderboards per (guild, mode), fed by every profile the bot fetches (see OsuApiClient.profileListeners) so
+        $lb can answer from the stored orderings. Members are synced with the backend whenever a board is read
+    '''
+
+    def __init__(self):
+        self.boards: Dict[Tuple[int, int], Leaderboard] = {}
+        # (osu id, mode) -> guilds that have that osu id on their leaderboard
+        self._guilds: Dict[Tuple[str, int], Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.boards)
+
+    def update_profile(self, user: osu.User, mode: int, fetchedAt: Optional[float] = None) -> None:
+        # `fetchedAt` for profiles that weren't just fetched (e.g. served from ProfileCache), defaults to now
+        fetchedAt = fetchedAt or time.time()
+        for gid in self._guilds.get((user.user_id, mode), ()):
+            self.boards[(gid, mode)].update(user, fetchedAt)
+
+    def get(self, gid: int, mode: int) -> Tuple[Leaderboard, List[Tuple[str, str]]]:
+        '''
+            The (guild, mode) leaderboard and the (uid, osuid) members it has no profile for yet
+        '''
+        board = self.boards.get((gid, mode))
+        if board is None:
+            board = self.boards[(gid, mode)] = Leaderboard(gid, mode)
+        members = backend.read_guild_members(gid)
+        if members != board.members:
+            self.sync_members(board, members)
+        return board, [(uid, osuid) for uid, osuid in members.items() if osuid not in board.profiles]
+
+    def sync_members(self, board: Leaderboard, members: Dict[str, str]) -> None:
+        osuids = set(members.values())
+        for osuid in set(board.members.values()) - osuids:
+            board.remove(osuid)
+            guilds = self._guilds.get((osuid, board.mode))
+            if guilds is not None:
+                guilds.discard(board.gid)
+                if not guilds:
+                    del self._guilds[(osuid, board.mode)]
+        for osuid in osuids:
+            self._guilds.setdefault((osuid, board.mode), set()).add(board.gid)
+        board.members = dict(members)
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'boards': len(self.boards),
+            'profiles': sum(len(board) for board in self.boards.values()),
+        }
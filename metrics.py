@@ -0,0 +1,210 @@
+import bisect
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from aiohttp import web
+
+logger = logging.getLogger('discord')
+
+LabelValues = Tuple[str, ...]
+# callbacks return a single value, or values keyed by label values for labelled metrics
+MetricCallback = Callable[[], Union[float, Dict[LabelValues, float]]]
+
+# seconds, covers everything from cache hits to slow osu!track updates
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SWEEP_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return f'{int(value)}' if float(value).is_integer() else f'{value:.6g}'
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), callback: Optional[MetricCallback] = None):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labels)
+        self.callback = callback
+        self.values: Dict[LabelValues, float] = {}
+
+    def key(self, labels: Dict[str, object]) -> LabelValues:
+        if len(labels) != len(self.labelNames):
+            raise Exception(f'Invalid labels {labels} for metric {self.name}')
+        return tuple(str(labels[name]) for name in self.labelNames)
+
+    def collect(self) -> Dict[LabelValues, float]:
+        if self.callback is None:
+            return self.values
+        values = self.callback()
+        return values if isinstance(values, dict) else {(): values}
+
+    def get(self, **labels: object) -> float:
+        return self.collect().get(self.key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self.collect().values())
+
+    def render(self) -> List[str]:
+        return [
+            f'{self.name}{format_labels(self.labelNames, labelValues)} {format_value(value)}'
+            for labelValues, value in sorted(self.collect().items())
+        ]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: object) -> None:
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: observation count per bucket (last one is +Inf), sum and count
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self.key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def time(self, **labels: object) -> 'Timer':
+        return Timer(self, labels)
+
+    def count(self, **labels: object) -> int:
+        return sum(self.counts.get(self.key(labels), ()))
+
+    def sum(self, **labels: object) -> float:
+        return self.sums.get(self.key(labels), 0)
+
+    def label_values(self) -> List[LabelValues]:
+        return sorted(self.counts)
+
+    def quantile(self, q: float, **labels: object) -> Optional[float]:
+        # estimated by interpolating inside the bucket the quantile falls in, like prometheus' histogram_quantile
+        counts = self.counts.get(self.key(labels))
+        if not counts:
+            return None
+        rank = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = []
+        names = (*self.labelNames, 'le')
+        for key in sorted(self.counts):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), self.counts[key]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(names, (*key, format_value(bound)))} {cumulative}')
+            labels = format_labels(self.labelNames, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(self.sums[key])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, object]):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Metrics:
+    '''
+        Registry of counters, gauges and histograms, rendered in the prometheus text format. Metrics with a callback
+        are read when collected (used to expose stats the caches/rate limiter already keep)
+    '''
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise Exception(f'Metric {metric.name} already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = (), callback: Optional[MetricCallback] = None) -> Counter:
+        return self.register(Counter(name, help, labels, callback))  # type: ignore
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), callback: Optional[MetricCallback] = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, callback))  # type: ignore
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))  # type: ignore
+
+    def __getitem__(self, name: str) -> Metric:
+        return self.metrics[name]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            try:
+                samples = metric.render()
+            except Exception as e:
+                logger.error(f'Failed to collect metric {metric.name}: {e}')
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(metrics: Metrics, host: str, port: int) -> web.AppRunner:
+    '''
+        Serves metrics.render() at http://host:port/metrics, cleanup() the returned runner to stop
+    '''
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode(), headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
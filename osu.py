@@ -1,4 +1,6 @@
-from typing import TypedDict, Union, List
+import datetime as dt
+from functools import lru_cache
+from typing import Any, Callable, ClassVar, Dict, List, Mapping, Optional, Tuple, Type, TypedDict, TypeVar, Union
 from urllib.parse import quote
 
 from typing_extensions import Literal
@@ -8,24 +10,96 @@ from typing_extensions import Literal
 # osu!track api (ameo): https://github.com/Ameobea/osutrack-api
 ScoreRank = Literal['F', 'D', 'C', 'B', 'A', 'S', 'SH', 'X', 'SS', 'XH', 'SSH']
 
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def decode_int(value: Any) -> int:
+    # the api sends numbers as strings and null for missing stats (e.g. pp_rank of inactive players)
+    return int(value) if value not in (None, '') else 0
+
+
+def decode_float(value: Any) -> float:
+    return float(value) if value not in (None, '') else 0.0
+
+
+def decode_str(value: Any) -> str:
+    return str(value) if value is not None else ''
+
+
+@lru_cache(maxsize=32768)
+def parse_date(value: str) -> dt.datetime:
+    # the same top score dates come back on every poll, so parsed dates are cached
+    return dt.datetime.fromisoformat(value) if value else dt.datetime.min
+
+
+def encode(value: Any) -> Any:
+    if isinstance(value, Record):
+        return value.to_dict()
+    return value
+
+
+FIELD_DECODERS: Dict[Any, Callable[[Any], Any]] = {
+    int: decode_int,
+    float: decode_float,
+    str: decode_str,
+}
+
+
+R = TypeVar('R', bound='Record')
+
+
+class Record:
+    '''
+        Api response decoded once into typed attributes. Fields are declared as annotations and converted with the
+        decoder for their type (anything without one is kept as is), subclasses list the same names in __slots__
+    '''
+    __slots__ = ()
+    _decoders: ClassVar[Dict[str, Callable[[Any], Any]]] = {}
+
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        cls._decoders = {
+            name: FIELD_DECODERS.get(annotation, lambda value: value)
+            for name, annotation in cls.__dict__.get('__annotations__', {}).items()
+        }
+
+    def __init__(self, **fields: Any):
+        for name, decode in self._decoders.items():
+            setattr(self, name, fields[name] if name in fields else decode(None))
+
+    @classmethod
+    def from_api(cls: Type[R], data: Mapping[str, Any]) -> R:
+        return cls(**{name: decode(data.get(name)) for name, decode in cls._decoders.items()})
+
+    def to_dict(self) -> Dict[str, Any]:
+        # json serializable, from_api(record.to_dict()) gives back an equal record
+        return {name: encode(getattr(self, name)) for name in self._decoders}
+
+    def copy(self: R) -> R:
+        return type(self)(**{name: getattr(self, name) for name in self._decoders})
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({", ".join(f"{name}={getattr(self, name)!r}" for name in self._decoders)})'
+
+
 # fmt: off
-class Beatmap(TypedDict):
+class Beatmap(Record):
     approved             : int      # 4 = loved, 3 = qualified, 2 = approved, 1 = ranked, 0 = pending, -1 = WIP, -2 = graveyard
     submit_date          : str      # date submitted, in UTC
     approved_date        : str      # date ranked, in UTC
     artist               : str
     beatmap_id           : str      # beatmap_id is per difficulty
     beatmapset_id        : str      # beatmapset_id groups difficulties into a set
-    bpm                  : int
+    bpm                  : float
     creator              : str
     creator_id           : str
     difficultyrating     : float    # The amount of stars the map would have ingame and on the website
     diff_aim             : float
     diff_speed           : float
-    diff_size            : int      # Circle size value (CS)
+    diff_size            : float    # Circle size value (CS)
     diff_overall         : float    # Overall difficulty (OD)
-    diff_approach        : int      # Approach Rate (AR)
-    diff_drain           : int      # Health drain (HP)
+    diff_approach        : float    # Approach Rate (AR)
+    diff_drain           : float    # Health drain (HP)
     hit_length           : int      # seconds from first note to last note not including breaks
     source               : str
     genre_id             : int      # 0 = any, 1 = unspecified, 2 = video game, 3 = anime, 4 = rock, 5 = pop, 6 = other, 7 = novelty, 9 = hip hop, 10 = electronic, 11 = metal, 12 = classical, 13 = folk, 14 = jazz (note that there's no 8)
@@ -42,9 +116,11 @@ class Beatmap(TypedDict):
     count_slider         : int
     count_spinner        : int
     max_combo            : int      # The maximum combo a user can reach playing this beatmap
+    mods                 : int      # difficulty mods the stats/star rating have been adjusted for (not part of api response)
+    __slots__ = tuple(__annotations__)
 
 
-class Score(TypedDict):
+class Score(Record):
     beatmap_id          : str
     score_id            : str
     score               : int
@@ -55,20 +131,39 @@ class Score(TypedDict):
     countmiss           : int
     countkatu           : int
     countgeki           : int
-    perfect             : Literal[0, 1]     # 1 = maximum combo of map reached, 0 otherwise
+    perfect             : int               # 1 = maximum combo of map reached, 0 otherwise
     enabled_mods        : int               # bitwise flag representation of mods used. see reference
-    user_id             : int
-    date                : str               # UTC
+    user_id             : str
+    date                : str               # UTC, 'YYYY-MM-DD HH:MM:SS' so dates order as strings. see playedAt
     rank                : ScoreRank
-    pp                  : float             # float value, 4 decimals
-    replay_available    : Literal[0, 1]
-    meta                : Beatmap           # beatmap metadata attached to score for use in embeds
+    pp                  : Optional[float]   # float value, 4 decimals. null for recent scores
+    replay_available    : int               # 1 = replay can be downloaded, 0 otherwise
+    meta                : Optional[Beatmap] # beatmap metadata attached to score for use in embeds
     ranking             : int               # -1 to 99 represents the score's ranking within a users top scores (-1 if not a top score)
                                             # present in ameo osu!track update responses
                                             # manually filled in from osu api responses (based on index in get_user_best)
-
-
-class User(TypedDict):
+    # derived from the fields above when decoded
+    accuracy            : float             # percent, rounded to 2 decimals
+    modNames            : Tuple[str, ...]   # e.g. ('HD', 'DT')
+    __slots__ = tuple(__annotations__)
+
+    @classmethod
+    def from_api(cls, data: Mapping[str, Any]) -> 'Score':
+        score = super().from_api(data)
+        score.pp = float(data['pp']) if data.get('pp') not in (None, '') else None
+        score.ranking = int(data['ranking']) if data.get('ranking') is not None else -1
+        score.meta = Beatmap.from_api(data['meta']) if data.get('meta') else None
+        score.accuracy = hit_accuracy(score.count300, score.count100, score.count50, score.countmiss)
+        score.modNames = mod_names(score.enabled_mods)
+        return score
+
+    @property
+    def playedAt(self) -> dt.datetime:
+        # parsed on use, detecting new scores only compares the date strings
+        return parse_date(self.date)
+
+
+class User(Record):
     user_id              : str
     username             : str
     join_date            : str      # In UTC
@@ -78,7 +173,7 @@ class User(TypedDict):
     playcount            : int      # Only counts ranked, approved, and loved beatmaps
     ranked_score         : int      # Counts the best individual score on each ranked, approved, and loved beatmaps
     total_score          : int      # Counts every score on ranked, approved, and loved beatmaps
-    pp_rank              : int
+    pp_rank              : int      # 0 for inactive players
     level                : float
     pp_raw               : float    # For inactive players this will be 0 to purge them from leaderboards
     accuracy             : float
@@ -86,10 +181,11 @@ class User(TypedDict):
     count_rank_ssh       : int
     count_rank_s         : int      # Counts for SS/SSH/S/SH/A ranks on maps
     count_rank_sh        : int
-    count_rank_a         : int    
-    country              : int      # Uses the ISO3166-1 alpha-2 country code naming. See this for more information: https:#en.wikipedia.org/wiki/ISO_3166-1_alpha-2)
+    count_rank_a         : int
+    country              : str      # Uses the ISO3166-1 alpha-2 country code naming. See this for more information: https:#en.wikipedia.org/wiki/ISO_3166-1_alpha-2)
     total_seconds_played : int
     pp_country_rank      : int      # The user's rank in the country.
+    __slots__ = tuple(__annotations__)
 
 
 # response from osu!track api update requrest
@@ -186,26 +282,132 @@ MODE_STRING_MAPPING = {
 # fmt: on
 
 
-def mod_string(modnum, nm='NM'):
+# names of the mods set in every possible value of each byte of the bitmask (in MODS_ENUM order), so decoding a
+# bitmask takes one lookup per byte instead of checking all 30 mods
+MOD_BYTE_NAMES: List[List[Tuple[str, ...]]] = [
+    [
+        tuple(mod for mod, value in MODS_ENUM.items() if (value >> (8 * i)) & 0xFF & byte)
+        for byte in range(256)
+    ]
+    for i in range(4)
+]
+
+
+def mod_names(modnum: int) -> Tuple[str, ...]:
+    # e.g. ('HD', 'DT'), NC/PF imply DT/SD so those are left out
+    names = (
+        MOD_BYTE_NAMES[0][modnum & 0xFF] + MOD_BYTE_NAMES[1][(modnum >> 8) & 0xFF]
+        + MOD_BYTE_NAMES[2][(modnum >> 16) & 0xFF] + MOD_BYTE_NAMES[3][(modnum >> 24) & 0xFF]
+    )
+    if modnum & MODS_ENUM['NC'] or modnum & MODS_ENUM['PF']:
+        implied = ('DT' if modnum & MODS_ENUM['NC'] else '', 'SD' if modnum & MODS_ENUM['PF'] else '')
+        names = tuple(mod for mod in names if mod not in implied)
+    return names
+
+
+def mod_string(modnum: int, nm: str = 'NM') -> str:
     # e.g. '+HDDT'
-    modStrs = []
-    for mod in MODS_ENUM:
-        if MODS_ENUM[mod] & modnum != 0:
-            modStrs.append(mod)
-    if len(modStrs):
-        if 'NC' in modStrs and 'DT' in modStrs:
-            modStrs.remove('DT')
-        if 'PF' in modStrs and 'SD' in modStrs:
-            modStrs.remove('SD')
-        return f'+{"".join(modStrs)}'
-    else:
-        return nm
+    names = mod_names(modnum)
+    return f'+{"".join(names)}' if names else nm
 
 
-def update_score_difficulty(score: Score):
+def hit_accuracy(count300: int, count100: int, count50: int, countmiss: int) -> float:
+    # see https://osu.ppy.sh/wiki/en/Accuracy
+    hits = count300 + count100 + count50 + countmiss
+    return round((count50 + 2 * count100 + 6 * count300) / hits / 6 * 100, 2) if hits else 0.0
+
+
+# mods that change beatmap difficulty (and the star rating returned by get_beatmaps with the `mods` param)
+DIFFICULTY_MODS = MODS_ENUM['EZ'] | MODS_ENUM['HR'] | MODS_ENUM['DT'] | MODS_ENUM['HT'] | MODS_ENUM['NC']
+
+
+def difficulty_mods(modnum: int) -> int:
+    # NC is DT as far as difficulty goes
+    mods = int(modnum) & DIFFICULTY_MODS
+    if mods & MODS_ENUM['NC']:
+        mods = (mods & ~MODS_ENUM['NC']) | MODS_ENUM['DT']
+    return mods
+
+
+def mod_rate(mods: int) -> float:
+    if mods & (MODS_ENUM['DT'] | MODS_ENUM['NC']):
+        return 1.5
+    if mods & MODS_ENUM['HT']:
+        return 0.75
+    return 1
+
+
+def ar_to_ms(ar: float) -> float:
+    return 1800 - 120 * ar if ar < 5 else 1200 - 150 * (ar - 5)
+
+
+def ms_to_ar(ms: float) -> float:
+    return (1800 - ms) / 120 if ms > 1200 else 5 + (1200 - ms) / 150
+
+
+def od_to_ms(od: float) -> float:
+    # 300 hit window
+    return 80 - 6 * od
+
+
+def ms_to_od(ms: float) -> float:
+    return (80 - ms) / 6
+
+
+@lru_cache(maxsize=4096)
+def apply_mods(cs: float, ar: float, od: float, hp: float, mods: int) -> Tuple[float, float, float, float]:
+    '''
+        osu!standard CS/AR/OD/HP after `mods`. HR/EZ scale the stats, DT/HT change the AR/OD time windows
+    '''
+    if mods & MODS_ENUM['HR']:
+        cs, ar, od, hp = min(cs * 1.3, 10), min(ar * 1.4, 10), min(od * 1.4, 10), min(hp * 1.4, 10)
+    elif mods & MODS_ENUM['EZ']:
+        cs, ar, od, hp = cs * 0.5, ar * 0.5, od * 0.5, hp * 0.5
+    rate = mod_rate(mods)
+    if rate != 1:
+        ar = ms_to_ar(ar_to_ms(ar) / rate)
+        od = ms_to_od(od_to_ms(od) / rate)
+    return cs, ar, od, hp
+
+
+def format_stat(value: float) -> str:
+    return f'{round(value, 2):g}'
+
+
+class ModsAlreadyApplied(ValueError):
     pass
 
 
+def modded_beatmap(beatmap: Beatmap, mods: int) -> Beatmap:
+    '''
+        Copy of `beatmap` with stats, bpm and length adjusted for `mods`. The star rating is left alone since it comes
+        from the api (get_beatmaps with the same mods). Raises ModsAlreadyApplied for a beatmap that is already
+        adjusted for other mods, the unmodded stats can't be recovered from it (HR caps them at 10)
+    '''
+    mods = difficulty_mods(mods)
+    if mods == beatmap.mods:
+        return beatmap
+    if beatmap.mods:
+        raise ModsAlreadyApplied(f'Beatmap {beatmap.beatmap_id} already adjusted for mods {mod_string(beatmap.mods)}')
+    modded = beatmap.copy()
+    modded.mods = mods
+    if beatmap.mode == 0:
+        modded.diff_size, modded.diff_approach, modded.diff_overall, modded.diff_drain = apply_mods(
+            beatmap.diff_size, beatmap.diff_approach, beatmap.diff_overall, beatmap.diff_drain, mods
+        )
+    rate = mod_rate(mods)
+    modded.bpm = beatmap.bpm * rate
+    modded.total_length = int(beatmap.total_length / rate)
+    modded.hit_length = int(beatmap.hit_length / rate)
+    return modded
+
+
+def update_score_difficulty(score: Score):
+    # adjusts the beatmap metadata attached to the score for the score's mods
+    if score.meta:
+        score.meta = modded_beatmap(score.meta, score.enabled_mods)
+
+
 def profile_thumb(osuid: str) -> str:
     return f'http://s.ppy.sh/a/{osuid}'
 
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import osu
+from api import ApiError, ApiTimeout, OsuApiClient
+from cache import LRUCache
+
+logger = logging.getLogger('discord')
+
+# osu!track updates return the change since the user's previous update, so repeating one right away only gives an
+# empty delta. Updates are kept this long and served again instead
+OSUTRACK_CACHE_TTL = 60
+OSUTRACK_RETRIES = 2
+OSUTRACK_BACKOFF = 0.5
+OSUTRACK_MAX_BACKOFF = 4
+# consecutive failures (5xx, timeouts, connection errors) before the circuit opens, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+
+class CircuitOpen(ApiError):
+    pass
+
+
+class CircuitBreaker:
+    '''
+        Closed until `failureThreshold` consecutive failures, then open (every call fails fast) for `resetTimeout`
+        seconds. After that a single trial call is let through (half open): success closes the circuit, failure opens
+        it for another `resetTimeout`
+    '''
+
+    def __init__(self, failureThreshold: int = CIRCUIT_FAILURE_THRESHOLD, resetTimeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.failures = 0
+        self.openedAt: Optional[float] = None
+        self._trial = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.openedAt is None:
+            return 'closed'
+        return 'open' if time.monotonic() - self.openedAt < self.resetTimeout else 'half_open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.openedAt = None
+        self._trial = False
+
+    def release(self) -> None:
+        # the call let through said nothing about the service (e.g. it never reached it), a half open circuit lets
+        # the next call be the trial instead
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._trial or (self.openedAt is None and self.failures >= self.failureThreshold):
+            self.opened += 1
+            self.openedAt = time.monotonic()
+            self._trial = False
+
+
+def retryable(e: ApiError) -> bool:
+    # timed out requests aren't retried, the caller has already waited the full timeout for them
+    return e.status >= 500 and not isinstance(e, ApiTimeout)
+
+
+def unhealthy(e: ApiError) -> bool:
+    # 4xx responses (e.g. 400 for an unknown user) mean osu!track itself is fine
+    return e.status == 0 or e.status >= 500
+
+
+class OsuTrackClient:
+    '''
+        osu!track update client on top of OsuApiClient's session (so requests keep their timeouts, single flight and
+        metrics). 5xx responses are retried with jittered exponential backoff, a circuit breaker fails calls fast while
+        osu!track keeps failing and the last update per (user, mode) is served again for `ttl` seconds
+    '''
+
+    def __init__(
+        self,
+        osuApi: OsuApiClient,
+        ttl: float = OSUTRACK_CACHE_TTL,
+        retries: int = OSUTRACK_RETRIES,
+        backoff: float = OSUTRACK_BACKOFF,
+        maxBackoff: float = OSUTRACK_MAX_BACKOFF,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.osuApi = osuApi
+        self.ttl = ttl
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.breaker = breaker or CircuitBreaker()
+        self._updates: LRUCache[Tuple[str, int], Tuple[float, osu.Update]] = LRUCache(1024)
+        # the cache's own hit count includes entries past `ttl`, which aren't served
+        self.hits = 0
+        self.misses = 0
+        self.retried = 0
+        self.rejected = 0
+
+    async def update(self, osuid: str, mode: int = 0) -> osu.Update:
+        # raises ApiError like OsuApiClient.osutrack_update, CircuitOpen while osu!track is considered down
+        key = (str(osuid), mode)
+        cached = self._updates.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        update = await self._update(osuid, mode)
+        self._updates.put(key, (time.monotonic(), update))
+        return update
+
+    async def _update(self, osuid: str, mode: int) -> osu.Update:
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise CircuitOpen('update', 503, 'osu!track is unavailable, circuit open')
+            try:
+                update = await self.osuApi.osutrack_update(osuid, mode)
+            except ApiError as e:
+                if e.status == 429:
+                    # shed by our own rate limiter, says nothing about osu!track
+                    self.breaker.release()
+                    raise
+                if not unhealthy(e):
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                if attempt >= self.retries or not retryable(e):
+                    raise
+                # full jitter, https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+                delay = random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** attempt))
+                logger.warning(f'osu!track update for {osuid} failed ({e}), retrying in {delay:.2f}s')
+                self.retried += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # undecodable responses, cancellation
+                self.breaker.release()
+                raise
+            self.breaker.success()
+            return update
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.breaker.state,
+            'hits': self.hits,
+            'misses': self.misses,
+            'retried': self.retried,
+            'rejected': self.rejected,
+            'opened': self.breaker.opened,
+        }
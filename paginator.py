@@ -0,0 +1,92 @@
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from discord import Embed, HTTPException, Message
+from discord.abc import Messageable
+
+from timers import DeferredAction, DeferredActions
+
+logger = logging.getLogger('discord')
+
+PREVIOUS_PAGE = '◀'
+NEXT_PAGE = '▶'
+# seconds without a page change before the reactions are removed
+PAGINATOR_TIMEOUT = 15.0
+
+
+class Paginator:
+    def __init__(self, message: Message, ownerId: int, pageCount: int, render: Callable[[int], Embed]):
+        self.message = message
+        self.ownerId = ownerId
+        self.pageCount = pageCount
+        self.render = render
+        self.page = 0
+        self.expiry: Optional[DeferredAction] = None
+
+
+class Paginators:
+    '''
+        Open paginated messages keyed by message id. The bot's single on_reaction_add listener hands every reaction to
+        `dispatch`, which finds the paginator with one dict lookup (a wait_for per paginator means discord.py runs every
+        open paginator's check on every reaction). Expiry is scheduled through DeferredActions and restarts on every
+        page change
+    '''
+
+    def __init__(self, deferredActions: DeferredActions, timeout: float = PAGINATOR_TIMEOUT):
+        self.deferredActions = deferredActions
+        self.timeout = timeout
+        self._open: Dict[int, Paginator] = {}
+
+    def __len__(self) -> int:
+        return len(self._open)
+
+    async def open(self, destination: Messageable, ownerId: int, pageCount: int, render: Callable[[int], Embed]) -> Message:
+        '''
+            Sends page 0 (`render(page)` builds a page's embed), only `ownerId` can change pages
+        '''
+        message = await destination.send(embed=render(0))
+        if pageCount <= 1:
+            return message
+        paginator = Paginator(message, ownerId, pageCount, render)
+        self._open[message.id] = paginator
+        self.touch(paginator)
+        await message.add_reaction(PREVIOUS_PAGE)
+        await message.add_reaction(NEXT_PAGE)
+        return message
+
+    def touch(self, paginator: Paginator) -> None:
+        if paginator.expiry:
+            paginator.expiry.cancel()
+        paginator.expiry = self.deferredActions.schedule(self.timeout, self.close, paginator.message.id)
+
+    async def close(self, messageId: int) -> None:
+        paginator = self._open.pop(messageId, None)
+        if paginator is None:
+            return
+        if paginator.expiry:
+            paginator.expiry.cancel()
+        try:
+            await paginator.message.clear_reaction(emoji=PREVIOUS_PAGE)
+            await paginator.message.clear_reaction(emoji=NEXT_PAGE)
+        except HTTPException as e:
+            logger.warning(f'Failed to clear paginator reactions on {messageId}: {e}')
+
+    async def dispatch(self, reaction: Any, user: Any) -> None:
+        paginator = self._open.get(reaction.message.id)
+        if paginator is None or user.id != paginator.ownerId:
+            return
+        emoji = str(reaction.emoji)
+        if emoji == PREVIOUS_PAGE:
+            page = paginator.page - 1
+        elif emoji == NEXT_PAGE:
+            page = paginator.page + 1
+        else:
+            return
+        self.touch(paginator)
+        try:
+            if 0 <= page < paginator.pageCount:
+                paginator.page = page
+                await paginator.message.edit(embed=paginator.render(page))
+            await paginator.message.remove_reaction(emoji=reaction.emoji, member=user)
+        except HTTPException as e:
+            logger.warning(f'Failed to change page on {reaction.message.id}: {e}')
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from discord import Embed
+from discord.abc import Messageable
+
+import backend
+import osu
+from delivery import DeliveryQueue
+
+logger = logging.getLogger('discord')
+
+# scores ranked above this in the user's top 100 are posted regardless of the pp cutoff
+PP_CUTOFF_EXEMPT_RANKING = 5
+
+
+class Threshold(NamedTuple):
+    scoreCutoff: int
+    ppCutoff: float
+
+    def passes(self, score: osu.Score) -> bool:
+        return score.ranking < self.scoreCutoff and (
+            (score.pp or 0) >= self.ppCutoff or score.ranking < PP_CUTOFF_EXEMPT_RANKING
+        )
+
+
+def guild_threshold(guildData: backend.GuildData) -> Threshold:
+    return Threshold(
+        min(guildData.get('osu_update_score_rank_cutoff', 100), 100),
+        max(guildData.get('osu_update_score_pp_cutoff', 0), 0),
+    )
+
+
+class DeliveryPlan:
+    '''
+        Scores to post per channel, grouped by user in the order they were planned. Planning the same score for the
+        same user and channel twice only posts it once
+    '''
+
+    def __init__(self):
+        self.channels: Dict[int, Messageable] = {}
+        # channel id -> uid -> (osuid, username, scores)
+        self.scores: Dict[int, Dict[str, Tuple[str, str, List[osu.Score]]]] = {}
+        self._planned: Set[Tuple[int, str, str]] = set()
+
+    def __len__(self) -> int:
+        return len(self._planned)
+
+    def add(self, channel: Messageable, uid: str, osuid: str, username: str, scores: Iterable[osu.Score]) -> None:
+        cid = channel.id  # type: ignore
+        for score in scores:
+            key = (cid, uid, score.score_id)
+            if key in self._planned:
+                continue
+            self._planned.add(key)
+            self.channels[cid] = channel
+            userScores = self.scores.setdefault(cid, {})
+            if uid not in userScores:
+                userScores[uid] = (osuid, username, [])
+            userScores[uid][2].append(score)
+
+    def has(self, uid: str) -> bool:
+        return any(uid in userScores for userScores in self.scores.values())
+
+    def send(
+        self, deliveryQueue: DeliveryQueue, render: Callable[[osu.Score, str, str], Embed]
+    ) -> Dict[Tuple[int, str], 'asyncio.Future[bool]']:
+        '''
+            One delivery per (channel, user), the queue packs each channel's deliveries into as few messages as it can.
+            Returns the queue's settled future (see DeliveryQueue) per (channel id, uid)
+        '''
+        deliveries = {}
+        for cid, userScores in self.scores.items():
+            for uid, (osuid, username, scores) in userScores.items():
+                deliveries[(cid, uid)] = deliveryQueue.enqueue(
+                    self.channels[cid],
+                    f'New top scores for <@{uid}>',
+                    [render(score, osuid, username) for score in scores],
+                )
+        self.channels.clear()
+        self.scores.clear()
+        self._planned.clear()
+        return deliveries
+
+
+class DeliveryPlanner:
+    '''
+        Auto update channel and cutoffs of every guild, compiled once per sweep. Guilds are indexed by their
+        (rank cutoff, pp cutoff) threshold so a user's new scores are filtered once per distinct threshold among their
+        guilds rather than once per guild
+    '''
+
+    def __init__(self, allGuildData: Mapping[str, backend.GuildData], resolveChannel: Callable[[int], Optional[Messageable]]):
+        self.channels: Dict[int, Messageable] = {}
+        self.thresholds: Dict[Threshold, Set[int]] = {}
+        for gid, guildData in allGuildData.items():
+            cid = guildData.get('osu_update_channel')
+            if not cid:
+                continue
+            channel = resolveChannel(cid)
+            if channel is None:
+                print(f'Top score update failed: invalid channel ID {cid}')
+                logger.error(f'Top score update failed: invalid channel ID {cid}')
+                continue
+            self.channels[int(gid)] = channel
+            self.thresholds.setdefault(guild_threshold(guildData), set()).add(int(gid))
+
+    def plan(
+        self, plan: DeliveryPlan, uid: str, osuid: str, username: str, newScores: List[osu.Score], gids: Iterable[int]
+    ) -> None:
+        gids = set(gids)
+        for gid in gids - self.channels.keys():
+            logger.warning(f'registered guild {gid} has no valid auto update channel')
+        for threshold, thresholdGids in self.thresholds.items():
+            guilds = thresholdGids & gids
+            if not guilds:
+                continue
+            scores = [score for score in newScores if threshold.passes(score)]
+            if not scores:
+                continue
+            for gid in guilds:
+                plan.add(self.channels[gid], uid, osuid, username, scores)
@@ -0,0 +1,154 @@
+# poller.py
+# standalone auto update poller, run any number of these next to the bot with AUTO_UPDATE_MODE=workers.
+# users are split between the running pollers through leases in the sqlite database and new top scores are
+# handed to the bot process through the same database (see pollqueue.py), which delivers them
+import asyncio
+import datetime as dt
+import logging
+import os
+import socket
+import time
+from typing import Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+
+import api
+import backend
+from cache import BeatmapCache, ProfileCache
+from pollqueue import PollLeases, ScoreQueue, detect_new_scores
+from ratelimit import BACKGROUND, TokenBucketLimiter
+from scheduler import PollScheduler
+from snapshots import TopScoreSnapshots
+
+logger = logging.getLogger('discord')
+
+
+# envvars
+load_dotenv()
+OSU_API_KEY = os.getenv('OSU_API_KEY')
+POLLER_ID = os.getenv('POLLER_ID') or f'{socket.gethostname()}-{os.getpid()}'
+# a poller that stops renewing its leases (crashed, hung) has its users picked up by the others after this long
+POLLER_LEASE_TTL = float(os.getenv('POLLER_LEASE_TTL') or 120)
+# the osu! api key's budget (the bot's OSU_API_RATE_LIMIT, same key) is split with the bot process: all pollers
+# together get POLLER_API_SHARE of it, split evenly between the live ones, and the bot keeps the rest for commands
+# and deliveries. set the same values for the bot and its pollers
+OSU_API_RATE_LIMIT = float(os.getenv('OSU_API_RATE_LIMIT') or 120)
+POLLER_API_SHARE = float(os.getenv('POLLER_API_SHARE') or 0.5)
+
+AUTO_UPDATE_TICK = float(os.getenv('AUTO_UPDATE_TICK') or 30)
+AUTO_UPDATE_MIN_INTERVAL = float(os.getenv('AUTO_UPDATE_MIN_INTERVAL') or 180)
+AUTO_UPDATE_MAX_INTERVAL = float(os.getenv('AUTO_UPDATE_MAX_INTERVAL') or 3600)
+OSU_API_BURST = float(os.getenv('OSU_API_BURST') or 30)
+OSU_API_MAX_BACKGROUND_WAIT = float(os.getenv('OSU_API_MAX_BACKGROUND_WAIT') or 30)
+
+
+class Poller:
+    '''
+        One poller worker. Every tick it renews its leases, schedules the users it holds and starts polls for the
+        ones that are due. Polls run in the background so a slow sweep never delays lease renewal
+    '''
+
+    def __init__(self, workerId: str = POLLER_ID, path: Optional[str] = None):
+        path = path or backend.database_path()
+        self.leases = PollLeases(path, workerId, ttl=POLLER_LEASE_TTL)
+        self.scoreQueue = ScoreQueue(path)
+        self.snapshots = TopScoreSnapshots(path)
+        self.limiter = TokenBucketLimiter(
+            OSU_API_RATE_LIMIT * POLLER_API_SHARE,
+            burst=OSU_API_BURST * POLLER_API_SHARE,
+            maxBackgroundWait=OSU_API_MAX_BACKGROUND_WAIT,
+        )
+        self.osuApi = api.OsuApiClient(
+            OSU_API_KEY, beatmapCache=BeatmapCache(), profileCache=ProfileCache(), limiter=self.limiter
+        )
+        self.pollScheduler = PollScheduler(
+            minInterval=AUTO_UPDATE_MIN_INTERVAL,
+            maxInterval=AUTO_UPDATE_MAX_INTERVAL,
+            initialInterval=min(max(600, AUTO_UPDATE_MIN_INTERVAL), AUTO_UPDATE_MAX_INTERVAL),
+        )
+        self.leased: Set[str] = set()
+        # live pollers the limiter's budget is currently split between
+        self._workers = 1
+        self._polling: Dict[str, 'asyncio.Task[None]'] = {}
+
+    def tick(self) -> List[str]:
+        # returns the users whose polls were started
+        userGuilds: Dict[str, List[int]] = {}
+        userOsuids: Dict[str, str] = {}
+        for gid, guildData in backend.read_all_data(backend.GUILD_DATA).items():
+            if not guildData.get('osu_update_channel'):
+                continue
+            for uid, osuid in backend.read_guild_members(gid).items():
+                userGuilds.setdefault(uid, []).append(int(gid))
+                userOsuids[uid] = osuid
+
+        leased = self.leases.claim(userGuilds.keys())
+        for uid in leased - self.leased:
+            # another poller may have polled this user since we last held them
+            self.snapshots.evict(userOsuids[uid])
+        for uid in self.leased - leased:
+            # the user may be claimed by another poller right away, an unfinished poll mustn't queue their scores too
+            task = self._polling.pop(uid, None)
+            if task is not None:
+                task.cancel()
+        self.leased = leased
+        if self.leases.workers != self._workers:
+            self._workers = self.leases.workers
+            self.limiter.configure(
+                OSU_API_RATE_LIMIT * POLLER_API_SHARE / self._workers, burst=OSU_API_BURST * POLLER_API_SHARE / self._workers
+            )
+        self.pollScheduler.sync(leased)
+
+        dueUsers = [uid for uid in self.pollScheduler.due() if uid not in self._polling]
+        for uid in dueUsers:
+            task = asyncio.ensure_future(self.poll(uid, userOsuids[uid], userGuilds[uid]))
+            task.add_done_callback(lambda task, uid=uid: self._polled(uid, task))
+            self._polling[uid] = task
+        if dueUsers:
+            logger.debug(
+                f'{self.leases.worker}: polling {len(dueUsers)} of {len(leased)} leased users '
+                f'({self.leases.workers} pollers) at {dt.datetime.now()}'
+            )
+        return dueUsers
+
+    def _polled(self, uid: str, task: 'asyncio.Task[None]') -> None:
+        # a cancelled poll may finish after a new one was started for the same user
+        if self._polling.get(uid) is task:
+            del self._polling[uid]
+
+    async def poll(self, uid: str, osuid: str, gids: List[int]) -> None:
+        api.request_priority.set(BACKGROUND)
+        active = None
+        try:
+            detected = await detect_new_scores(self.osuApi, self.snapshots, osuid)
+            if detected is None:
+                return
+            if detected.newScores and detected.user:
+                logger.debug(f'{detected.user.username}: {len(detected.newScores)} top scores')
+                self.scoreQueue.push(gids, uid, osuid, detected.user.username, detected.newScores)
+            self.snapshots.save(osuid, detected.topScores)
+            active = len(detected.newScores) > 0
+        except Exception as e:
+            logger.exception(f'Top score update failed for {osuid}: {e}')
+        finally:
+            self.pollScheduler.reschedule(uid, active)
+
+    async def run(self) -> None:
+        try:
+            while True:
+                tickStart = time.monotonic()
+                try:
+                    self.tick()
+                except Exception as e:
+                    logger.exception(f'Poller tick failed: {e}')
+                await asyncio.sleep(max(AUTO_UPDATE_TICK - (time.monotonic() - tickStart), 0))
+        finally:
+            for task in self._polling.values():
+                task.cancel()
+            self.leases.release_all()
+            await self.osuApi.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    asyncio.run(Poller().run())
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Callable, Iterable, List, NamedTuple, Optional, Set
+
+import api
+import backend
+import osu
+from snapshots import TopScoreSnapshots
+
+logger = logging.getLogger('discord')
+
+POLL_QUEUE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS poll_workers (
+    worker      TEXT PRIMARY KEY,
+    heartbeat   REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS poll_leases (
+    uid         TEXT PRIMARY KEY,
+    worker      TEXT NOT NULL,
+    expires     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS poll_leases_worker ON poll_leases (worker);
+CREATE TABLE IF NOT EXISTS polled_scores (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    gid         INTEGER NOT NULL,
+    uid         TEXT NOT NULL,
+    osuid       TEXT NOT NULL,
+    username    TEXT NOT NULL,
+    scores      TEXT NOT NULL,
+    created     REAL NOT NULL
+);
+'''
+
+# polled scores nobody picked up (e.g. no bot process runs the guild's shard) are dropped after this long
+POLLED_SCORES_TTL = 24 * 60 * 60
+
+
+class PollLeases:
+    '''
+        Time limited claims on users so each user is polled by exactly one poller worker. Every worker heartbeats,
+        renews its leases and claims free/expired ones up to its share (registered users / live workers), releasing
+        any above it so users rebalance when workers come and go
+    '''
+
+    def __init__(self, path: str, worker: str, ttl: float = 120):
+        self.conn = backend.connect(path)
+        self.conn.executescript(POLL_QUEUE_SCHEMA)
+        self.worker = worker
+        self.ttl = ttl
+        self.workers = 1
+
+    def claim(self, uids: Iterable[str]) -> Set[str]:
+        # returns the users this worker holds a lease on until the next claim (at most `ttl` seconds away)
+        uids = set(uids)
+        now = time.time()
+        with backend.transaction(self.conn) as conn:
+            conn.execute('INSERT OR REPLACE INTO poll_workers (worker, heartbeat) VALUES (?, ?)', (self.worker, now))
+            conn.execute('DELETE FROM poll_workers WHERE heartbeat < ?', (now - self.ttl,))
+            conn.execute('DELETE FROM poll_leases WHERE expires < ?', (now,))
+            self.workers = conn.execute('SELECT COUNT(*) FROM poll_workers').fetchone()[0]
+            share = math.ceil(len(uids) / self.workers)
+            leased = {row['uid']: row['worker'] for row in conn.execute('SELECT uid, worker FROM poll_leases')}
+            mine = sorted(uid for uid, worker in leased.items() if worker == self.worker and uid in uids)
+            release = [uid for uid, worker in leased.items() if worker == self.worker and uid not in uids]
+            release += mine[share:]
+            mine = mine[:share]
+            conn.executemany('DELETE FROM poll_leases WHERE uid = ?', ((uid,) for uid in release))
+            conn.executemany('UPDATE poll_leases SET expires = ? WHERE uid = ?', ((now + self.ttl, uid) for uid in mine))
+            free = sorted(uid for uid in uids if uid not in leased)[:max(share - len(mine), 0)]
+            conn.executemany(
+                'INSERT INTO poll_leases (uid, worker, expires) VALUES (?, ?, ?)',
+                ((uid, self.worker, now + self.ttl) for uid in free),
+            )
+        return set(mine) | set(free)
+
+    def release_all(self) -> None:
+        with backend.transaction(self.conn) as conn:
+            conn.execute('DELETE FROM poll_leases WHERE worker = ?', (self.worker,))
+            conn.execute('DELETE FROM poll_workers WHERE worker = ?', (self.worker,))
+
+
+class PolledScores(NamedTuple):
+    gid: int
+    uid: str
+    osuid: str
+    username: str
+    scores: List[osu.Score]
+
+
+class ScoreQueue:
+    '''
+        New top scores found by poller workers waiting to be delivered by the bot process, one row per
+        (guild, user) so sharded bot processes only take the rows for guilds they host
+    '''
+
+    def __init__(self, path: str):
+        self.conn = backend.connect(path)
+        self.conn.executescript(POLL_QUEUE_SCHEMA)
+
+    def push(self, gids: Iterable[int], uid: str, osuid: str, username: str, scores: List[osu.Score]) -> None:
+        encoded = json.dumps([score.to_dict() for score in scores])
+        now = time.time()
+        with backend.transaction(self.conn) as conn:
+            conn.executemany(
+                'INSERT INTO polled_scores (gid, uid, osuid, username, scores, created) VALUES (?, ?, ?, ?, ?, ?)',
+                ((gid, uid, osuid, username, encoded, now) for gid in gids),
+            )
+
+    def take(self, hosts: Callable[[int], bool] = lambda gid: True, limit: int = 500) -> List[PolledScores]:
+        # removes and returns queued rows for guilds `hosts` accepts, oldest first
+        with backend.transaction(self.conn) as conn:
+            conn.execute('DELETE FROM polled_scores WHERE created < ?', (time.time() - POLLED_SCORES_TTL,))
+            rows = [row for row in conn.execute('SELECT * FROM polled_scores ORDER BY id') if hosts(row['gid'])][:limit]
+            conn.executemany('DELETE FROM polled_scores WHERE id = ?', ((row['id'],) for row in rows))
+        return [
+            PolledScores(
+                row['gid'], row['uid'], row['osuid'], row['username'],
+                [osu.Score.from_api(score) for score in json.loads(row['scores'])],
+            )
+            for row in rows
+        ]
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM polled_scores').fetchone()[0]
+
+
+class DetectedScores(NamedTuple):
+    topScores: List[osu.Score]
+    newScores: List[osu.Score]
+    # only fetched when there are new scores
+    user: Optional[osu.User]
+
+
+async def detect_new_scores(osuApi: api.OsuApiClient, snapshots: TopScoreSnapshots, osuid: str) -> Optional[DetectedScores]:
+    '''
+        Polls a user's top scores and diffs them against their snapshot, new scores come back with beatmaps attached.
+        None if the user couldn't be checked, a user without top scores is checked and has nothing new. The caller
+        saves the snapshot once the new scores are handled
+    '''
+    topScores = await osuApi.get_top_scores(osuid, 100)
+    if topScores is None:
+        return None
+    newScores = snapshots.new_scores(osuid, topScores)
+    if not newScores:
+        return DetectedScores(topScores, newScores, None)
+    user, _ = await asyncio.gather(osuApi.get_user(osuid), osuApi.attach_beatmaps(newScores))
+    if not user:
+        # snapshot isn't saved so these scores are retried next update
+        logger.error(f'Top score update failed: profile retrieval failed for {osuid}')
+        return None
+    return DetectedScores(topScores, newScores, user)
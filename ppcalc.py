@@ -0,0 +1,463 @@
+import logging
+import math
+import os
+from array import array
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import osu
+from cache import LRUCache
+
+logger = logging.getLogger('discord')
+
+# Offline osu!standard star rating/pp calculation from .osu files. This follows ppv2 as implemented by oppai-ng 4.x
+# but ignores slider travel distance and note stacking, so values are close to but not always exactly what the
+# website shows.
+# .osu format: https://osu.ppy.sh/wiki/en/Client/File_formats/Osu_%28file_format%29
+
+OBJECT_CIRCLE = 1
+OBJECT_SLIDER = 2
+OBJECT_SPINNER = 3
+
+PLAYFIELD_WIDTH = 512
+PLAYFIELD_HEIGHT = 384
+
+# difficulty calculation constants
+STAR_SCALING_FACTOR = 0.0675
+EXTREME_SCALING_FACTOR = 0.5
+STRAIN_STEP = 400
+DECAY_WEIGHT = 0.9
+AIM_DECAY_BASE = 0.15
+SPEED_DECAY_BASE = 0.3
+AIM_WEIGHT_SCALING = 26.25
+SPEED_WEIGHT_SCALING = 1400
+CIRCLESIZE_BUFF_THRESHOLD = 30
+SINGLE_SPACING = 125
+MIN_SPEED_BONUS = 75
+MAX_SPEED_BONUS = 45
+ANGLE_BONUS_SCALE = 90
+AIM_TIMING_THRESHOLD = 107
+SPEED_ANGLE_BONUS_BEGIN = 5 * math.pi / 6
+AIM_ANGLE_BONUS_BEGIN = math.pi / 3
+
+
+class OsuFile:
+    '''
+        Parsed .osu beatmap. Hit objects are stored column wise in typed arrays rather than as a list of objects
+    '''
+
+    def __init__(self):
+        self.metadata: Dict[str, str] = {}
+        self.difficulty: Dict[str, float] = {}
+        self.mode = 0
+        # uninherited timing points as (time, beat length), inherited ones as (time, slider velocity multiplier)
+        self.timingPoints: List[Tuple[float, float, bool]] = []
+        self.breaks: List[Tuple[float, float]] = []
+        self.x = array('f')
+        self.y = array('f')
+        self.times = array('d')
+        self.types = array('B')
+        self.repeats = array('H')
+        self.pixelLengths = array('f')
+        self._maxCombo: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def circles(self) -> int:
+        return self.types.count(OBJECT_CIRCLE)
+
+    @property
+    def cs(self) -> float:
+        return self.difficulty.get('CircleSize', 5)
+
+    @property
+    def od(self) -> float:
+        return self.difficulty.get('OverallDifficulty', 5)
+
+    @property
+    def ar(self) -> float:
+        # old maps don't have an AR and use OD instead
+        return self.difficulty.get('ApproachRate', self.od)
+
+    @property
+    def hp(self) -> float:
+        return self.difficulty.get('HPDrainRate', 5)
+
+    def max_combo(self) -> int:
+        if self._maxCombo is not None:
+            return self._maxCombo
+        sliderMultiplier = self.difficulty.get('SliderMultiplier', 1.4)
+        tickRate = self.difficulty.get('SliderTickRate', 1)
+        combo = 0
+        # hit objects and timing points are both sorted by time, walk them together
+        point = 0
+        velocity = 1.0
+        for i, objectType in enumerate(self.types):
+            if objectType != OBJECT_SLIDER:
+                combo += 1
+                continue
+            while point < len(self.timingPoints) and self.timingPoints[point][0] <= self.times[i]:
+                _, value, inherited = self.timingPoints[point]
+                velocity = value if inherited else 1.0
+                point += 1
+            repeats = max(self.repeats[i], 1)
+            beats = self.pixelLengths[i] * repeats / (sliderMultiplier * 100 * velocity)
+            ticks = (math.ceil((beats - 0.1) / repeats * tickRate) - 1) * repeats + repeats + 1
+            combo += max(ticks, 0)
+        self._maxCombo = combo
+        return combo
+
+    def bpm(self) -> float:
+        # bpm of the uninherited timing point that lasts the longest
+        uninherited = [(time, beatLength) for time, beatLength, inherited in self.timingPoints if not inherited]
+        if not uninherited or not len(self.times):
+            return 0
+        durations: Counter = Counter()
+        end = self.times[-1]
+        for i, (time, beatLength) in enumerate(uninherited):
+            nextTime = uninherited[i + 1][0] if i + 1 < len(uninherited) else end
+            durations[beatLength] += max(nextTime, time) - time
+        beatLength = durations.most_common(1)[0][0] if durations else uninherited[0][1]
+        return 60000 / beatLength if beatLength > 0 else 0
+
+    def length(self) -> Tuple[int, int]:
+        # (total length, length without breaks) in seconds, like the api total_length/hit_length
+        if not len(self.times):
+            return 0, 0
+        total = (self.times[-1] - self.times[0]) / 1000
+        breaks = sum(end - start for start, end in self.breaks) / 1000
+        return int(total), int(max(total - breaks, 0))
+
+
+def parse_osu_file(text: str) -> OsuFile:
+    beatmap = OsuFile()
+    section = ''
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1]
+            continue
+        if section in ('General', 'Metadata', 'Difficulty'):
+            key, _, value = line.partition(':')
+            key, value = key.strip(), value.strip()
+            if section == 'Difficulty':
+                try:
+                    beatmap.difficulty[key] = float(value)
+                except ValueError:
+                    pass
+            elif section == 'General' and key == 'Mode':
+                beatmap.mode = int(value)
+            else:
+                beatmap.metadata[key] = value
+        elif section == 'Events':
+            parts = line.split(',')
+            if parts[0] in ('2', 'Break') and len(parts) >= 3:
+                beatmap.breaks.append((float(parts[1]), float(parts[2])))
+        elif section == 'TimingPoints':
+            parts = line.split(',')
+            if len(parts) < 2:
+                continue
+            time, beatLength = float(parts[0]), float(parts[1])
+            uninherited = parts[6] == '1' if len(parts) > 6 else beatLength > 0
+            if uninherited:
+                beatmap.timingPoints.append((time, beatLength, False))
+            else:
+                # negative inverse slider velocity multiplier as a percentage
+                beatmap.timingPoints.append((time, -100 / beatLength if beatLength < 0 else 1.0, True))
+        elif section == 'HitObjects':
+            parts = line.split(',')
+            if len(parts) < 4:
+                continue
+            flags = int(parts[3])
+            if flags & 1:
+                objectType, repeats, pixelLength = OBJECT_CIRCLE, 0, 0.0
+            elif flags & 2:
+                objectType = OBJECT_SLIDER
+                repeats = int(parts[6]) if len(parts) > 6 else 1
+                pixelLength = float(parts[7]) if len(parts) > 7 else 0.0
+            elif flags & 8:
+                objectType, repeats, pixelLength = OBJECT_SPINNER, 0, 0.0
+            else:
+                # mania holds etc.
+                continue
+            beatmap.x.append(float(parts[0]))
+            beatmap.y.append(float(parts[1]))
+            beatmap.times.append(float(parts[2]))
+            beatmap.types.append(objectType)
+            beatmap.repeats.append(max(repeats, 0))
+            beatmap.pixelLengths.append(pixelLength)
+    beatmap.timingPoints.sort(key=lambda point: point[0])
+    return beatmap
+
+
+class Difficulty(NamedTuple):
+    aim: float
+    speed: float
+    stars: float
+    ar: float
+    od: float
+    cs: float
+    hp: float
+
+
+def _spacing_weight(aim: bool, distance: float, strainTime: float, prevDistance: float, prevStrainTime: float, angle: Optional[float]) -> float:
+    if not aim:
+        distance = min(distance, SINGLE_SPACING)
+        deltaTime = max(strainTime, MAX_SPEED_BONUS)
+        speedBonus = 1.0
+        if deltaTime < MIN_SPEED_BONUS:
+            speedBonus += ((MIN_SPEED_BONUS - deltaTime) / 40) ** 2
+        angleBonus = 1.0
+        if angle is not None and angle < SPEED_ANGLE_BONUS_BEGIN:
+            s = math.sin(1.5 * (SPEED_ANGLE_BONUS_BEGIN - angle))
+            angleBonus += s * s / 3.57
+            if angle < math.pi / 2:
+                angleBonus = 1.28
+                if distance < ANGLE_BONUS_SCALE and angle < math.pi / 4:
+                    angleBonus += (1 - angleBonus) * min((ANGLE_BONUS_SCALE - distance) / 10, 1)
+                elif distance < ANGLE_BONUS_SCALE:
+                    angleBonus += (1 - angleBonus) * min((ANGLE_BONUS_SCALE - distance) / 10, 1) * \
+                        math.sin((math.pi / 2 - angle) * 4 / math.pi)
+        return (1 + (speedBonus - 1) * 0.75) * angleBonus * (0.95 + speedBonus * (distance / SINGLE_SPACING) ** 3.5) / strainTime
+    prevStrainTime = max(prevStrainTime, 50)
+    strainTime = max(strainTime, 50)
+    result = 0.0
+    if angle is not None and angle > AIM_ANGLE_BONUS_BEGIN:
+        angleBonus = math.sqrt(
+            max(prevDistance - ANGLE_BONUS_SCALE, 0) * math.sin(angle - AIM_ANGLE_BONUS_BEGIN) ** 2 *
+            max(distance - ANGLE_BONUS_SCALE, 0)
+        )
+        result = 1.5 * max(angleBonus, 0) ** 0.99 / max(AIM_TIMING_THRESHOLD, prevStrainTime)
+    weightedDistance = distance ** 0.99
+    return max(result + weightedDistance / max(AIM_TIMING_THRESHOLD, strainTime), weightedDistance / strainTime)
+
+
+def _skill_difficulty(beatmap: OsuFile, aim: bool, rate: float, scale: float) -> float:
+    decayBase = AIM_DECAY_BASE if aim else SPEED_DECAY_BASE
+    weightScaling = AIM_WEIGHT_SCALING if aim else SPEED_WEIGHT_SCALING
+    times, xs, ys, types = beatmap.times, beatmap.x, beatmap.y, beatmap.types
+    if not len(times):
+        return 0
+    peaks: List[float] = []
+    intervalEnd = math.ceil(times[0] / rate / STRAIN_STEP) * STRAIN_STEP
+    maxStrain = 0.0
+    strain = 0.0
+    prevStrain = 0.0
+    prevDistance = 0.0
+    prevStrainTime = 0.0
+    for i in range(len(times)):
+        time = times[i] / rate
+        if i > 0:
+            deltaTime = time - times[i - 1] / rate
+            strainTime = max(deltaTime, 50)
+            distance = 0.0
+            angle = None
+            if types[i] != OBJECT_SPINNER and types[i - 1] != OBJECT_SPINNER:
+                dx, dy = (xs[i] - xs[i - 1]) * scale, (ys[i] - ys[i - 1]) * scale
+                distance = math.hypot(dx, dy)
+                if i > 1 and types[i - 2] != OBJECT_SPINNER:
+                    px, py = (xs[i - 2] - xs[i - 1]) * scale, (ys[i - 2] - ys[i - 1]) * scale
+                    angle = abs(math.atan2(px * dy - py * dx, px * dx + py * dy))
+            weight = 0.0 if types[i] == OBJECT_SPINNER else \
+                _spacing_weight(aim, distance, strainTime, prevDistance, prevStrainTime, angle)
+            strain = prevStrain * decayBase ** (deltaTime / 1000) + weight * weightScaling
+            prevDistance, prevStrainTime = distance, strainTime
+        while time > intervalEnd:
+            peaks.append(maxStrain)
+            previousTime = times[i - 1] / rate if i > 0 else time
+            maxStrain = prevStrain * decayBase ** ((intervalEnd - previousTime) * rate / 1000) if i > 0 else 0
+            intervalEnd += STRAIN_STEP
+        maxStrain = max(maxStrain, strain)
+        prevStrain = strain
+    peaks.append(maxStrain)
+    peaks.sort(reverse=True)
+    difficulty, weight = 0.0, 1.0
+    for peak in peaks:
+        difficulty += peak * weight
+        weight *= DECAY_WEIGHT
+    return difficulty
+
+
+def calculate_difficulty(beatmap: OsuFile, mods: int = 0) -> Difficulty:
+    mods = osu.difficulty_mods(mods)
+    rate = osu.mod_rate(mods)
+    cs, ar, od, hp = osu.apply_mods(beatmap.cs, beatmap.ar, beatmap.od, beatmap.hp, mods)
+    radius = (PLAYFIELD_WIDTH / 16) * (1 - 0.7 * (cs - 5) / 5)
+    scale = 52 / radius
+    if radius < CIRCLESIZE_BUFF_THRESHOLD:
+        scale *= 1 + min(CIRCLESIZE_BUFF_THRESHOLD - radius, 5) / 50
+    aim = math.sqrt(_skill_difficulty(beatmap, True, rate, scale)) * STAR_SCALING_FACTOR
+    speed = math.sqrt(_skill_difficulty(beatmap, False, rate, scale)) * STAR_SCALING_FACTOR
+    stars = aim + speed + abs(speed - aim) * EXTREME_SCALING_FACTOR
+    return Difficulty(aim, speed, stars, ar, od, cs, hp)
+
+
+def score_accuracy(n300: int, n100: int, n50: int, misses: int) -> float:
+    hits = n300 + n100 + n50 + misses
+    return (n50 + 2 * n100 + 6 * n300) / (6 * hits) if hits else 0
+
+
+def calculate_pp(
+    beatmap: OsuFile, difficulty: Difficulty, mods: int, combo: int, n300: int, n100: int, n50: int, misses: int
+) -> float:
+    objects = len(beatmap)
+    circles = beatmap.circles
+    maxCombo = beatmap.max_combo()
+    ar, od = difficulty.ar, difficulty.od
+    accuracy = score_accuracy(n300, n100, n50, misses)
+
+    lengthBonus = 0.95 + 0.4 * min(1, objects / 2000) + (math.log10(objects / 2000) * 0.5 if objects > 2000 else 0)
+    comboBreak = min(combo ** 0.8 / maxCombo ** 0.8, 1) if maxCombo else 1
+    # the miss penalty scales with the fraction of missed objects, speed is penalized a bit less
+    missRatio = 1 - (misses / objects) ** 0.775 if objects else 1
+    aimMissPenalty = 0.97 * missRatio ** misses if misses else 1
+    speedMissPenalty = 0.97 * missRatio ** (misses ** 0.875) if misses else 1
+    arFactor = 0.0
+    if ar > 10.33:
+        arFactor = 0.4 * (ar - 10.33)
+    elif ar < 8:
+        arFactor = 0.01 * (8 - ar)
+    # the ar bonus is scaled down for maps shorter than 1000 objects
+    arBonus = 1 + min(arFactor, arFactor * objects / 1000)
+    hdBonus = 1 + 0.04 * (12 - ar) if mods & osu.MODS_ENUM['HD'] else 1
+
+    aim = (5 * max(1, difficulty.aim / STAR_SCALING_FACTOR) - 4) ** 3 / 100000
+    aim *= lengthBonus * aimMissPenalty * comboBreak * arBonus * hdBonus
+    if mods & osu.MODS_ENUM['FL']:
+        aim *= 1 + 0.35 * min(1, objects / 200) + (
+            0.3 * min(1, (objects - 200) / 300) + ((objects - 500) / 1200 if objects > 500 else 0) if objects > 200 else 0
+        )
+    aim *= (0.5 + accuracy / 2) * (0.98 + od ** 2 / 2500)
+
+    speed = (5 * max(1, difficulty.speed / STAR_SCALING_FACTOR) - 4) ** 3 / 100000
+    speed *= lengthBonus * speedMissPenalty * comboBreak * hdBonus
+    if ar > 10.33:
+        speed *= arBonus
+    speed *= (0.95 + od ** 2 / 750) * accuracy ** ((14.5 - max(od, 8)) / 2)
+    speed *= 0.98 ** (0 if n50 < objects / 500 else n50 - objects / 500)
+
+    # accuracy pp only counts circles, sliders and spinners are assumed to be 300s
+    circleAccuracy = 0.0
+    if circles:
+        circleAccuracy = min(max(((n300 - (objects - circles)) * 6 + n100 * 2 + n50) / (circles * 6), 0), 1)
+    accPP = 1.52163 ** od * circleAccuracy ** 24 * 2.83 * min(1.15, (circles / 1000) ** 0.3)
+    if mods & osu.MODS_ENUM['HD']:
+        accPP *= 1.08
+    if mods & osu.MODS_ENUM['FL']:
+        accPP *= 1.02
+
+    multiplier = 1.12
+    if mods & osu.MODS_ENUM['NF']:
+        multiplier *= 0.9
+    if mods & osu.MODS_ENUM['SO']:
+        multiplier *= 0.95
+    return (aim ** 1.1 + speed ** 1.1 + accPP ** 1.1) ** (1 / 1.1) * multiplier
+
+
+class LocalCalculator:
+    '''
+        Star rating, pp and beatmap metadata from .osu files in `directory` (named <beatmap_id>.osu), no api calls.
+        Parsed beatmaps, difficulties and pp values are cached
+    '''
+
+    def __init__(self, directory: str = 'beatmaps', capacity: int = 256):
+        self.directory = directory
+        self._beatmaps: LRUCache[str, Optional[OsuFile]] = LRUCache(capacity)
+        self._difficulties: LRUCache[Tuple[str, int], Difficulty] = LRUCache(capacity * 4)
+        self._pp: LRUCache[Tuple[str, int, int, int, int, int, int], float] = LRUCache(capacity * 16)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, beatmapid: str) -> str:
+        return os.path.join(self.directory, f'{beatmapid}.osu')
+
+    def has_beatmap(self, beatmapid: str) -> bool:
+        return f'{beatmapid}' in self._beatmaps or os.path.exists(self.path(beatmapid))
+
+    def save_beatmap(self, beatmapid: str, text: str) -> None:
+        with open(f'{self.path(beatmapid)}.tmp', 'w', encoding='utf-8') as fp:
+            fp.write(text)
+        os.replace(f'{self.path(beatmapid)}.tmp', self.path(beatmapid))
+        self._beatmaps.pop(f'{beatmapid}')
+
+    def beatmap(self, beatmapid: str) -> Optional[OsuFile]:
+        beatmapid = f'{beatmapid}'
+        if beatmapid in self._beatmaps:
+            return self._beatmaps.get(beatmapid)
+        try:
+            with open(self.path(beatmapid), 'r', encoding='utf-8-sig') as fp:
+                beatmap: Optional[OsuFile] = parse_osu_file(fp.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, IndexError) as e:
+            logger.warning(f'Failed to parse beatmap file for {beatmapid}: {e}')
+            beatmap = None
+        if beatmap is not None and beatmap.mode != 0:
+            # only osu!standard is supported
+            beatmap = None
+        self._beatmaps.put(beatmapid, beatmap)
+        return beatmap
+
+    def difficulty(self, beatmapid: str, mods: int = 0) -> Optional[Difficulty]:
+        key = (f'{beatmapid}', osu.difficulty_mods(mods))
+        difficulty = self._difficulties.get(key)
+        if difficulty is None:
+            beatmap = self.beatmap(beatmapid)
+            if beatmap is None:
+                return None
+            difficulty = calculate_difficulty(beatmap, mods)
+            self._difficulties.put(key, difficulty)
+        return difficulty
+
+    def score_pp(self, score: osu.Score) -> Optional[float]:
+        mods = score.enabled_mods
+        counts = (score.maxcombo, score.count300, score.count100, score.count50, score.countmiss)
+        key = (score.beatmap_id, mods, *counts)
+        pp = self._pp.get(key)
+        if pp is None:
+            beatmap = self.beatmap(score.beatmap_id)
+            difficulty = self.difficulty(score.beatmap_id, mods)
+            if beatmap is None or difficulty is None:
+                return None
+            pp = calculate_pp(beatmap, difficulty, mods, *counts)
+            self._pp.put(key, pp)
+        return pp
+
+    def beatmap_meta(self, beatmapid: str, mods: int = 0) -> Optional[osu.Beatmap]:
+        '''
+            Beatmap metadata like the api's get_beatmaps (adjusted for `mods` like osu.modded_beatmap) built from
+            the local .osu file
+        '''
+        beatmap = self.beatmap(beatmapid)
+        difficulty = self.difficulty(beatmapid, mods)
+        if beatmap is None or difficulty is None:
+            return None
+        rate = osu.mod_rate(osu.difficulty_mods(mods))
+        totalLength, hitLength = beatmap.length()
+        return osu.Beatmap(
+            beatmap_id=f'{beatmapid}',
+            beatmapset_id=beatmap.metadata.get('BeatmapSetID', ''),
+            title=beatmap.metadata.get('Title', ''),
+            artist=beatmap.metadata.get('Artist', ''),
+            version=beatmap.metadata.get('Version', ''),
+            creator=beatmap.metadata.get('Creator', ''),
+            mode=beatmap.mode,
+            diff_size=difficulty.cs,
+            diff_approach=difficulty.ar,
+            diff_overall=difficulty.od,
+            diff_drain=difficulty.hp,
+            difficultyrating=difficulty.stars,
+            diff_aim=difficulty.aim,
+            diff_speed=difficulty.speed,
+            bpm=beatmap.bpm() * rate,
+            total_length=int(totalLength / rate),
+            hit_length=int(hitLength / rate),
+            max_combo=beatmap.max_combo(),
+            count_normal=beatmap.circles,
+            count_slider=beatmap.types.count(OBJECT_SLIDER),
+            count_spinner=beatmap.types.count(OBJECT_SPINNER),
+            mods=osu.difficulty_mods(mods),
+        )
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+# request priority classes, lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, wait: float):
+        super().__init__(f'Rate limit budget exhausted, estimated wait {wait:.1f}s')
+        self.wait = wait
+
+
+class TokenBucketLimiter:
+    '''
+        Token bucket shared by every api request. Queued interactive requests are always served before background
+        ones, background requests can't dip into the last `reserve` tokens, and background requests that would have to
+        wait longer than `maxBackgroundWait` are shed (RateLimitExceeded) so they can be retried on a later poll
+    '''
+
+    def __init__(self, perMinute: float, burst: Optional[float] = None, reserve: float = 0, maxBackgroundWait: float = 30):
+        if perMinute <= 0:
+            raise Exception(f'Invalid rate limit {perMinute}/min')
+        self.rate = perMinute / 60
+        self.capacity = max(burst if burst is not None else perMinute / 6, 1 + reserve)
+        self.reserve = reserve
+        self.maxBackgroundWait = maxBackgroundWait
+        self.tokens = self.capacity
+        self.updatedAt = time.monotonic()
+        self._waiters: Dict[int, Deque['asyncio.Future[None]']] = {priority: deque() for priority in PRIORITIES}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.requests = {priority: 0 for priority in PRIORITIES}
+        self.waited = {priority: 0.0 for priority in PRIORITIES}
+        self.maxWaited = {priority: 0.0 for priority in PRIORITIES}
+        self.shed = 0
+        # when the requests of the last minute went through, to compare against the key's limit
+        self._recent: Deque[float] = deque()
+
+    def configure(self, perMinute: float, burst: Optional[float] = None) -> None:
+        # changes the budget in place (e.g. when the number of processes sharing the key changes), tokens already
+        # earned are kept up to the new capacity and queued requests are rescheduled for the new rate
+        if perMinute <= 0:
+            raise Exception(f'Invalid rate limit {perMinute}/min')
+        self._refill()
+        self.rate = perMinute / 60
+        self.capacity = max(burst if burst is not None else perMinute / 6, 1 + self.reserve)
+        self.tokens = min(self.tokens, self.capacity)
+        if self._timer is not None:
+            self._schedule()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+    def _threshold(self, priority: int) -> float:
+        return 1 if priority == INTERACTIVE else 1 + self.reserve
+
+    def _queued(self, upTo: int) -> int:
+        return sum(len(self._waiters[priority]) for priority in PRIORITIES if priority <= upTo)
+
+    def _grant(self) -> None:
+        self._timer = None
+        self._refill()
+        for priority in PRIORITIES:
+            waiters = self._waiters[priority]
+            while waiters:
+                if waiters[0].done():
+                    # cancelled while waiting
+                    waiters.popleft()
+                    continue
+                if self.tokens < self._threshold(priority):
+                    break
+                self.tokens -= 1
+                waiters.popleft().set_result(None)
+            if waiters:
+                # lower priority classes wait until every higher priority request has gone through
+                break
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for priority in PRIORITIES:
+            if self._waiters[priority]:
+                delay = max((self._threshold(priority) - self.tokens) / self.rate, 0.001)
+                self._timer = asyncio.get_event_loop().call_later(delay, self._grant)
+                return
+
+    def _record(self, priority: int, waited: float) -> None:
+        now = time.monotonic()
+        self._recent.append(now)
+        while self._recent[0] < now - 60:
+            self._recent.popleft()
+        self.requests[priority] += 1
+        self.waited[priority] += waited
+        self.maxWaited[priority] = max(self.maxWaited[priority], waited)
+
+    async def acquire(self, priority: int = INTERACTIVE) -> float:
+        # waits for a token and returns how long that took (seconds)
+        start = time.monotonic()
+        self._refill()
+        if not self._queued(priority) and self.tokens >= self._threshold(priority):
+            self.tokens -= 1
+            self._record(priority, 0)
+            return 0
+        if priority != INTERACTIVE:
+            estimatedWait = (self._queued(BACKGROUND) + self._threshold(priority) - self.tokens) / self.rate
+            if estimatedWait > self.maxBackgroundWait:
+                self.shed += 1
+                raise RateLimitExceeded(estimatedWait)
+        future: 'asyncio.Future[None]' = asyncio.get_event_loop().create_future()
+        self._waiters[priority].append(future)
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # token was granted right as we got cancelled, hand it back
+                self.tokens += 1
+            raise
+        waited = time.monotonic() - start
+        self._record(priority, waited)
+        return waited
+
+    @property
+    def perMinute(self) -> float:
+        return self.rate * 60
+
+    @property
+    def requests_last_minute(self) -> int:
+        while self._recent and self._recent[0] < time.monotonic() - 60:
+            self._recent.popleft()
+        return len(self._recent)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        self._refill()
+        stats: Dict[str, float] = {
+            'tokens': round(self.tokens, 2), 'shed': self.shed, 'requests_last_minute': self.requests_last_minute
+        }
+        for priority in PRIORITIES:
+            name = PRIORITY_NAMES[priority]
+            stats[f'{name}_requests'] = self.requests[priority]
+            stats[f'{name}_queued'] = len(self._waiters[priority])
+            stats[f'{name}_wait_total'] = round(self.waited[priority], 3)
+            stats[f'{name}_wait_max'] = round(self.maxWaited[priority], 3)
+        return stats
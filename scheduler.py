@@ -0,0 +1,107 @@
+import heapq
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class PollScheduler:
+    '''
+        Priority queue of users keyed by their next poll time. Each user has their own poll interval which
+        snaps down to `minInterval` after they set a new top score and backs off exponentially (up to `maxInterval`)
+        while they stay idle
+    '''
+
+    def __init__(
+        self,
+        minInterval: float = 180,
+        maxInterval: float = 3600,
+        initialInterval: float = 600,
+        backoff: float = 2,
+        jitter: float = 0.1,
+    ):
+        if not 0 < minInterval <= initialInterval <= maxInterval:
+            raise Exception(f'Invalid poll intervals {minInterval}/{initialInterval}/{maxInterval}')
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.initialInterval = initialInterval
+        self.backoff = backoff
+        self.jitter = jitter
+        self._heap: List[Tuple[float, str]] = []
+        # uid -> (interval, next poll time). heap entries that don't match are stale and skipped when popped
+        self._users: Dict[str, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self._users
+
+    def _push(self, uid: str, interval: float, nextPoll: float) -> None:
+        self._users[uid] = (interval, nextPoll)
+        heapq.heappush(self._heap, (nextPoll, uid))
+
+    def add(self, uid: str, now: Optional[float] = None) -> None:
+        # new users are due immediately
+        if uid not in self._users:
+            self._push(uid, self.initialInterval, time.time() if now is None else now)
+
+    def remove(self, uid: str) -> None:
+        self._users.pop(uid, None)
+
+    def sync(self, uids: Iterable[str], now: Optional[float] = None) -> None:
+        # makes the scheduled users match `uids` (e.g. after registrations change)
+        uids = set(uids)
+        for uid in list(self._users):
+            if uid not in uids:
+                self.remove(uid)
+        for uid in uids:
+            self.add(uid, now)
+        if len(self._heap) > 4 * len(self._users) + 64:
+            self._heap = [(nextPoll, uid) for uid, (_, nextPoll) in self._users.items()]
+            heapq.heapify(self._heap)
+
+    def due(self, now: Optional[float] = None, limit: Optional[int] = None) -> List[str]:
+        # every user whose poll time has passed (most overdue first), they should be rescheduled after polling. Until
+        # then they stay scheduled one interval from now, so a poll that never reschedules (cancelled sweep, crash)
+        # doesn't drop the user
+        now = time.time() if now is None else now
+        dueUsers: List[str] = []
+        popped: Set[str] = set()
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(dueUsers) < limit):
+            nextPoll, uid = heapq.heappop(self._heap)
+            # a stale entry can share its time with the current one, both are popped by the same call
+            if uid in self._users and self._users[uid][1] == nextPoll and uid not in popped:
+                popped.add(uid)
+                dueUsers.append(uid)
+        for uid in dueUsers:
+            interval = self._users[uid][0]
+            self._push(uid, interval, now + interval)
+        return dueUsers
+
+    def next_poll_time(self) -> Optional[float]:
+        while self._heap:
+            nextPoll, uid = self._heap[0]
+            if uid in self._users and self._users[uid][1] == nextPoll:
+                return nextPoll
+            heapq.heappop(self._heap)
+        return None
+
+    def reschedule(self, uid: str, active: Optional[bool], now: Optional[float] = None) -> None:
+        '''
+            `active` True if the poll found new top scores, False if it found nothing and None if the poll failed
+            (keeps the current interval)
+        '''
+        if uid not in self._users:
+            return
+        now = time.time() if now is None else now
+        interval = self._users[uid][0]
+        if active:
+            interval = self.minInterval
+        elif active is not None:
+            interval = min(interval * self.backoff, self.maxInterval)
+        # jitter so users added together don't stay bunched up in the same sweep forever
+        delay = interval * (1 + random.uniform(-self.jitter, self.jitter))
+        self._push(uid, interval, now + delay)
+
+    def interval(self, uid: str) -> Optional[float]:
+        return self._users[uid][0] if uid in self._users else None
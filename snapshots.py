@@ -0,0 +1,107 @@
+import datetime as dt
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+import backend
+import osu
+
+SNAPSHOT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS top_score_snapshots (
+    osuid       TEXT NOT NULL,
+    mode        INTEGER NOT NULL,
+    score_ids   TEXT NOT NULL,
+    last_date   TEXT NOT NULL,
+    PRIMARY KEY (osuid, mode)
+);
+'''
+
+# the first time a user is seen there is nothing to diff against, so (like the old fixed window check)
+# only scores set within this long are treated as new
+FIRST_SNAPSHOT_WINDOW = dt.timedelta(minutes=10, seconds=5)
+
+
+class TopScoreSnapshots:
+    '''
+        Persistent per user snapshot of the top score ids seen so far plus the newest score date (watermark).
+        New top scores are the ones missing from the snapshot that aren't older than the watermark, which makes
+        detection independent of when (or how late) the auto update loop runs.
+
+        Processes that only deliver to some guilds (shard groups) each keep their own snapshots under `scope`, so one
+        process handling a score doesn't hide it from the others
+    '''
+
+    def __init__(self, path: str, scope: str = ''):
+        self.conn = backend.connect(path)
+        self.conn.executescript(SNAPSHOT_SCHEMA)
+        self.scope = scope
+        self._snapshots: Dict[Tuple[str, int], Tuple[Set[str], str]] = {}
+        # ids of new scores handed off for delivery before the snapshot that includes them is saved, skipped by
+        # new_scores so a delivery that's still in progress isn't queued again by the next poll
+        self._inFlight: Dict[Tuple[str, int], Set[str]] = {}
+
+    def key(self, osuid: str, mode: int) -> Tuple[str, int]:
+        # scoped snapshots share the table, the scope is kept in the osuid column
+        return (f'{osuid}@{self.scope}' if self.scope else str(osuid), mode)
+
+    def get(self, osuid: str, mode: int = 0) -> Optional[Tuple[Set[str], str]]:
+        key = self.key(osuid, mode)
+        if key not in self._snapshots:
+            row = self.conn.execute(
+                'SELECT score_ids, last_date FROM top_score_snapshots WHERE osuid = ? AND mode = ?', key
+            ).fetchone()
+            if not row:
+                return None
+            self._snapshots[key] = (set(json.loads(row['score_ids'])), row['last_date'])
+        return self._snapshots[key]
+
+    def evict(self, osuid: str, mode: int = 0) -> None:
+        # drops the cached snapshot, e.g. when another process may have saved a newer one
+        self._snapshots.pop(self.key(osuid, mode), None)
+
+    def hold(self, osuid: str, scores: List[osu.Score], mode: int = 0) -> None:
+        self._inFlight.setdefault(self.key(osuid, mode), set()).update(score.score_id for score in scores)
+
+    def release(self, osuid: str, scores: List[osu.Score], mode: int = 0) -> None:
+        # once the held scores are delivered and saved, or their delivery failed and they should be found again
+        key = self.key(osuid, mode)
+        inFlight = self._inFlight.get(key)
+        if inFlight is None:
+            return
+        inFlight.difference_update(score.score_id for score in scores)
+        if not inFlight:
+            del self._inFlight[key]
+
+    def holding(self, osuid: str, mode: int = 0) -> bool:
+        return self.key(osuid, mode) in self._inFlight
+
+    def new_scores(self, osuid: str, topScores: List[osu.Score], mode: int = 0) -> List[osu.Score]:
+        inFlight = self._inFlight.get(self.key(osuid, mode), set())
+        snapshot = self.get(osuid, mode)
+        if snapshot is None:
+            cutoff = (dt.datetime.utcnow() - FIRST_SNAPSHOT_WINDOW).strftime(osu.DATE_FORMAT)
+            return [score for score in topScores if score.date >= cutoff and score.score_id not in inFlight]
+        knownIds, lastDate = snapshot
+        # api dates are 'YYYY-MM-DD HH:MM:SS' (UTC) so string comparison orders them without parsing. Scores
+        # older than the watermark that appear (e.g. after a pp rework reshuffles the top 100) aren't new plays
+        return [
+            score for score in topScores
+            if score.score_id not in knownIds and score.date >= lastDate and score.score_id not in inFlight
+        ]
+
+    def save(self, osuid: str, topScores: List[osu.Score], mode: int = 0) -> None:
+        # only call once the new scores have been handled, so a crash in between means they're picked up again
+        if not topScores:
+            return
+        key = self.key(osuid, mode)
+        previous = self.get(osuid, mode)
+        scoreIds = {score.score_id for score in topScores}
+        lastDate = max(score.date for score in topScores)
+        if previous is not None:
+            lastDate = max(lastDate, previous[1])
+            if previous == (scoreIds, lastDate):
+                return
+        self.conn.execute(
+            'INSERT OR REPLACE INTO top_score_snapshots (osuid, mode, score_ids, last_date) VALUES (?, ?, ?, ?)',
+            (*key, json.dumps(sorted(scoreIds)), lastDate),
+        )
+        self._snapshots[key] = (scoreIds, lastDate)
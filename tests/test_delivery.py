@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from discord import Embed, HTTPException
+
+from delivery import DeliveryQueue
+
+
+class FakeChannel:
+    # records sent messages, raises `errors` (HTTPException statuses) for the first sends
+    def __init__(self, id: int, *errors: int):
+        self.id = id
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send(self, content=None, embed=None):
+        if self.errors:
+            status = self.errors.pop(0)
+            raise HTTPException(SimpleNamespace(status=status, reason='error'), 'error')
+        self.sent.append((content, embed))
+
+
+class DeliveryQueueTest(unittest.TestCase):
+    def deliver(self, channel: FakeChannel) -> bool:
+        async def run():
+            return await DeliveryQueue(sendInterval=0).enqueue(channel, 'content', [Embed(description='score')])
+
+        return asyncio.run(run())
+
+    def test_deliveries_settle_separately(self):
+        async def run(channel: FakeChannel):
+            deliveryQueue = DeliveryQueue(sendInterval=0)
+            # too long to share a message
+            first = deliveryQueue.enqueue(channel, 'a' * 1500, [Embed(description='a')])
+            second = deliveryQueue.enqueue(channel, 'b' * 1500, [Embed(description='b')])
+            return await first, await second
+
+        channel = FakeChannel(1, 503)
+        self.assertEqual(asyncio.run(run(channel)), (False, True))
+        self.assertEqual([content[0] for content, _ in channel.sent], ['b'])
+
+    def test_sent(self):
+        channel = FakeChannel(1)
+        self.assertTrue(self.deliver(channel))
+        self.assertEqual(len(channel.sent), 1)
+
+    def test_rate_limits_discord_gave_up_on_can_be_retried(self):
+        channel = FakeChannel(1, 429)
+        self.assertFalse(self.deliver(channel))
+        self.assertEqual(channel.sent, [])
+
+    def test_permanent_failures_are_settled(self):
+        self.assertTrue(self.deliver(FakeChannel(1, 403)))
+
+    def test_other_failures_can_be_retried(self):
+        self.assertFalse(self.deliver(FakeChannel(1, 503)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+
+import osu
+from history import UNKNOWN_RANK, ScoreHistory
+
+
+def score(osuid: str, beatmapId: int, date: str, rank: str = 'S') -> osu.Score:
+    return osu.Score.from_api({
+        'user_id': osuid, 'beatmap_id': str(beatmapId), 'score_id': str(beatmapId), 'date': date, 'rank': rank,
+        'pp': '100', 'count300': '100',
+    })
+
+
+class ScoreHistoryTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'bonkers.db')
+
+    def test_duplicate_scores_are_stored_once(self):
+        history = ScoreHistory(self.path)
+        scores = [score('1', 10, '2021-01-01 00:00:00'), score('1', 11, '2021-01-02 00:00:00')]
+        self.assertEqual(history.record(scores), 2)
+        self.assertEqual(history.record(scores), 0)
+        self.assertEqual(history.record([*scores, score('1', 10, '2021-01-03 00:00:00')]), 1)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.stats['segments'], 2)
+
+    def test_segments_are_compacted(self):
+        history = ScoreHistory(self.path, maxSegments=2)
+        for day in range(1, 4):
+            history.record([score('1', day, f'2021-01-0{day} 00:00:00')])
+        self.assertEqual(history.users[('1', 0)].segments, 1)
+        history.record([score('1', 4, '2021-01-04 00:00:00')])
+        history.record([score('2', 4, '2021-01-04 00:00:00')])
+        self.assertEqual(history.compact(), 1)
+        reloaded = ScoreHistory(self.path)
+        self.assertEqual(reloaded.stats, {'scores': 5, 'users': 2, 'segments': 2})
+        self.assertEqual(reloaded.user_scores('1'), history.user_scores('1'))
+
+    def test_processes_share_the_database(self):
+        a = ScoreHistory(self.path, maxSegments=3)
+        b = ScoreHistory(self.path, maxSegments=3)
+        a.record([score('1', 10, '2021-01-01 00:00:00')])
+        b.record([score('1', 11, '2021-01-02 00:00:00')])
+        a.record([score('1', 12, '2021-01-03 00:00:00')])
+        # a compacts with b's segment merged in
+        a.record([score('1', 13, '2021-01-04 00:00:00')])
+        self.assertEqual(a.users[('1', 0)].segments, 1)
+        self.assertEqual([historyScore.beatmap_id for historyScore in a.user_scores('1')], [10, 11, 12, 13])
+        b.record([score('1', 14, '2021-01-05 00:00:00')])
+        self.assertEqual(b.compact(), 1)
+        self.assertEqual(len(ScoreHistory(self.path).user_scores('1')), 5)
+
+    def test_between_is_oldest_first_across_users(self):
+        history = ScoreHistory(self.path)
+        history.record([score('1', 10, '2021-01-03 00:00:00'), score('1', 11, '2021-01-01 00:00:00')])
+        history.record([score('2', 12, '2021-01-02 00:00:00'), score('2', 13, '2021-01-05 00:00:00')])
+        scores = history.between(dt.datetime(2021, 1, 1), dt.datetime(2021, 1, 5))
+        self.assertEqual([historyScore.beatmap_id for historyScore in scores], [11, 12, 10])
+        history.record([score('3', 14, '2021-01-04 00:00:00')])
+        scores = history.between(dt.datetime(2021, 1, 3), dt.datetime(2021, 1, 6))
+        self.assertEqual([historyScore.beatmap_id for historyScore in scores], [10, 14, 13])
+        self.assertEqual(history.between(dt.datetime(2021, 1, 1), dt.datetime(2021, 1, 6), mode=1), [])
+
+    def test_beatmap_scores(self):
+        history = ScoreHistory(self.path)
+        history.record([score('1', 10, '2021-01-01 00:00:00'), score('2', 10, '2021-01-02 00:00:00')])
+        self.assertEqual({historyScore.osuid for historyScore in history.beatmap_scores(10)}, {'1', '2'})
+
+    def test_unknown_ranks_keep_their_own_code(self):
+        history = ScoreHistory(self.path)
+        history.record([score('1', 10, '2021-01-01 00:00:00', rank='Z'), score('1', 11, '2021-01-02 00:00:00', rank='F')])
+        self.assertEqual([historyScore.rank for historyScore in ScoreHistory(self.path).user_scores('1')], [UNKNOWN_RANK, 'F'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import time
+import unittest
+
+import osu
+from cache import ProfileCache
+from leaderboards import GuildLeaderboards, Leaderboard
+
+
+def user(osuid: str, ppRank: int) -> osu.User:
+    return osu.User.from_api({'user_id': osuid, 'username': osuid, 'pp_rank': str(ppRank)})
+
+
+class GuildLeaderboardsTest(unittest.TestCase):
+    def setUp(self):
+        self.leaderboards = GuildLeaderboards()
+        self.board = self.leaderboards.boards[(1, 0)] = Leaderboard(1, 0)
+        self.leaderboards.sync_members(self.board, {'a': '10', 'b': '20'})
+
+    def test_profiles_are_ranked_as_they_come_in(self):
+        self.leaderboards.update_profile(user('20', 5), 0)
+        self.leaderboards.update_profile(user('10', 50), 0)
+        self.leaderboards.update_profile(user('10', 1), 0)
+        self.assertEqual([member.user_id for member in self.board.ranking()], ['10', '20'])
+
+    def test_cached_profiles_keep_their_fetch_time(self):
+        profileCache = ProfileCache(ttl=60, staleTTL=600)
+        # fetched five minutes ago, still servable as stale
+        profileCache._entries.put(('10', 0), (user('10', 1), time.monotonic() - 300))
+        self.leaderboards.update_profile(user('10', 1), 0, profileCache.fetched_at('10', 0))
+        self.assertAlmostEqual(time.time() - self.board.oldest(), 300, delta=1)
+        self.assertIsNone(profileCache.fetched_at('20', 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+import osu
+from osu import MODS_ENUM
+
+
+def mods(*names: str) -> int:
+    return sum(MODS_ENUM[name] for name in names)
+
+
+def beatmap(mode: int = 0) -> osu.Beatmap:
+    return osu.Beatmap.from_api({
+        'beatmap_id': '1', 'mode': str(mode), 'bpm': '180', 'total_length': '120', 'hit_length': '90',
+        'diff_size': '4', 'diff_approach': '9', 'diff_overall': '8', 'diff_drain': '5',
+    })
+
+
+class DifficultyModsTest(unittest.TestCase):
+    def test_only_difficulty_mods_are_kept(self):
+        self.assertEqual(osu.difficulty_mods(mods('HD', 'HR', 'DT')), mods('HR', 'DT'))
+        self.assertEqual(osu.difficulty_mods(mods('NF', 'SO')), 0)
+
+    def test_nightcore_counts_as_double_time(self):
+        self.assertEqual(osu.difficulty_mods(mods('NC', 'DT')), mods('DT'))
+        self.assertEqual(osu.difficulty_mods(mods('NC')), mods('DT'))
+
+    def test_mod_rate(self):
+        self.assertEqual(osu.mod_rate(0), 1)
+        self.assertEqual(osu.mod_rate(mods('DT')), 1.5)
+        self.assertEqual(osu.mod_rate(mods('NC')), 1.5)
+        self.assertEqual(osu.mod_rate(mods('HT')), 0.75)
+
+
+class ApplyModsTest(unittest.TestCase):
+    def assertStats(self, stats, expected):
+        for stat, value in zip(stats, expected):
+            self.assertAlmostEqual(stat, value, places=2)
+
+    def test_nomod(self):
+        self.assertStats(osu.apply_mods(4, 9, 8, 5, 0), (4, 9, 8, 5))
+
+    def test_hard_rock_is_capped_at_10(self):
+        self.assertStats(osu.apply_mods(4, 9, 8, 5, mods('HR')), (5.2, 10, 10, 7))
+
+    def test_easy_halves_stats(self):
+        self.assertStats(osu.apply_mods(4, 9, 8, 5, mods('EZ')), (2, 4.5, 4, 2.5))
+
+    def test_rate_mods_change_timing_windows(self):
+        self.assertStats(osu.apply_mods(4, 9, 8, 5, mods('DT')), (4, 10.33, 9.78, 5))
+        self.assertStats(osu.apply_mods(4, 9, 8, 5, mods('HT')), (4, 7.67, 6.22, 5))
+        self.assertStats(osu.apply_mods(4, 9, 8, 5, mods('HR', 'DT')), (5.2, 11, 11.11, 7))
+
+
+class ModdedBeatmapTest(unittest.TestCase):
+    def test_nomod_returns_same_beatmap(self):
+        original = beatmap()
+        self.assertIs(osu.modded_beatmap(original, mods('HD')), original)
+
+    def test_stats_bpm_and_length_are_adjusted(self):
+        original = beatmap()
+        modded = osu.modded_beatmap(original, mods('HD', 'DT'))
+        self.assertEqual(modded.mods, mods('DT'))
+        self.assertEqual((modded.bpm, modded.total_length, modded.hit_length), (270, 80, 60))
+        self.assertAlmostEqual(modded.diff_approach, 10.33, places=2)
+        self.assertEqual((original.mods, original.bpm, original.diff_approach), (0, 180, 9))
+        self.assertIs(osu.modded_beatmap(modded, mods('NC')), modded)
+
+    def test_other_modes_keep_their_stats(self):
+        modded = osu.modded_beatmap(beatmap(mode=3), mods('HR', 'HT'))
+        self.assertEqual((modded.diff_approach, modded.diff_overall, modded.bpm), (9, 8, 135))
+
+    def test_already_modded_beatmap_is_rejected(self):
+        modded = osu.modded_beatmap(beatmap(), mods('HR'))
+        with self.assertRaises(osu.ModsAlreadyApplied):
+            osu.modded_beatmap(modded, mods('DT'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import unittest
+
+from api import ApiError
+from osutrack import CircuitBreaker, CircuitOpen, OsuTrackClient
+
+
+class FakeApi:
+    # replays `responses` (a dict is returned, an exception is raised) for successive osutrack_update calls
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def osutrack_update(self, osuid, mode=0):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+
+def expire(breaker: CircuitBreaker) -> None:
+    breaker.openedAt -= breaker.resetTimeout
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failureThreshold=3, resetTimeout=30)
+        for _ in range(2):
+            breaker.failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failureThreshold=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_half_open_allows_single_trial(self):
+        breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+        breaker.failure()
+        expire(breaker)
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+        breaker.failure()
+        expire(breaker)
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(breaker.opened, 2)
+
+    def test_released_trial_lets_next_call_through(self):
+        breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+        breaker.failure()
+        expire(breaker)
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertTrue(breaker.allow())
+
+
+class OsuTrackClientTest(unittest.TestCase):
+    def client(self, api: FakeApi, **kwargs) -> OsuTrackClient:
+        return OsuTrackClient(api, backoff=0, **kwargs)  # type: ignore
+
+    def test_retries_server_errors(self):
+        api = FakeApi(ApiError('update', 502), ApiError('update', 503), {'username': 'a'})
+        client = self.client(api)
+        self.assertEqual(asyncio.run(client.update('1')), {'username': 'a'})
+        self.assertEqual((api.calls, client.retried), (3, 2))
+
+    def test_client_errors_are_not_retried(self):
+        api = FakeApi(ApiError('update', 400))
+        client = self.client(api)
+        with self.assertRaises(ApiError):
+            asyncio.run(client.update('1'))
+        self.assertEqual(api.calls, 1)
+        self.assertEqual(client.breaker.failures, 0)
+
+    def test_caches_updates(self):
+        api = FakeApi({'username': 'a'})
+        client = self.client(api)
+        asyncio.run(client.update('1'))
+        self.assertEqual(asyncio.run(client.update('1')), {'username': 'a'})
+        self.assertEqual(api.calls, 1)
+
+    def test_expired_updates_are_not_hits(self):
+        api = FakeApi({'username': 'a'}, {'username': 'b'})
+        client = self.client(api, ttl=30)
+        asyncio.run(client.update('1'))
+        asyncio.run(client.update('1'))
+        key, (fetchedAt, update) = ('1', 0), client._updates.peek(('1', 0))
+        client._updates.put(key, (fetchedAt - 30, update))
+        self.assertEqual(asyncio.run(client.update('1')), {'username': 'b'})
+        self.assertEqual((client.stats['hits'], client.stats['misses']), (1, 2))
+
+    def test_open_circuit_fails_fast(self):
+        api = FakeApi(*[ApiError('update', 500)] * 3)
+        client = self.client(api, retries=0, breaker=CircuitBreaker(failureThreshold=2))
+        for osuid in ('1', '2'):
+            with self.assertRaises(ApiError):
+                asyncio.run(client.update(osuid))
+        with self.assertRaises(CircuitOpen):
+            asyncio.run(client.update('3'))
+        self.assertEqual(api.calls, 2)
+
+    def test_rate_limited_trial_still_recovers(self):
+        breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+        breaker.failure()
+        expire(breaker)
+        api = FakeApi(ApiError('update', 429), {'username': 'a'})
+        client = self.client(api, breaker=breaker)
+        with self.assertRaises(ApiError):
+            asyncio.run(client.update('1'))
+        self.assertEqual(asyncio.run(client.update('1')), {'username': 'a'})
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_undecodable_trial_still_recovers(self):
+        breaker = CircuitBreaker(failureThreshold=1, resetTimeout=30)
+        breaker.failure()
+        expire(breaker)
+        api = FakeApi(ValueError('bad date'), {'username': 'a'})
+        client = self.client(api, breaker=breaker)
+        with self.assertRaises(ValueError):
+            asyncio.run(client.update('1'))
+        self.assertEqual(asyncio.run(client.update('1')), {'username': 'a'})
+        self.assertEqual(breaker.state, 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()
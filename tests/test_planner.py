@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+
+from discord import Embed
+
+import osu
+from delivery import DeliveryQueue
+from planner import DeliveryPlan, DeliveryPlanner
+from tests.test_delivery import FakeChannel
+
+
+def score(scoreId: str, ranking: int, pp: float) -> osu.Score:
+    topScore = osu.Score.from_api({'score_id': scoreId, 'date': '2021-01-01 00:00:00', 'rank': 'S', 'pp': str(pp)})
+    topScore.ranking = ranking
+    return topScore
+
+
+def render(score: osu.Score, osuid: str, username: str) -> Embed:
+    return Embed(description=score.score_id)
+
+
+class DeliveryPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.channels = {100: FakeChannel(100), 200: FakeChannel(200), 300: FakeChannel(300)}
+        self.planner = DeliveryPlanner(
+            {
+                '1': {'osu_update_channel': 100},
+                '2': {'osu_update_channel': 200, 'osu_update_score_rank_cutoff': 10},
+                '3': {'osu_update_channel': 300, 'osu_update_score_pp_cutoff': 200},
+                '4': {'osu_update_channel': 400},
+                '5': {},
+            },
+            self.channels.get,
+        )
+        self.scores = [score('a', 1, 100), score('b', 20, 300), score('c', 50, 100)]
+
+    def planned(self, plan: DeliveryPlan):
+        return {
+            cid: {uid: [topScore.score_id for topScore in scores] for uid, (_, _, scores) in userScores.items()}
+            for cid, userScores in plan.scores.items()
+        }
+
+    def test_guilds_are_grouped_by_threshold(self):
+        self.assertEqual(set(self.planner.channels), {1, 2, 3})
+        self.assertEqual(len(self.planner.thresholds), 3)
+
+    def test_scores_are_filtered_per_guild(self):
+        plan = DeliveryPlan()
+        self.planner.plan(plan, 'u', '10', 'name', self.scores, [1, 2, 3, 4])
+        self.assertEqual(self.planned(plan), {100: {'u': ['a', 'b', 'c']}, 200: {'u': ['a']}, 300: {'u': ['a', 'b']}})
+
+    def test_scores_are_planned_once(self):
+        plan = DeliveryPlan()
+        self.planner.plan(plan, 'u', '10', 'name', self.scores, [1])
+        self.planner.plan(plan, 'u', '10', 'name', self.scores, [1])
+        self.assertEqual(len(plan), 3)
+        self.assertTrue(plan.has('u'))
+        self.assertFalse(plan.has('v'))
+
+    def test_send_settles_each_delivery(self):
+        async def run():
+            plan = DeliveryPlan()
+            self.planner.plan(plan, 'u', '10', 'name', self.scores, [1, 3])
+            deliveries = plan.send(DeliveryQueue(sendInterval=0), render)
+            self.assertEqual(len(plan), 0)
+            return {key: await delivery for key, delivery in deliveries.items()}
+
+        self.channels[300].errors = [500]
+        self.assertEqual(asyncio.run(run()), {(100, 'u'): True, (300, 'u'): False})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import osu
+from pollqueue import PollLeases, ScoreQueue, detect_new_scores
+from snapshots import TopScoreSnapshots
+
+
+class PollLeasesTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'bonkers.db')
+        self.uids = [str(uid) for uid in range(10)]
+
+    def test_single_worker_claims_everyone(self):
+        leases = PollLeases(self.path, 'a')
+        self.assertEqual(leases.claim(self.uids), set(self.uids))
+        self.assertEqual(leases.workers, 1)
+
+    def test_claims_rebalance_between_workers(self):
+        a = PollLeases(self.path, 'a')
+        b = PollLeases(self.path, 'b')
+        a.claim(self.uids)
+        # everyone is still leased to a
+        self.assertEqual(b.claim(self.uids), set())
+        aLeased = a.claim(self.uids)
+        bLeased = b.claim(self.uids)
+        self.assertEqual((len(aLeased), len(bLeased)), (5, 5))
+        self.assertEqual(aLeased | bLeased, set(self.uids))
+
+    def test_released_users_are_picked_up(self):
+        a = PollLeases(self.path, 'a')
+        b = PollLeases(self.path, 'b')
+        a.claim(self.uids)
+        b.claim(self.uids)
+        a.claim(self.uids)
+        b.claim(self.uids)
+        b.release_all()
+        self.assertEqual(a.claim(self.uids), set(self.uids))
+        self.assertEqual(a.workers, 1)
+
+    def test_unregistered_users_are_released(self):
+        leases = PollLeases(self.path, 'a')
+        leases.claim(self.uids)
+        self.assertEqual(leases.claim(self.uids[:3]), set(self.uids[:3]))
+        claimed = PollLeases(self.path, 'b').claim(self.uids)
+        self.assertEqual(len(claimed), 5)
+        self.assertTrue(claimed.isdisjoint(self.uids[:3]))
+
+
+class ScoreQueueTest(unittest.TestCase):
+    def test_take_only_returns_hosted_guilds(self):
+        with tempfile.TemporaryDirectory() as directory:
+            queue = ScoreQueue(os.path.join(directory, 'bonkers.db'))
+            score = osu.Score.from_api({'score_id': '1', 'date': '2021-01-01 00:00:00', 'rank': 'S'})
+            queue.push([1, 2], 'u', '10', 'name', [score])
+            taken = queue.take(lambda gid: gid == 2)
+            self.assertEqual([(polled.gid, polled.scores[0].score_id) for polled in taken], [(2, '1')])
+            self.assertEqual(len(queue), 1)
+
+
+class FakeApi:
+    def __init__(self, topScores):
+        self.topScores = topScores
+
+    async def get_top_scores(self, u, limit):
+        return self.topScores
+
+
+class DetectNewScoresTest(unittest.TestCase):
+    def detect(self, topScores):
+        with tempfile.TemporaryDirectory() as directory:
+            snapshots = TopScoreSnapshots(os.path.join(directory, 'bonkers.db'))
+            return asyncio.run(detect_new_scores(FakeApi(topScores), snapshots, '10'))  # type: ignore
+
+    def test_failed_request_is_not_checked(self):
+        self.assertIsNone(self.detect(None))
+
+    def test_user_without_top_scores_has_nothing_new(self):
+        self.assertEqual(self.detect([]), ([], [], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+
+from ratelimit import BACKGROUND, INTERACTIVE, RateLimitExceeded, TokenBucketLimiter
+
+
+class TokenBucketLimiterTest(unittest.TestCase):
+    def test_background_requests_are_shed_past_max_wait(self):
+        async def run(limiter: TokenBucketLimiter) -> None:
+            await limiter.acquire(BACKGROUND)
+            await limiter.acquire(BACKGROUND)
+            with self.assertRaises(RateLimitExceeded):
+                await limiter.acquire(BACKGROUND)
+
+        limiter = TokenBucketLimiter(60, burst=2, maxBackgroundWait=0.5)
+        asyncio.run(run(limiter))
+        self.assertEqual(limiter.shed, 1)
+        self.assertEqual(limiter.requests[BACKGROUND], 2)
+
+    def test_background_requests_leave_the_reserve(self):
+        async def run(limiter: TokenBucketLimiter) -> None:
+            await limiter.acquire(BACKGROUND)
+            with self.assertRaises(RateLimitExceeded):
+                await limiter.acquire(BACKGROUND)
+            await limiter.acquire(INTERACTIVE)
+            await limiter.acquire(INTERACTIVE)
+
+        limiter = TokenBucketLimiter(60, burst=3, reserve=2, maxBackgroundWait=0)
+        asyncio.run(run(limiter))
+        self.assertEqual(limiter.requests, {INTERACTIVE: 2, BACKGROUND: 1})
+
+    def test_interactive_requests_wait_instead_of_being_shed(self):
+        async def run(limiter: TokenBucketLimiter) -> float:
+            await limiter.acquire(INTERACTIVE)
+            return await limiter.acquire(INTERACTIVE)
+
+        limiter = TokenBucketLimiter(1200, burst=1, maxBackgroundWait=0)
+        self.assertGreater(asyncio.run(run(limiter)), 0)
+        self.assertEqual(limiter.shed, 0)
+
+    def test_interactive_requests_are_served_first(self):
+        async def run(limiter: TokenBucketLimiter) -> list:
+            order = []
+
+            async def request(priority: int) -> None:
+                await limiter.acquire(priority)
+                order.append(priority)
+
+            await limiter.acquire(INTERACTIVE)
+            background = asyncio.ensure_future(request(BACKGROUND))
+            await asyncio.sleep(0)
+            await asyncio.gather(request(INTERACTIVE), background)
+            return order
+
+        limiter = TokenBucketLimiter(1200, burst=1, maxBackgroundWait=10)
+        self.assertEqual(asyncio.run(run(limiter)), [INTERACTIVE, BACKGROUND])
+
+
+    def test_configure_keeps_earned_tokens_up_to_new_capacity(self):
+        limiter = TokenBucketLimiter(60, burst=10)
+        limiter.configure(30, burst=4)
+        self.assertEqual((limiter.perMinute, limiter.capacity), (30, 4))
+        self.assertLessEqual(limiter.tokens, 4)
+
+    def test_configure_reschedules_queued_requests(self):
+        async def run(limiter: TokenBucketLimiter) -> float:
+            await limiter.acquire(INTERACTIVE)
+            waiting = asyncio.ensure_future(limiter.acquire(INTERACTIVE))
+            await asyncio.sleep(0)
+            limiter.configure(6000, burst=1)
+            return await asyncio.wait_for(waiting, 1)
+
+        self.assertLess(asyncio.run(run(TokenBucketLimiter(6, burst=1))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from scheduler import PollScheduler
+
+
+class PollSchedulerTest(unittest.TestCase):
+    def scheduler(self) -> PollScheduler:
+        return PollScheduler(minInterval=100, maxInterval=800, initialInterval=200, jitter=0)
+
+    def test_new_users_are_due_immediately(self):
+        scheduler = self.scheduler()
+        scheduler.sync(['a', 'b'], now=0)
+        self.assertEqual(sorted(scheduler.due(now=0)), ['a', 'b'])
+        self.assertEqual(scheduler.due(now=0), [])
+
+    def test_interval_adapts_to_activity(self):
+        scheduler = self.scheduler()
+        scheduler.add('a', now=0)
+        scheduler.due(now=0)
+        scheduler.reschedule('a', False, now=0)
+        self.assertEqual(scheduler.interval('a'), 400)
+        scheduler.reschedule('a', False, now=0)
+        scheduler.reschedule('a', False, now=0)
+        self.assertEqual(scheduler.interval('a'), 800)
+        scheduler.reschedule('a', None, now=0)
+        self.assertEqual(scheduler.interval('a'), 800)
+        scheduler.reschedule('a', True, now=0)
+        self.assertEqual(scheduler.interval('a'), 100)
+        self.assertEqual(scheduler.next_poll_time(), 100)
+
+    def test_unrescheduled_users_come_back(self):
+        scheduler = self.scheduler()
+        scheduler.add('a', now=0)
+        self.assertEqual(scheduler.due(now=0), ['a'])
+        # the poll never rescheduled (e.g. the sweep was cancelled)
+        self.assertEqual(scheduler.due(now=199), [])
+        self.assertEqual(scheduler.due(now=200), ['a'])
+
+    def test_reschedule_supersedes_due_entry(self):
+        scheduler = self.scheduler()
+        scheduler.add('a', now=0)
+        scheduler.due(now=0)
+        scheduler.reschedule('a', True, now=0)
+        self.assertEqual(scheduler.due(now=100), ['a'])
+        scheduler.reschedule('a', False, now=100)
+        self.assertEqual(scheduler.due(now=299), [])
+        self.assertEqual(scheduler.due(now=300), ['a'])
+
+    def test_due_users_are_returned_once(self):
+        scheduler = self.scheduler()
+        scheduler.add('a', now=0)
+        scheduler.due(now=0)
+        scheduler.reschedule('a', True, now=0)
+        # leaves an entry at 200 next to the one due() schedules 100 after 100
+        scheduler.due(now=100)
+        self.assertEqual(scheduler.due(now=200), ['a'])
+
+    def test_sync_removes_users(self):
+        scheduler = self.scheduler()
+        scheduler.sync(['a', 'b'], now=0)
+        scheduler.sync(['b'], now=0)
+        self.assertNotIn('a', scheduler)
+        self.assertEqual(scheduler.due(now=0), ['b'])
+        scheduler.reschedule('a', True, now=0)
+        self.assertEqual(len(scheduler), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+
+import osu
+from snapshots import TopScoreSnapshots
+
+
+def score(scoreId: str, date: str) -> osu.Score:
+    return osu.Score.from_api({'score_id': scoreId, 'date': date, 'rank': 'S'})
+
+
+class TopScoreSnapshotsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'bonkers.db')
+        self.snapshots = TopScoreSnapshots(self.path)
+        self.top = [score('1', '2021-01-01 00:00:00'), score('2', '2021-01-02 00:00:00')]
+
+    def test_first_snapshot_only_counts_recent_scores(self):
+        recent = score('3', (dt.datetime.utcnow() - dt.timedelta(minutes=1)).strftime(osu.DATE_FORMAT))
+        self.assertEqual(self.snapshots.new_scores('10', [*self.top, recent]), [recent])
+
+    def test_new_scores_are_unknown_and_not_older_than_watermark(self):
+        self.snapshots.save('10', self.top)
+        played = score('3', '2021-01-03 00:00:00')
+        # e.g. a pp rework moving an old score into the top 100
+        reshuffled = score('4', '2020-12-31 00:00:00')
+        self.assertEqual(self.snapshots.new_scores('10', [*self.top, played, reshuffled]), [played])
+
+    def test_held_scores_are_not_new_until_released(self):
+        self.snapshots.save('10', self.top)
+        played = score('3', '2021-01-03 00:00:00')
+        self.snapshots.hold('10', [played])
+        self.assertTrue(self.snapshots.holding('10'))
+        self.assertEqual(self.snapshots.new_scores('10', [*self.top, played]), [])
+        # delivery failed, the score is found again
+        self.snapshots.release('10', [played])
+        self.assertFalse(self.snapshots.holding('10'))
+        self.assertEqual(self.snapshots.new_scores('10', [*self.top, played]), [played])
+
+    def test_watermark_never_moves_back(self):
+        self.snapshots.save('10', self.top)
+        self.snapshots.save('10', self.top[:1])
+        self.assertEqual(self.snapshots.get('10'), ({'1'}, '2021-01-02 00:00:00'))
+
+    def test_snapshots_persist(self):
+        self.snapshots.save('10', self.top)
+        self.assertEqual(TopScoreSnapshots(self.path).get('10'), ({'1', '2'}, '2021-01-02 00:00:00'))
+
+    def test_scopes_are_separate(self):
+        self.snapshots.save('10', self.top)
+        self.assertIsNone(TopScoreSnapshots(self.path, scope='shards-1').get('10'))
+
+
+if __name__ == '__main__':
+    unittest.main()
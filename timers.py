@@ -0,0 +1,102 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import time
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+logger = logging.getLogger('discord')
+
+
+class DeferredAction:
+    def __init__(self, owner: 'DeferredActions', when: float, callback: Callable[..., Any], args: Tuple[Any, ...], kwargs: dict):
+        self.owner = owner
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self) -> None:
+        if not self.cancelled and not self.done:
+            self.cancelled = True
+            self.owner._cancelled()
+
+
+class DeferredActions:
+    '''
+        Runs delayed actions (message edits, reaction cleanup, pagination timeouts) off a single heap with one
+        event loop timer armed for the earliest action, instead of a sleeping task per action. Callbacks can be plain
+        functions or coroutine functions, coroutines only get a task once they're due
+    '''
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, DeferredAction]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timerWhen: Optional[float] = None
+        self._running: Set['asyncio.Future[Any]'] = set()
+        self._cancelledCount = 0
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._cancelledCount
+
+    def _cancelled(self) -> None:
+        self._cancelledCount += 1
+        # cancelled actions are skipped lazily, rebuild the heap once they make up most of it
+        if self._cancelledCount > 64 and self._cancelledCount * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelledCount = 0
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args: Any, **kwargs: Any) -> DeferredAction:
+        action = DeferredAction(self, time.monotonic() + delay, callback, args, kwargs)
+        heapq.heappush(self._heap, (action.when, next(self._counter), action))
+        if self._timerWhen is None or action.when < self._timerWhen:
+            self._arm()
+        return action
+
+    def _arm(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timerWhen = None
+        # drop cancelled actions from the front so they don't wake us up
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+            self._cancelledCount -= 1
+        if not self._heap:
+            return
+        when = self._heap[0][0]
+        loop = asyncio.get_event_loop()
+        self._timer = loop.call_at(loop.time() + max(when - time.monotonic(), 0), self._fire)
+        self._timerWhen = when
+
+    def _fire(self) -> None:
+        self._timer = self._timerWhen = None
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, action = heapq.heappop(self._heap)
+            if action.cancelled:
+                self._cancelledCount -= 1
+            else:
+                self._run(action)
+        self._arm()
+
+    def _run(self, action: DeferredAction) -> None:
+        action.done = True
+        try:
+            result = action.callback(*action.args, **action.kwargs)
+        except Exception as e:
+            logger.error(f'Deferred action {action.callback} failed: {e}')
+            return
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._running.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task: 'asyncio.Future[Any]') -> None:
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f'Deferred action failed: {task.exception()}')